@@ -20,13 +20,14 @@ import os
 # from ragas.embeddings import HuggingfaceEmbeddings
 
 from datasets import Dataset
-from typing import Union, Any, List, Dict
+from typing import Union, Any, List, Dict, Tuple
 from rouge_score import rouge_scorer
 from tqdm import tqdm
 from sentence_transformers import SentenceTransformer
 
 from data import Document
-from retrieval.Chunker import Chunker
+from retrieval.Chunker import Chunker, Chunk
+from retrieval.Chunker.SectionChunker import SectionChunker
 from retrieval.Ranker import Ranker
 from qa import QA
 from retrieval.Ranker.GuessSimilarityRanker import GuessSimilarityRanker
@@ -120,6 +121,42 @@ def evaluate_answer_similarity(answers: List[str], ground_truths: List[str]) ->
     return all_distances
 
 
+def ground_truth_mask(chunks: List[Union[str, Chunk]], ground_truths: List[str]) -> np.ndarray:
+    """
+    Finds the chunks containing a ground truth.
+
+    :param chunks: The chunks
+    :type chunks: list[Union[str, Chunk]]
+    :param ground_truths: The ground truths of a question
+    :type ground_truths: list[str]
+
+    :return: Whether each chunk contains any of the ground truths
+    """
+    return np.fromiter((any(ground_truth in chunk for ground_truth in ground_truths) for chunk in chunks), dtype=bool, count=len(chunks))
+
+
+def ground_rank_of(found: np.ndarray, distances: np.ndarray) -> Tuple[float, float]:
+    """
+    Normalises the rank and the distance of the first ranked chunk containing the ground truth.
+
+    :param found: Whether each ranked chunk contains the ground truth, in ranked order
+    :type found: np.ndarray
+    :param distances: The similarity of each ranked chunk, in ranked order
+    :type distances: np.ndarray
+
+    :return: The rank divided by the number of chunks, and the distance min-max normalised over all chunks, -1 before normalising if no chunk contains the ground truth
+    """
+    ground_rank, ground_distance = -1, -1.0
+    if found.any():
+        ground_rank = int(found.argmax())
+        ground_distance = float(distances[ground_rank])
+    lowest, highest = distances.min(), distances.max()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ground_distance = float(np.float64(ground_distance - lowest) / np.float64(highest - lowest))
+    # replace NaNs with 0
+    return ground_rank / len(distances), 0 if np.isnan(ground_distance) else ground_distance
+
+
 class Experiment:
     """Experiment class for running experiments on a dataset with a given pipeline or set of pipelines."""
     def __init__(
@@ -130,7 +167,10 @@ class Experiment:
             chunker: Union[Chunker, List[Chunker]],
             ranker: Union[Ranker, List[Ranker]],
             qa: Union[QA, List[QA]],
-            autoload: bool = True
+            autoload: bool = True,
+            offset_chunks: bool = False,
+            index_cache: str = None,
+            corpus_index: bool = False
     ):
         """
         :param name: The name of the experiment
@@ -145,6 +185,13 @@ class Experiment:
         :type ranker: Union[Ranker, list[Ranker]]
         :param qa: The QA model or models to use
         :type qa: Union[QA, list[QA]]
+        :param offset_chunks: Whether to pass offset-based `Chunk` objects instead of copied strings to the rankers, defaults to False
+        :type offset_chunks: bool, optional
+        :param index_cache: A directory to save initialised rankers to and load them from on later runs, defaults to None - rankers are always initialised from scratch
+        :type index_cache: str, optional
+        :param corpus_index: Whether to initialise rankers that support it once per chunker with the chunks of every document, and select the document to rank per question, defaults to False.
+            Their results are stored under the ranker name with a "_corpus" suffix, since e.g. TF-IDF scores depend on the other documents.
+        :type corpus_index: bool, optional
         """
         self.evaluation = None
         self.name = name
@@ -158,6 +205,9 @@ class Experiment:
         self.qa = qa
 
         self.autoload = autoload
+        self.offset_chunks = offset_chunks
+        self.index_cache = index_cache
+        self.corpus_index = corpus_index
 
         if not isinstance(self.dataset, list):
             self.dataset = [self.dataset]
@@ -173,6 +223,7 @@ class Experiment:
 
         self.results = None
         self.verbose = False
+        self.chunks: Dict[str, Dict[str, list]] = {}
 
     def r(self, function, text, times, silenced=True, **kwargs):
         if self.verbose and not silenced:
@@ -188,12 +239,93 @@ class Experiment:
 
         return result
 
-    def run(self, get_ground_ranks: bool = False) -> Dict[str, Dict[Any, Any]]:
+    def prechunk(self, workers: int = None, times: Dict[str, List[float]] = None) -> Dict[str, Dict[str, list]]:
+        """
+        Chunks every document of the dataset with every chunker before any ranking happens.
+
+        :param workers: The number of worker processes used by each chunker, defaults to None - chunks in the current process
+        :type workers: int, optional
+        :param times: The times dict to record the chunking time in, defaults to None
+        :type times: dict[str, list[float]], optional
+
+        :return: The chunks, by chunker name and dataset name
+        :rtype: dict[str, dict[str, list]]
+        """
+        if times is None:
+            times = {}
+
+        documents = [dataset.document for dataset in self.dataset]
+        for chunker in self.chunker:
+            chunked = self.r(chunker.chunk_many, f"Chunking with {chunker.name}", times,
+                             documents=documents, workers=workers, spans=self.offset_chunks)
+            if self.offset_chunks:
+                chunked = [[Chunk(dataset.document, start, end, dataset.name) for start, end in spans]
+                           for dataset, spans in zip(self.dataset, chunked)]
+            self.chunks[chunker.name] = {dataset.name: chunks for dataset, chunks in zip(self.dataset, chunked)}
+
+        return self.chunks
+
+    def in_corpus(self, ranker: Ranker, chunker: Chunker, dataset: Document) -> bool:
+        """
+        Checks whether a ranker ranks the chunks of a dataset from a corpus index in this experiment.
+        Documents split into sections by a SectionChunker are left out, and ranked document by document.
+        """
+        return (self.corpus_index and type(ranker).init_corpus is not Ranker.init_corpus
+                and not (isinstance(chunker, SectionChunker) and hasattr(dataset, "paragraphs")))
+
+    def result_variants(self, ranker: Ranker, chunker: Chunker, dataset: Document) -> Dict[str, str]:
+        """
+        Gets the names the results of each variant of a ranker are stored under, with a "_corpus" suffix for corpus indexes.
+        """
+        suffix = "_corpus" if self.in_corpus(ranker, chunker, dataset) else ""
+        return {variant: f"{variant}{suffix}" for variant in ranker.variants()}
+
+    def init_corpora(self, chunker: Chunker, workers: int = None, times: Dict[str, List[float]] = None, rankers: List[Ranker] = None) -> Dict[str, set]:
+        """
+        Initialises every ranker that supports `init_corpus` with one index over the chunks of all documents of a chunker.
+
+        Documents are keyed by dataset name. Each chunker gets its own index, so the scores of a ranker do not depend on
+        which other chunkers are part of the sweep.
+
+        :param chunker: The chunker whose chunks are indexed
+        :type chunker: Chunker
+        :param workers: The number of worker processes used to chunk the documents, defaults to None - chunks in the current process
+        :type workers: int, optional
+        :param times: The times dict to record the initialisation time in, defaults to None
+        :type times: dict[str, list[float]], optional
+        :param rankers: The rankers to initialise, defaults to None - all rankers of the experiment
+        :type rankers: list[Ranker], optional
+
+        :return: The ids of the documents in the index of each ranker, by ranker name
+        :rtype: dict[str, set]
+        """
+        if times is None:
+            times = {}
+
+        if not all(other.name in self.chunks for other in self.chunker):
+            self.prechunk(workers=workers, times=times)
+
+        corpora = {}
+        for ranker in self.ranker if rankers is None else rankers:
+            documents = {dataset.name: self.chunks[chunker.name][dataset.name]
+                         for dataset in self.dataset if self.in_corpus(ranker, chunker, dataset)}
+            if not documents:
+                continue
+            self.r(ranker.init_corpus, f"Initialising ranker {ranker.name} with the corpus of {chunker.name}", times, documents=documents)
+            corpora[ranker.name] = set(documents)
+        return corpora
+
+    def run(self, get_ground_ranks: bool = False, prechunk_workers: int = None) -> Dict[str, Dict[Any, Any]]:
         """
         Runs the experiment(s).
 
         If chunker, ranker, or qa is a list, the experiment runs all combinations of chunkers, rankers, and qa models.
 
+        :param get_ground_ranks: Whether to record the rank of the first chunk containing the ground truth, defaults to False
+        :type get_ground_ranks: bool, optional
+        :param prechunk_workers: If given, all documents are chunked up front by this many worker processes, defaults to None
+        :type prechunk_workers: int, optional
+
         :return: The results of the experiment
         :rtype: dict[str, list[dict[str, str]]]
         """
@@ -211,7 +343,7 @@ class Experiment:
                 print("No results found, running experiment")
 
         start_time = time.time()
-        total_num_of_results = len(self.qa) * len(self.chunker) * len(self.ranker) * sum([len(dataset.questions) for dataset in self.dataset])
+        total_num_of_results = len(self.qa) * len(self.chunker) * sum(len(ranker.variants()) for ranker in self.ranker) * sum([len(dataset.questions) for dataset in self.dataset])
         num_of_processed_results = 0
         num_of_initial_results = 0
         for result in results.values():
@@ -220,85 +352,133 @@ class Experiment:
 
         total_remaining_results = total_num_of_results - num_of_initial_results
 
-        for dataset in self.dataset:
+        if prechunk_workers is not None:
+            self.prechunk(workers=prechunk_workers, times=times)
+
+        # corpus indexes are built per chunker, so the datasets are then run chunker by chunker
+        if self.corpus_index:
+            passes = [(dataset, [chunker]) for chunker in self.chunker for dataset in self.dataset]
+        else:
+            passes = [(dataset, self.chunker) for dataset in self.dataset]
+
+        # the chunker whose corpus each ranker holds an index of, by ranker name
+        corpus_chunkers: Dict[str, str] = {}
+        for dataset, chunkers in passes:
             paragraphs = None
             if hasattr(dataset, "paragraphs"):
                 paragraphs = dataset.paragraphs
-            for chunker in self.chunker:
-                if isinstance(self.results, dict) and all(result_setup in self.results for result_setup in [f"{chunker.name}_{ranker.name}_{qa.name}_{dataset.name}" for ranker in self.ranker for qa in self.qa]):
+            for chunker in chunkers:
+                if isinstance(self.results, dict) and all(result_setup in self.results for result_setup in [f"{chunker.name}_{variant}_{qa.name}_{dataset.name}" for ranker in self.ranker for variant in self.result_variants(ranker, chunker, dataset).values() for qa in self.qa]):
                     print(f"Results for {dataset.name}, {chunker.name} already found, skipping")
                     continue
-                chunks = self.r(chunker.chunk, f"Chunking with {chunker.name}", times, document=dataset.document)
-
+                sections = None
+                if isinstance(chunker, SectionChunker) and paragraphs is not None:
+                    chunks, sections = self.r(chunker.chunk_sections, f"Chunking with {chunker.name}", times, sections=paragraphs)
+                elif dataset.name in self.chunks.get(chunker.name, {}):
+                    chunks = self.chunks[chunker.name][dataset.name]
+                elif self.offset_chunks:
+                    chunks = self.r(chunker.chunk_objects, f"Chunking with {chunker.name}", times, document=dataset.document, doc_id=dataset.name)
+                else:
+                    chunks = self.r(chunker.chunk, f"Chunking with {chunker.name}", times, document=dataset.document)
+
+                # which chunks contain the ground truth of each question, shared by the rankers ranking these chunks
+                ground_truth_masks: Dict[str, np.ndarray] = {}
                 for ranker in self.ranker:
-                    if isinstance(self.results, dict) and all(result_setup in self.results for result_setup in [f"{chunker.name}_{ranker.name}_{qa.name}_{dataset.name}" for qa in self.qa]):
+                    # rankers sweeping a parameter produce the results of several virtual rankers, one per variant
+                    variants = ranker.variants()
+                    # the name the results of each variant are stored under
+                    labels = self.result_variants(ranker, chunker, dataset)
+                    if isinstance(self.results, dict) and all(result_setup in self.results for result_setup in [f"{chunker.name}_{labels[variant]}_{qa.name}_{dataset.name}" for variant in variants for qa in self.qa]):
                         print(f"Results for {dataset.name}, {chunker.name}, {ranker.name} already found, skipping")
                         continue
                     if isinstance(ranker, PromptRanker) and hasattr(dataset, "paragraphs"):
                         self.r(ranker.init_chunks, f"Initialising ranker {ranker.name} with chunks", times,
-                               chunks=chunks, paragraphs=paragraphs)
+                               chunks=chunks, paragraphs=paragraphs, sections=sections)
+                    elif self.in_corpus(ranker, chunker, dataset):
+                        if corpus_chunkers.get(ranker.name) != chunker.name:
+                            self.init_corpora(chunker, workers=prechunk_workers, times=times, rankers=[ranker])
+                            corpus_chunkers[ranker.name] = chunker.name
+                        ranker.select_document(dataset.name)
                     else:
-                        self.r(ranker.init_chunks, f"Initialising ranker {ranker.name} with chunks", times, chunks=chunks)
+                        corpus_chunkers.pop(ranker.name, None)
+                        self.r(ranker.init_document, f"Initialising ranker {ranker.name} with chunks", times,
+                               document=dataset.document, chunker=chunker, chunks=chunks, cache_dir=self.index_cache)
 
-                    results.update({f"{chunker.name}_{ranker.name}_{qa.name}_{dataset.name}": [] for qa in self.qa})
+                    results.update({f"{chunker.name}_{labels[variant]}_{qa.name}_{dataset.name}": [] for variant in variants for qa in self.qa})
                     if num_of_processed_results > 0:
                         # calculate time left estimate
                         time_left = (total_remaining_results - num_of_processed_results) * (time.time() - start_time) / num_of_processed_results
                         print(f"{datetime.now().strftime('%H:%M:%S')}: Estimated time left: {time.strftime('%d, %H:%M:%S', time.gmtime(time_left))}")
                     for question in tqdm(dataset.questions, desc=f"Running experiment on {dataset.name} with {chunker.name} and {ranker.name}"):
-                        guesses = None
-                        ground_rank = -1
-                        ground_distance = -1
+                        guessing = isinstance(ranker, GuessSimilarityRanker) or isinstance(ranker, PromptRanker)
                         if not get_ground_ranks:
-                            contexts = self.r(ranker.rank, f"Ranking question with ranker {ranker.name}", times, query=question["question"], silenced=True)
-                            if isinstance(ranker, GuessSimilarityRanker) or isinstance(ranker, PromptRanker):
-                                contexts, guesses = contexts
+                            rankings = self.r(ranker.rank_variants, f"Ranking question with ranker {ranker.name}", times, query=question["question"], silenced=True)
+                        elif guessing:
+                            rankings = self.r(ranker.rank_variants, f"Ranking question with ranker {ranker.name}", times, query=question["question"], silenced=True, return_similarities=True)
                         else:
-                            contexts = self.r(ranker.rank, f"Ranking question with ranker {ranker.name}", times, query=question["question"], silenced=True, return_similarities=True)
-                            if isinstance(ranker, GuessSimilarityRanker) or isinstance(ranker, PromptRanker):
-                                contexts, guesses = contexts
+                            # the scores stay aligned with the chunks, and only the top-k chunks are listed
+                            variant_scores = self.r(ranker.score_variants, f"Ranking question with ranker {ranker.name}", times, query=question["question"], silenced=True)
+                            if len(ranker.chunks) != len(chunks):
+                                mask = ground_truth_mask(ranker.chunks, question["ground_truths"])
+                            else:
+                                if question["question"] not in ground_truth_masks:
+                                    ground_truth_masks[question["question"]] = ground_truth_mask(ranker.chunks, question["ground_truths"])
+                                mask = ground_truth_masks[question["question"]]
+
+                        for variant in variants:
+                            guesses = None
                             ground_rank = -1
                             ground_distance = -1
-                            for i, context in enumerate(contexts):
-                                chunk, distance = context
-                                if any(ground_truth in chunk for ground_truth in question["ground_truths"]):
-                                    ground_rank = i
-                                    ground_distance = float(distance)
-                                    break
-
-                            # normalise ground rank
-                            ground_rank /= len(contexts)
-                            # normalise ground distance
-                            ground_distance = (ground_distance - min([distance for _, distance in contexts])) / (max([distance for _, distance in contexts]) - min([distance for _, distance in contexts]))
-                            # replace NaNs with 0
-                            ground_distance = 0 if np.isnan(ground_distance) else ground_distance
-                            contexts = [context[0] for context in contexts[:ranker.top_k]]
-
-                        for qa in self.qa:
-
-                            # if the question does not already have an answer in results, predict one
-                            if not any(result["question"] == question["question"] for result in results[f"{chunker.name}_{ranker.name}_{qa.name}_{dataset.name}"]):
-                                answer = self.r(qa.predict, f"Generating response with {qa.name}", times, question=question["question"], chunks=contexts, silenced=True)
-
-                                result = {
-                                    "question": question["question"],
-                                    "answer": answer,
-                                    "ground_truths": question["ground_truths"],
-                                    "contexts": contexts
-                                }
-                                if isinstance(ranker, GuessSimilarityRanker) or isinstance(ranker, PromptRanker):
-                                    result["guesses"] = guesses
-                                if get_ground_ranks:
-                                    result["ground_rank"] = ground_rank
-                                    result["ground_distance"] = ground_distance
-
-                                results[f"{chunker.name}_{ranker.name}_{qa.name}_{dataset.name}"].append(result)
-                                num_of_processed_results += 1
+                            if not get_ground_ranks:
+                                contexts = rankings[variant]
+                                if guessing:
+                                    contexts, guesses = contexts
                             else:
-                                # if self.verbose:
-                                print(f"Question {question['question']} already answered")
-                            results["times"] = times
-                            self.results = results
+                                if guessing:
+                                    contexts, guesses = rankings[variant]
+                                    distances = np.array([float(distance) for _, distance in contexts])
+                                    contexts = [context for context, _ in contexts]
+                                    found = ground_truth_mask(contexts, question["ground_truths"])
+                                else:
+                                    scores = variant_scores[variant]
+                                    order = np.argsort(-scores, kind="stable")
+                                    distances, found = scores[order], mask[order]
+                                    contexts = [ranker.chunks[i] for i in order[:ranker.top_k]]
+                                ground_rank, ground_distance = ground_rank_of(found, distances)
+                                contexts = contexts[:ranker.top_k]
+
+                            # Chunk objects are materialized only for the contexts that are passed on
+                            contexts = [str(context) for context in contexts]
+
+                            for qa in self.qa:
+
+                                # if the question does not already have an answer in results, predict one
+                                if not any(result["question"] == question["question"] for result in results[f"{chunker.name}_{labels[variant]}_{qa.name}_{dataset.name}"]):
+                                    answer = self.r(qa.predict, f"Generating response with {qa.name}", times, question=question["question"], chunks=contexts, silenced=True)
+
+                                    result = {
+                                        "question": question["question"],
+                                        "answer": answer,
+                                        "ground_truths": question["ground_truths"],
+                                        "contexts": contexts
+                                    }
+                                    if guessing:
+                                        result["guesses"] = guesses
+                                    if get_ground_ranks:
+                                        result["ground_rank"] = ground_rank
+                                        result["ground_distance"] = ground_distance
+
+                                    results[f"{chunker.name}_{labels[variant]}_{qa.name}_{dataset.name}"].append(result)
+                                    num_of_processed_results += 1
+                                else:
+                                    # if self.verbose:
+                                    print(f"Question {question['question']} already answered")
+                                results["times"] = times
+                                self.results = results
+
+                    # counters such as cache hits are recorded next to the timings
+                    for stat, value in ranker.pop_stats().items():
+                        times.setdefault(f"{stat} of ranker {ranker.name}", []).append(value)
 
                 self.save_results()
 
@@ -15,7 +15,7 @@ def answer_single_question(
         chunker: Chunker = CharChunker(chunk_length=100, sliding_window_size=0.0),
         ranker: Ranker = TfidfRanker(top_k=5),
         qa: QA = MistralQA("default"),
-
+        cache_dir: str = None,
 ):
     """
     Answers a single question with a given chunker, ranker and qa.
@@ -31,6 +31,8 @@ def answer_single_question(
     :type ranker: Ranker, optional
     :param qa: The qa model to use, defaults to MistralQA("default")
     :type qa: QA, optional
+    :param cache_dir: A directory to save the initialised ranker to and load it from when the same chunks are ranked again, defaults to None
+    :type cache_dir: str, optional
 
     :return: The answer
     """
@@ -42,7 +44,10 @@ def answer_single_question(
     chunks = chunker.chunk(document=dataset.document)
 
     # init ranker
-    ranker.init_chunks(chunks=chunks)
+    if cache_dir is None:
+        ranker.init_chunks(chunks=chunks)
+    else:
+        ranker.init_chunks_cached(chunks=chunks, cache_dir=cache_dir)
 
     # get ranked chunks
     chunks = ranker.rank(query=question)
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Iterator, Union, IO, Tuple
 
 from retrieval.Chunker import Chunker
 
@@ -22,3 +22,27 @@ class CharChunker(Chunker):
                     len(document),
                     self.chunk_length - int(self.chunk_length * self.sliding_window_size)
                 )]
+
+    def chunk_spans(self, document: str) -> List[Tuple[int, int]]:
+        return self.windows(len(document))
+
+    def iter_chunks(self, document: Union[str, IO]) -> Iterator[str]:
+        # the buffer only ever holds the unread part of the current window and one block
+        buffer = ''
+        emitted = False
+        for block in self.read_blocks(document):
+            buffer += block
+            start = 0
+            while start + self.chunk_length <= len(buffer):
+                yield buffer[start:start + self.chunk_length]
+                emitted = True
+                start += self.step
+            buffer = buffer[start:]
+
+        if not emitted:
+            # documents shorter than one chunk are returned whole
+            yield buffer
+            return
+
+        for start in range(0, len(buffer), self.step):
+            yield buffer[start:start + self.chunk_length]
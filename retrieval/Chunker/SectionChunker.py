@@ -0,0 +1,41 @@
+from typing import List, Dict, Tuple
+
+from retrieval.Chunker import Chunker
+
+
+class SectionChunker(Chunker):
+    def __init__(self, chunker: Chunker, name: str = None):
+        """
+        :param chunker: The chunker used to chunk each section
+        :type chunker: Chunker
+        :param name: The name of the chunker, defaults to None - uses the class name and the name of the inner chunker
+        :type name: str, optional
+        """
+        super().__init__(chunker.chunk_length, chunker.sliding_window_size, name)
+        if name is None:
+            self.name = f"Section{chunker.name}"
+        self.chunker = chunker
+
+    def chunk(self, document: str) -> List[str]:
+        # without section boundaries the document is chunked as a whole
+        return self.chunker.chunk(document)
+
+    def chunk_spans(self, document: str) -> List[Tuple[int, int]]:
+        return self.chunker.chunk_spans(document)
+
+    def chunk_sections(self, sections: Dict[str, str]) -> Tuple[List[str], Dict[str, List[int]]]:
+        """
+        Chunks every section separately, so that no chunk crosses a section boundary.
+
+        :param sections: The text of each section, by section name, in document order
+        :type sections: dict[str, str]
+
+        :return: The chunks of all sections, and the indices of the chunks of each section
+        """
+        chunks = []
+        section_index = {}
+        for section, text in sections.items():
+            section_chunks = self.chunker.chunk(text)
+            section_index[section] = list(range(len(chunks), len(chunks) + len(section_chunks)))
+            chunks.extend(section_chunks)
+        return chunks, section_index
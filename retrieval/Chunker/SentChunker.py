@@ -1,7 +1,9 @@
 import nltk
-from typing import List
+from typing import List, Iterable, Iterator, Union, IO, Tuple
 
-from retrieval.Chunker import Chunker
+from retrieval.Chunker import Chunker, align_spans
+from retrieval.Chunker.SentenceSplitter import RegexSentenceSplitter
+from retrieval.Chunker.TokenizationCache import TokenizationCache, default_tokenization_cache
 
 # if needed, download the punkt tokenizer
 try:
@@ -10,18 +12,77 @@ except LookupError:
     nltk.download('punkt')
 
 
+def iter_sentences(blocks: Iterable[str], max_length: int = 4 * Chunker.block_size) -> Iterator[str]:
+    """
+    Splits a stream of text blocks into sentences with the punkt tokenizer.
+
+    The last, possibly unfinished sentence of each block is carried over to the next block,
+    so only the current block and one partial sentence are kept in memory.
+    A partial sentence longer than max_length characters, e.g. in text without punctuation, is emitted up to its last
+    whitespace, so memory stays bounded and every block is tokenized a bounded number of times.
+
+    :param blocks: The blocks of the document, in order
+    :type blocks: Iterable[str]
+    :param max_length: The longest partial sentence carried over, in characters, defaults to four blocks of a Chunker
+    :type max_length: int, optional
+
+    :return: The sentences, as nltk.sent_tokenize would return them for the whole document, unless a sentence is longer than max_length
+    """
+    buffer = ''
+    for block in blocks:
+        buffer += block
+        sentences = nltk.sent_tokenize(buffer)
+        if len(sentences) >= 2:
+            yield from sentences[:-1]
+            buffer = buffer[buffer.rfind(sentences[-1]):]
+        if len(buffer) > max_length:
+            # words are not split, unless the partial sentence is a single word
+            cut = max(buffer.rfind(' '), buffer.rfind('\n'))
+            cut = cut if cut > 0 else len(buffer)
+            yield from nltk.sent_tokenize(buffer[:cut])
+            buffer = buffer[cut:]
+    yield from nltk.sent_tokenize(buffer)
+
+
 class SentChunker(Chunker):
-    def __init__(self, chunk_length: int, sliding_window_size: float = 0.0, name: str = None):
+    def __init__(self, chunk_length: int, sliding_window_size: float = 0.0, name: str = None,
+                 cache: TokenizationCache = default_tokenization_cache, splitter: RegexSentenceSplitter = None):
         """
         :param chunk_length: The length of the chunks, measured in sentences.
         :type chunk_length: int
         :param sliding_window_size: The size of the sliding window. Defines the overlap between chunks, rounded down. Must be between 0.0 and 1.0, defaults to 0.0.
         :type sliding_window_size: float, optional
+        :param cache: The cache of tokenized documents, defaults to the cache shared by all chunkers
+        :type cache: TokenizationCache, optional
+        :param splitter: A sentence splitter returning (start, end) offsets, defaults to None - uses nltk punkt. With a splitter, chunks are sliced from the document instead of joining their sentences with spaces.
+        :type splitter: RegexSentenceSplitter, optional
         """
         super().__init__(chunk_length, sliding_window_size, name)
+        if name is None and splitter is not None:
+            self.name += f"_{splitter.name}"
+        self.cache = cache
+        self.splitter = splitter
+
+    @property
+    def splitter_name(self) -> str:
+        # the sentences of a document depend on the splitter, so rankers indexing sentences are keyed on it
+        return self.splitter.name if self.splitter is not None else 'punkt'
+
+    def sentences(self, document: str) -> List[str]:
+        if self.splitter is not None:
+            return [document[start:end] for start, end in self.sentence_spans(document)]
+        return self.cache.get(document, 'sent_tokenize', nltk.sent_tokenize)
+
+    def sentence_spans(self, document: str) -> List[Tuple[int, int]]:
+        if self.splitter is not None:
+            return self.cache.get(document, f'{self.splitter.name}_spans', self.splitter.span_tokenize)
+        return self.cache.get(document, 'sent_tokenize_spans', lambda text: align_spans(self.sentences(text), text))
 
     def chunk(self, document: str) -> List[str]:
-        sentences = nltk.sent_tokenize(document)
+        if self.splitter is not None:
+            return [document[start:end] for start, end in self.chunk_spans(document)]
+
+        sentences = self.sentences(document)
 
         if len(sentences) < self.chunk_length:
             return [' '.join(sentences)]
@@ -32,3 +93,15 @@ class SentChunker(Chunker):
                     len(sentences),
                     self.chunk_length - int(self.chunk_length * self.sliding_window_size)
                 )]
+
+    def chunk_spans(self, document: str) -> List[Tuple[int, int]]:
+        spans = self.sentence_spans(document)
+        if len(spans) == 0:
+            return [(0, 0)]
+        return [(spans[first][0], spans[last - 1][1]) for first, last in self.windows(len(spans))]
+
+    def iter_chunks(self, document: Union[str, IO]) -> Iterator[str]:
+        if self.splitter is not None:
+            # chunks are slices of the document, so it is read as a whole
+            return super().iter_chunks(document)
+        return self.iter_windows(iter_sentences(self.read_blocks(document)))
@@ -0,0 +1,78 @@
+import re
+from typing import List, Tuple
+
+
+class RegexSentenceSplitter:
+    """
+    A rule-based sentence splitter built on one compiled regular expression.
+
+    Unlike nltk.sent_tokenize it returns the (start, end) offsets of the sentences, so chunks can be sliced from the
+    original text, and it is several times faster on long documents.
+
+    A sentence ends at a run of '.', '!' or '?' (and any closing quotes or brackets) that is followed by whitespace and
+    an uppercase letter, digit or opening quote, unless the word before it is a known abbreviation or an initial.
+    Blank lines always end a sentence.
+    """
+    name = 'regex'
+
+    abbreviations = {
+        'mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st', 'mt', 'vs', 'etc', 'e.g', 'i.e', 'cf', 'al', 'fig', 'figs',
+        'eq', 'eqs', 'sec', 'no', 'vol', 'pp', 'approx', 'inc', 'ltd', 'co', 'corp', 'gen', 'gov', 'sen', 'rep', 'rev',
+        'jan', 'feb', 'mar', 'apr', 'jun', 'jul', 'aug', 'sep', 'sept', 'oct', 'nov', 'dec', 'u.s', 'u.k', 'u.n',
+    }
+
+    boundary = re.compile(
+        r'(?P<end>[.!?…]+["\'”’)\]]*)\s+(?=["\'“‘(\[]?[A-Z0-9])'
+        r'|(?P<paragraph>\n[ \t]*\n)\s*'
+    )
+    word_before = re.compile(r'(\S+)$')
+
+    def is_abbreviation(self, text: str, position: int) -> bool:
+        """
+        Checks whether the period at the given position closes an abbreviation or an initial.
+
+        :param text: The text
+        :type text: str
+        :param position: The offset of the period
+        :type position: int
+
+        :return: Whether the period does not end a sentence
+        """
+        match = self.word_before.search(text, max(0, position - 20), position)
+        if match is None:
+            return False
+        word = match.group(1).lstrip('"\'(“‘[')
+        # single letters are initials, e.g. "J. R. R. Tolkien"
+        return len(word) == 1 and word.isalpha() or word.lower() in self.abbreviations
+
+    def span_tokenize(self, text: str) -> List[Tuple[int, int]]:
+        """
+        Splits a text into sentences.
+
+        :param text: The text
+        :type text: str
+
+        :return: The (start, end) offsets of the sentences, without surrounding whitespace
+        """
+        spans = []
+        start = len(text) - len(text.lstrip())
+        for match in self.boundary.finditer(text):
+            if match.group('end') is not None:
+                if match.group('end') == '.' and self.is_abbreviation(text, match.start()):
+                    continue
+                end = match.end('end')
+            else:
+                end = match.start('paragraph')
+                while end > start and text[end - 1].isspace():
+                    end -= 1
+            if end > start:
+                spans.append((start, end))
+            start = match.end()
+
+        end = len(text.rstrip())
+        if end > start:
+            spans.append((start, end))
+        return spans
+
+    def tokenize(self, text: str) -> List[str]:
+        return [text[start:end] for start, end in self.span_tokenize(text)]
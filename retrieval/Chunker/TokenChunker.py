@@ -0,0 +1,141 @@
+import itertools
+import re
+
+import nltk
+from typing import List, Tuple, Union, Any
+
+from retrieval.Chunker import Chunker, align_spans
+from retrieval.Chunker.TokenizationCache import TokenizationCache, default_tokenization_cache
+
+# if needed, download the punkt tokenizer
+try:
+    nltk.data.find('tokenizers/punkt')
+except LookupError:
+    nltk.download('punkt')
+
+
+class TokenChunker(Chunker):
+    def __init__(
+            self,
+            chunk_length: int,
+            sliding_window_size: float = 0.0,
+            name: str = None,
+            tokenizer: Union[str, Any] = 'cross-encoder/ms-marco-MiniLM-L-6-v2',
+            cache: TokenizationCache = default_tokenization_cache
+    ):
+        """
+        :param chunk_length: The token budget of the chunks, measured in model tokens without special tokens.
+        :type chunk_length: int
+        :param sliding_window_size: The size of the sliding window. Defines the overlap between chunks, measured in tokens and rounded down to whole sentences. Must be between 0.0 and 1.0, defaults to 0.0.
+        :type sliding_window_size: float, optional
+        :param tokenizer: The tokenizer of the ranking model, or its name on the HuggingFace hub, defaults to the tokenizer of CrossEncodingRanker
+        :type tokenizer: Union[str, PreTrainedTokenizer], optional
+        :param cache: The cache of tokenized documents, defaults to the cache shared by all chunkers
+        :type cache: TokenizationCache, optional
+        """
+        super().__init__(chunk_length, sliding_window_size, name)
+        self.tokenizer_name = tokenizer if isinstance(tokenizer, str) else getattr(tokenizer, 'name_or_path', tokenizer.__class__.__name__)
+        if isinstance(tokenizer, str):
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(tokenizer)
+        self.tokenizer = tokenizer
+        self.cache = cache
+
+    @classmethod
+    def for_model(cls, tokenizer: Union[str, Any], sliding_window_size: float = 0.0, max_length: int = None,
+                  reserved_tokens: int = 64, **kwargs) -> "TokenChunker":
+        """
+        Creates a chunker whose chunks fill the model's maximum sequence length.
+
+        :param tokenizer: The tokenizer of the ranking model, or its name on the HuggingFace hub
+        :type tokenizer: Union[str, PreTrainedTokenizer]
+        :param sliding_window_size: The size of the sliding window, defaults to 0.0
+        :type sliding_window_size: float, optional
+        :param max_length: The maximum sequence length of the model, defaults to None - uses the tokenizer's model_max_length
+        :type max_length: int, optional
+        :param reserved_tokens: Tokens kept free for the query and special tokens, defaults to 64
+        :type reserved_tokens: int, optional
+
+        :return: The chunker
+        """
+        chunker = cls(1, sliding_window_size, tokenizer=tokenizer, **kwargs)
+        if max_length is None:
+            max_length = chunker.tokenizer.model_max_length
+        chunker.chunk_length = max_length - reserved_tokens
+        if 'name' not in kwargs:
+            chunker.name = cls.__name__ + f"_{chunker.chunk_length}_{sliding_window_size}"
+        return chunker
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        if len(texts) == 0:
+            return []
+        return [len(ids) for ids in self.tokenizer(texts, add_special_tokens=False)['input_ids']]
+
+    def units(self, document: str) -> Tuple[List[Tuple[int, int]], List[int]]:
+        """
+        Splits a document into sentences, and sentences longer than the budget into words.
+
+        :param document: The document
+        :type document: str
+
+        :return: The spans of the units and their token counts
+        """
+        def split(text: str) -> List[Tuple[int, int, int]]:
+            sentences = align_spans(nltk.sent_tokenize(text), text)
+            counts = self.count_tokens([text[start:end] for start, end in sentences])
+            units = []
+            for (start, end), count in zip(sentences, counts):
+                if count <= self.chunk_length:
+                    units.append((start, end, count))
+                    continue
+                words = [(start + match.start(), start + match.end()) for match in re.finditer(r'\S+', text[start:end])]
+                word_counts = self.count_tokens([text[word_start:word_end] for word_start, word_end in words])
+                units.extend((word_start, word_end, word_count) for (word_start, word_end), word_count in zip(words, word_counts))
+            return units
+
+        units = self.cache.get(document, f'token_units_{self.tokenizer_name}_{self.chunk_length}', split)
+        return [(start, end) for start, end, _ in units], [count for _, _, count in units]
+
+    def token_windows(self, counts: List[int]) -> List[Tuple[int, int]]:
+        """
+        Groups units into windows of at most chunk_length tokens, overlapping by at most sliding_window_size of the budget.
+
+        Both ends of the window only move forward, so this runs in linear time on the prefix sums of the token counts.
+
+        :param counts: The token counts of the units
+        :type counts: list[int]
+
+        :return: The (first, last + 1) unit indices of each chunk
+        """
+        num_of_units = len(counts)
+        if num_of_units == 0:
+            return [(0, 0)]
+
+        prefix = list(itertools.accumulate(counts, initial=0))
+        overlap = int(self.chunk_length * self.sliding_window_size)
+
+        windows = []
+        start, end = 0, 0
+        while True:
+            # extend the window as far as the budget allows, always taking at least one unit
+            end = max(end, start + 1)
+            while end < num_of_units and prefix[end + 1] - prefix[start] <= self.chunk_length:
+                end += 1
+            windows.append((start, end))
+            if end == num_of_units:
+                return windows
+
+            # start the next window at the first unit that keeps the overlap within its budget
+            # and still leaves room for the next unit
+            start += 1
+            while start < end and (prefix[end] - prefix[start] > overlap or prefix[end + 1] - prefix[start] > self.chunk_length):
+                start += 1
+
+    def chunk_spans(self, document: str) -> List[Tuple[int, int]]:
+        spans, counts = self.units(document)
+        if len(spans) == 0:
+            return [(0, 0)]
+        return [(spans[first][0], spans[last - 1][1]) for first, last in self.token_windows(counts)]
+
+    def chunk(self, document: str) -> List[str]:
+        return [document[start:end] for start, end in self.chunk_spans(document)]
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Any, Callable, List, Dict
+
+
+class TokenizationCache:
+    """
+    Caches the output of tokenizers, keyed by the tokenizer and a hash of the document.
+
+    Chunkers sharing a cache tokenize every document once, no matter how many chunk lengths or overlaps are swept.
+    Results are kept in an in-process LRU and, optionally, in a directory on disk that survives restarts.
+    """
+
+    def __init__(self, max_size: int = 1024, path: str = None):
+        """
+        :param max_size: The number of tokenized documents kept in memory, defaults to 1024
+        :type max_size: int, optional
+        :param path: The directory to store tokenized documents in, defaults to None - memory only
+        :type path: str, optional
+        """
+        self.max_size = max_size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict = OrderedDict()
+
+        if path is not None and not os.path.exists(path):
+            os.makedirs(path)
+
+    @staticmethod
+    def digest(document: str) -> str:
+        return hashlib.sha1(document.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def key(cls, document: str, tokenizer: str) -> str:
+        return f"{tokenizer}-{cls.digest(document)}"
+
+    def get(self, document: str, tokenizer: str, function: Callable[[str], List[Any]]) -> List[Any]:
+        """
+        Gets the tokens of a document, tokenizing it only if it is not cached yet.
+
+        :param document: The document
+        :type document: str
+        :param tokenizer: The name of the tokenizer, part of the cache key
+        :type tokenizer: str
+        :param function: The tokenizer, called with the document on a cache miss
+        :type function: Callable[[str], list]
+
+        :return: The tokens. The list is shared between callers and must not be modified.
+        """
+        key = self.key(document, tokenizer)
+
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        file_path = None if self.path is None else os.path.join(self.path, f"{key}.json")
+        if file_path is not None and os.path.exists(file_path):
+            self.hits += 1
+            with open(file_path, "r") as f:
+                tokens = json.load(f)
+        else:
+            self.misses += 1
+            tokens = function(document)
+            if file_path is not None:
+                with open(file_path, "w") as f:
+                    # arrays of offsets are stored as lists
+                    json.dump(tokens, f, default=lambda value: value.tolist())
+
+        self.put(key, tokens)
+        return tokens
+
+    def put(self, key: str, tokens: List[Any]):
+        self._cache[key] = tokens
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def entries(self, document: str) -> Dict[str, List[Any]]:
+        """
+        Gets the cached tokenizations of a document by every tokenizer, to send along with it to a worker process.
+
+        :param document: The document
+        :type document: str
+
+        :return: The tokens, by cache key
+        """
+        digest = self.digest(document)
+        return {key: tokens for key, tokens in self._cache.items() if key.endswith(digest)}
+
+    def update(self, entries: Dict[str, List[Any]]):
+        """
+        Adds tokenizations made elsewhere, e.g. by a worker process, to the in-memory cache.
+
+        :param entries: The tokens, by cache key
+        :type entries: dict[str, list]
+        """
+        for key, tokens in entries.items():
+            self.put(key, tokens)
+
+    def __getstate__(self):
+        # chunkers are pickled for every task sent to a process pool, so the cached documents are left behind,
+        # and chunk_many sends the tokenizations of each document along with it instead
+        state = self.__dict__.copy()
+        state['_cache'] = OrderedDict()
+        return state
+
+    def clear(self):
+        """
+        Empties the in-memory cache. Files on disk are kept.
+        """
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# shared by all chunkers unless they are given their own cache
+default_tokenization_cache = TokenizationCache()
@@ -1,7 +1,11 @@
 import nltk
-from typing import List
+import numpy as np
+from typing import List, Iterator, Union, IO, Tuple
 
-from retrieval.Chunker import Chunker
+from retrieval.Chunker import Chunker, align_spans
+from retrieval.Chunker.TokenizationCache import TokenizationCache, default_tokenization_cache
+from retrieval.Chunker.WordSplitter import RegexWordSplitter
+from retrieval.Chunker.SentChunker import iter_sentences
 
 # if needed, download the punkt tokenizer
 try:
@@ -11,17 +15,39 @@ except LookupError:
 
 
 class WordChunker(Chunker):
-    def __init__(self, chunk_length: int, sliding_window_size: float = 0.0, name: str = None):
+    def __init__(self, chunk_length: int, sliding_window_size: float = 0.0, name: str = None,
+                 cache: TokenizationCache = default_tokenization_cache, splitter: RegexWordSplitter = None):
         """
         :param chunk_length: The length of the chunks, measured in sentences.
         :type chunk_length: int
         :param sliding_window_size: The size of the sliding window. Defines the overlap between chunks, rounded down. Must be between 0.0 and 1.0, defaults to 0.0.
         :type sliding_window_size: float, optional
+        :param cache: The cache of tokenized documents, defaults to the cache shared by all chunkers
+        :type cache: TokenizationCache, optional
+        :param splitter: A word splitter returning the offsets of the words, defaults to None - uses nltk.word_tokenize. With a splitter, every chunk is one slice of the document instead of its words joined with spaces.
+        :type splitter: RegexWordSplitter, optional
         """
         super().__init__(chunk_length, sliding_window_size, name)
+        if name is None and splitter is not None:
+            self.name += f"_{splitter.name}"
+        self.cache = cache
+        self.splitter = splitter
+
+    def words(self, document: str) -> List[str]:
+        if self.splitter is not None:
+            return [document[start:end] for start, end in self.word_spans(document)]
+        return self.cache.get(document, 'word_tokenize', nltk.word_tokenize)
+
+    def word_spans(self, document: str) -> Union[List[Tuple[int, int]], np.ndarray]:
+        if self.splitter is not None:
+            return self.cache.get(document, f'{self.splitter.name}_word_spans', self.splitter.span_tokenize)
+        return self.cache.get(document, 'word_tokenize_spans', lambda text: align_spans(self.words(text), text))
 
     def chunk(self, document: str) -> List[str]:
-        words = nltk.word_tokenize(document)
+        if self.splitter is not None:
+            return [document[start:end] for start, end in self.chunk_spans(document)]
+
+        words = self.words(document)
 
         if len(words) < self.chunk_length:
             return [' '.join(words)]
@@ -32,3 +58,20 @@ class WordChunker(Chunker):
                     len(words),
                     self.chunk_length - int(self.chunk_length * self.sliding_window_size)
                 )]
+
+    def chunk_spans(self, document: str) -> List[Tuple[int, int]]:
+        spans = np.asarray(self.word_spans(document), dtype=np.int64).reshape(-1, 2)
+        if len(spans) == 0:
+            return [(0, 0)]
+        # the offsets of all chunks are looked up at once, from the first and last word of each window
+        windows = self.window_array(len(spans))
+        return list(zip(spans[windows[:, 0], 0].tolist(), spans[windows[:, 1] - 1, 1].tolist()))
+
+    def iter_chunks(self, document: Union[str, IO]) -> Iterator[str]:
+        if self.splitter is not None:
+            # chunks are slices of the document, so it is read as a whole
+            return super().iter_chunks(document)
+        # nltk.word_tokenize splits into sentences first, so tokenizing sentence by sentence gives the same words
+        words = (word for sentence in iter_sentences(self.read_blocks(document))
+                 for word in nltk.word_tokenize(sentence, preserve_line=True))
+        return self.iter_windows(words)
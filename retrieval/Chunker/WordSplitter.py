@@ -0,0 +1,26 @@
+import re
+
+import numpy as np
+
+
+class RegexWordSplitter:
+    """
+    A word splitter built on one compiled regular expression, returning the offsets of the words as an integer array.
+
+    Words are runs of letters or digits (numbers keep their decimal point), clitics such as "'s", and single punctuation
+    marks, which approximates the words counted by nltk.word_tokenize.
+    """
+    name = 'regex'
+
+    word = re.compile(r"\d+(?:[.,]\d+)*|\w+|'\w+|[^\w\s]")
+
+    def span_tokenize(self, text: str) -> np.ndarray:
+        """
+        Splits a text into words.
+
+        :param text: The text
+        :type text: str
+
+        :return: The (start, end) offsets of the words, as an array of shape (words, 2)
+        """
+        return np.array([match.span() for match in self.word.finditer(text)], dtype=np.int64).reshape(-1, 2)
@@ -1,9 +1,157 @@
+import codecs
+import itertools
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 from abc import ABC, abstractmethod
+from collections import deque
 
-from typing import List
+import numpy as np
+
+from typing import List, Iterable, Iterator, Union, IO, Any, Tuple, Optional, Dict
+
+
+def batched(iterable: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    """
+    Groups an iterable into lists of at most batch_size elements.
+
+    :param iterable: The iterable to group
+    :type iterable: Iterable
+    :param batch_size: The maximum size of a batch
+    :type batch_size: int
+
+    :return: The batches, in order
+    """
+    assert batch_size > 0, 'batch_size must be positive'
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def align_spans(tokens: Iterable[str], document: str) -> List[Tuple[int, int]]:
+    """
+    Finds the (start, end) character offsets of consecutive tokens in the document they were taken from.
+
+    :param tokens: The tokens, in the order they appear in the document
+    :type tokens: Iterable[str]
+    :param document: The document
+    :type document: str
+
+    :return: The spans of the tokens
+    """
+    spans = []
+    position = 0
+    for token in tokens:
+        start = document.find(token, position)
+        if start == -1 and token in ('``', "''"):
+            # nltk.word_tokenize rewrites double quotes
+            token = '"'
+            start = document.find(token, position)
+        if start == -1:
+            # the tokenizer changed the token, so it is anchored at the next non-space character
+            start = position
+            while start < len(document) and document[start].isspace():
+                start += 1
+            spans.append((start, min(start + len(token), len(document))))
+            continue
+        spans.append((start, start + len(token)))
+        position = start + len(token)
+    return spans
+
+
+def chunk_task(chunker: 'Chunker', spans: bool, document: str, entries: Dict[str, Any]) -> Tuple[list, Dict[str, Any]]:
+    """
+    Chunks a document in a worker process of `Chunker.chunk_many`.
+
+    :param chunker: The chunker, whose tokenization cache arrives empty
+    :type chunker: Chunker
+    :param spans: Whether to return the (start, end) offsets of the chunks instead of their text
+    :type spans: bool
+    :param document: The document
+    :type document: str
+    :param entries: The tokenizations of the document already cached by the parent process, by cache key
+    :type entries: dict[str, Any]
+
+    :return: The chunks, and the tokenizations made for them, to be merged into the parent's cache
+    """
+    cache = getattr(chunker, 'cache', None)
+    if cache is not None:
+        cache.update(entries)
+    chunks = (chunker.chunk_spans if spans else chunker.chunk)(document)
+    if cache is None:
+        return chunks, {}
+    # the cache copy is shared by the documents of a batch, so only this document's new tokenizations are returned
+    return chunks, {key: tokens for key, tokens in cache.entries(document).items() if key not in entries}
+
+
+class Chunk:
+    """
+    A chunk of a document, stored as character offsets into the document instead of a copy of its text.
+
+    Chunks are equal if they cover the same span of the same document, which makes identity and overlap checks O(1).
+    """
+    __slots__ = ('source', 'start', 'end', 'doc_id')
+
+    def __init__(self, source: str, start: int, end: int, doc_id: Optional[str] = None):
+        """
+        :param source: The document the chunk is taken from. It is referenced, not copied.
+        :type source: str
+        :param start: The offset of the first character of the chunk
+        :type start: int
+        :param end: The offset after the last character of the chunk
+        :type end: int
+        :param doc_id: The identifier of the document, defaults to None - chunks are then only equal to chunks of the same source object
+        :type doc_id: str, optional
+        """
+        self.source = source
+        self.start = start
+        self.end = end
+        self.doc_id = doc_id
+
+    @property
+    def text(self) -> str:
+        """
+        The text of the chunk, materialized on access.
+        """
+        return self.source[self.start:self.end]
+
+    def same_document(self, other: "Chunk") -> bool:
+        if self.doc_id is not None or other.doc_id is not None:
+            return self.doc_id == other.doc_id
+        return self.source is other.source
+
+    def overlaps(self, other: "Chunk") -> bool:
+        return self.same_document(other) and self.start < other.end and other.start < self.end
+
+    def __contains__(self, item: Union[str, "Chunk"]) -> bool:
+        if isinstance(item, Chunk):
+            return self.same_document(item) and self.start <= item.start and item.end <= self.end
+        return item in self.text
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Chunk):
+            return NotImplemented
+        return self.start == other.start and self.end == other.end and self.same_document(other)
+
+    def __hash__(self) -> int:
+        return hash((self.doc_id, self.start, self.end))
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __str__(self) -> str:
+        return self.text
+
+    def __repr__(self) -> str:
+        return f"Chunk(doc_id={self.doc_id}, start={self.start}, end={self.end}, text={self.text[:10]})"
 
 
 class Chunker(ABC):
+    # number of characters read at once when streaming a document
+    block_size: int = 1 << 16
+
     def __init__(self, chunk_length: int, sliding_window_size: float = 0.0, name: str = None):
         """
         :param chunk_length: The length of the chunks. measurement depends on the chunker.
@@ -22,6 +170,13 @@ class Chunker(ABC):
         if name is None:
             self.name = self.__class__.__name__ + f"_{chunk_length}_{sliding_window_size}"
 
+    @property
+    def step(self) -> int:
+        """
+        The distance between the starts of two consecutive chunks, measured in the unit of the chunker.
+        """
+        return self.chunk_length - int(self.chunk_length * self.sliding_window_size)
+
     @abstractmethod
     def chunk(self, document: str) -> List[str]:
         """
@@ -33,3 +188,171 @@ class Chunker(ABC):
         :return: The chunks
         """
         raise NotImplementedError
+
+    def windows(self, num_of_units: int) -> List[Tuple[int, int]]:
+        """
+        Computes which units (words, sentences, ...) make up each chunk.
+
+        :param num_of_units: The number of units in the document
+        :type num_of_units: int
+
+        :return: The (first, last + 1) unit indices of each chunk
+        """
+        if num_of_units < self.chunk_length:
+            return [(0, num_of_units)]
+        return [(i, min(i + self.chunk_length, num_of_units)) for i in range(0, num_of_units, self.step)]
+
+    def window_array(self, num_of_units: int) -> np.ndarray:
+        """
+        Computes which units make up each chunk, like `windows`, without building Python objects per chunk.
+
+        :param num_of_units: The number of units in the document
+        :type num_of_units: int
+
+        :return: The (first, last + 1) unit indices of each chunk, as an array of shape (chunks, 2)
+        """
+        if num_of_units < self.chunk_length:
+            return np.array([[0, num_of_units]], dtype=np.int64)
+        starts = np.arange(0, num_of_units, self.step, dtype=np.int64)
+        return np.stack([starts, np.minimum(starts + self.chunk_length, num_of_units)], axis=1)
+
+    def chunk_spans(self, document: str) -> List[Tuple[int, int]]:
+        """
+        Chunks a document into character spans of the original document.
+
+        :param document: The document
+        :type document: str
+
+        :return: The (start, end) offsets of the chunks
+        """
+        raise NotImplementedError
+
+    def chunk_objects(self, document: str, doc_id: str = None) -> List[Chunk]:
+        """
+        Chunks a document into offset-based `Chunk` objects that reference the document instead of copying it.
+
+        :param document: The document
+        :type document: str
+        :param doc_id: The identifier of the document, defaults to None
+        :type doc_id: str, optional
+
+        :return: The chunks
+        """
+        return [Chunk(document, start, end, doc_id) for start, end in self.chunk_spans(document)]
+
+    def chunk_many(
+            self,
+            documents: List[str],
+            workers: int = None,
+            chunksize: int = None,
+            spans: bool = False
+    ) -> Union[List[List[str]], List[List[Tuple[int, int]]]]:
+        """
+        Chunks many documents at once, fanning them out across a process pool.
+
+        Documents are sent to the workers with their tokenizations cached in this process, and the tokenizations the
+        workers make are merged back into the cache, so a sweep of chunkers sharing a cache tokenizes every document once.
+
+        :param documents: The documents
+        :type documents: list[str]
+        :param workers: The number of worker processes, defaults to None - chunks in the current process
+        :type workers: int, optional
+        :param chunksize: The number of documents sent to a worker at once, defaults to None - a quarter of each worker's share
+        :type chunksize: int, optional
+        :param spans: Whether to return the (start, end) offsets of the chunks instead of their text, defaults to False
+        :type spans: bool, optional
+
+        :return: The chunks of each document, in the order of the documents
+        """
+        function = self.chunk_spans if spans else self.chunk
+        if workers is None or workers <= 1 or len(documents) <= 1:
+            return [function(document) for document in documents]
+
+        if chunksize is None:
+            chunksize = max(1, len(documents) // (workers * 4))
+        cache = getattr(self, 'cache', None)
+        entries = [{} if cache is None else cache.entries(document) for document in documents]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(partial(chunk_task, self, spans), documents, entries, chunksize=chunksize))
+        if cache is not None:
+            for _, made in results:
+                cache.update(made)
+        return [chunks for chunks, _ in results]
+
+    def iter_chunks(self, document: Union[str, IO]) -> Iterator[str]:
+        """
+        Lazily chunks a document that does not have to fit in memory.
+
+        The default implementation reads the whole document and falls back to `chunk`.
+
+        :param document: The document, a file-like object (text or binary) or an mmap
+        :type document: Union[str, IO]
+
+        :return: The chunks, in the same order as `chunk` would return them
+        """
+        yield from self.chunk(''.join(self.read_blocks(document)))
+
+    @classmethod
+    def read_blocks(cls, document: Union[str, IO], encoding: str = 'utf-8') -> Iterator[str]:
+        """
+        Reads a document in blocks of at most `block_size` characters.
+
+        :param document: The document, a file-like object (text or binary) or an mmap
+        :type document: Union[str, IO]
+        :param encoding: The encoding used to decode binary sources, defaults to 'utf-8'
+        :type encoding: str, optional
+
+        :return: The blocks of the document
+        """
+        if isinstance(document, str):
+            for i in range(0, len(document), cls.block_size):
+                yield document[i:i + cls.block_size]
+            return
+
+        # file-like objects and mmaps both expose read(); binary sources are decoded incrementally
+        # so that multibyte characters split between two blocks are not broken
+        decoder = codecs.getincrementaldecoder(encoding)()
+        while True:
+            block = document.read(cls.block_size)
+            if not block:
+                break
+            if isinstance(block, (bytes, bytearray)):
+                block = decoder.decode(block)
+            if block:
+                yield block
+        tail = decoder.decode(b'', final=True)
+        if tail:
+            yield tail
+
+    def iter_windows(self, units: Iterable[str], separator: str = ' ') -> Iterator[str]:
+        """
+        Joins a stream of units (words, sentences, ...) into overlapping chunks.
+
+        Only the units of the current window are kept in memory.
+
+        :param units: The units of the document, in order
+        :type units: Iterable[str]
+        :param separator: The string used to join the units of a chunk, defaults to ' '
+        :type separator: str, optional
+
+        :return: The chunks, in the same order as `chunk` would return them
+        """
+        window = deque()
+        emitted = False
+        for unit in units:
+            window.append(unit)
+            if len(window) == self.chunk_length:
+                yield separator.join(window)
+                emitted = True
+                for _ in range(self.step):
+                    window.popleft()
+
+        if not emitted:
+            # documents shorter than one chunk are returned whole
+            yield separator.join(window)
+            return
+
+        while window:
+            yield separator.join(itertools.islice(window, self.chunk_length))
+            for _ in range(min(self.step, len(window))):
+                window.popleft()
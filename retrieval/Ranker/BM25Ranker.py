@@ -0,0 +1,172 @@
+import json
+import os
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer
+from typing import List, Union, Tuple
+
+from retrieval.Ranker import Ranker, top_k_indices
+from retrieval.Ranker.Preprocessor import Preprocessor, default_preprocessor
+
+
+class BM25Ranker(Ranker):
+    def __init__(self, top_k: int, name=None, k1: float = 1.5, b: float = 0.75, pruning: bool = False,
+                 preprocessor: Preprocessor = default_preprocessor, workers: int = None, **kwargs):
+        """
+        :param top_k: The number of chunks to return
+        :type top_k: int
+        :param k1: The term frequency saturation, defaults to 1.5
+        :type k1: float, optional
+        :param b: The document length normalisation, defaults to 0.75
+        :type b: float, optional
+        :param pruning: Whether to skip the postings of common query terms once they cannot change the top-k (MaxScore), defaults to False. Only affects rank without return_similarities.
+        :type pruning: bool, optional
+        :param preprocessor: The preprocessor normalising chunks and queries, defaults to the one shared by all sparse rankers
+        :type preprocessor: Preprocessor, optional
+        :param workers: The number of processes preprocessing chunks that are not cached yet, defaults to None - the current process
+        :type workers: int, optional
+
+        :param kwargs: Keyword arguments for the CountVectorizer
+        :type kwargs: dict
+        """
+        super().__init__(top_k, name)
+        if name is None:
+            self.name += f"_{k1}_{b}"
+            if not kwargs == {}:
+                self.name += f"_{kwargs}"
+        self.k1 = k1
+        self.b = b
+        self.pruning = pruning
+        self.vectorizer = CountVectorizer(**kwargs)
+        self.preprocessor = preprocessor
+        self.workers = workers
+
+        self.chunks = None
+        # (chunks x terms) BM25 weights, in CSC format so that the postings of a term are one contiguous column
+        self.weights = None
+        # the highest weight of each term, bounding what it can add to a score
+        self.max_weights = None
+
+    def init_chunks(self, chunks: List[str]):
+        self.chunks = chunks
+        counts = self.vectorizer.fit_transform(self.preprocess(chunks)).tocsc().astype(float)
+        num_of_chunks, num_of_terms = counts.shape
+
+        lengths = np.asarray(counts.sum(axis=1)).ravel()
+        average_length = lengths.mean() if num_of_chunks and lengths.mean() > 0 else 1.0
+        frequencies = np.diff(counts.indptr)
+        idf = np.log(1 + (num_of_chunks - frequencies + 0.5) / (frequencies + 0.5))
+
+        # the weight of every posting is precomputed, so scoring a query only sums columns
+        norms = self.k1 * (1 - self.b + self.b * lengths / average_length)
+        tf = counts.data
+        counts.data = tf * (self.k1 + 1) / (tf + norms[counts.indices]) * np.repeat(idf, frequencies)
+        self.weights = counts
+
+        self.max_weights = np.zeros(num_of_terms)
+        nonempty = frequencies > 0
+        self.max_weights[nonempty] = np.maximum.reduceat(counts.data, counts.indptr[:-1][nonempty]) if counts.nnz else 0
+
+    def save_state(self, path: str):
+        with open(os.path.join(path, "vocabulary.json"), "w") as f:
+            json.dump({term: int(column) for term, column in self.vectorizer.vocabulary_.items()}, f)
+        np.save(os.path.join(path, "max_weights.npy"), self.max_weights)
+        sp.save_npz(os.path.join(path, "weights.npz"), self.weights)
+
+    def load_state(self, path: str):
+        with open(os.path.join(path, "vocabulary.json"), "r") as f:
+            self.vectorizer.vocabulary_ = json.load(f)
+        self.max_weights = np.load(os.path.join(path, "max_weights.npy"))
+        self.weights = sp.load_npz(os.path.join(path, "weights.npz"))
+
+    def query_terms(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Maps a query to the columns of its terms.
+
+        :param query: The query
+        :type query: str
+
+        :return: The columns of the query terms in the vocabulary, and how often each occurs in the query
+        """
+        counts = self.vectorizer.transform(self.preprocess([query]))
+        return counts.indices, counts.data.astype(float)
+
+    def score(self, query: str) -> np.ndarray:
+        """
+        Scores every chunk, touching only the postings of the query terms.
+
+        :param query: The query
+        :type query: str
+
+        :return: The BM25 score of each chunk
+        """
+        terms, counts = self.query_terms(query)
+        return self.weights[:, terms] @ counts
+
+    def score_pruned(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Scores chunks term at a time with MaxScore pruning.
+
+        Terms are processed in order of their highest weight, and only the chunks their postings touch are scored, with the
+        top-k threshold kept over those. Once the weights of the remaining terms can no longer lift an untouched chunk
+        into the top-k, the remaining terms are only looked up for the chunks that can still make it, so the long
+        postings of common terms are never traversed.
+
+        :param query: The query
+        :type query: str
+
+        :return: The chunks that can be in the top-k, in order, and their exact BM25 scores. Every other chunk scores less,
+            and if fewer than top_k chunks are returned, every other chunk scores 0.
+        """
+        terms, counts = self.query_terms(query)
+        bounds = self.max_weights[terms] * counts
+        order = np.argsort(-bounds, kind="stable")
+        terms, counts = terms[order], counts[order]
+        # the highest score the terms from each one on can add
+        remaining = np.cumsum(bounds[order][::-1])[::-1]
+
+        indptr, indices, data = self.weights.indptr, self.weights.indices, self.weights.data
+        candidates, scores = np.zeros(0, dtype=indices.dtype), np.zeros(0)
+        threshold = None
+        for i, (term, count) in enumerate(zip(terms, counts)):
+            if threshold is not None and remaining[i] < threshold:
+                break
+            postings = slice(indptr[term], indptr[term + 1])
+            candidates, inverse = np.unique(np.concatenate((candidates, indices[postings])), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate((scores, data[postings] * count)), minlength=len(candidates))
+            if len(candidates) >= self.top_k > 0:
+                threshold = np.partition(scores, len(scores) - self.top_k)[len(scores) - self.top_k]
+        else:
+            return candidates, scores
+
+        # candidates that cannot reach the threshold any more are dropped, the others are looked up in the remaining postings
+        keep = scores + remaining[i] >= threshold
+        candidates, scores = candidates[keep], scores[keep]
+        for term, count in zip(terms[i:], counts[i:]):
+            rows = indices[indptr[term]:indptr[term + 1]]
+            positions = np.searchsorted(rows, candidates)
+            found = positions < len(rows)
+            found[found] = rows[positions[found]] == candidates[found]
+            scores[found] += data[indptr[term] + positions[found]] * count
+        return candidates, scores
+
+    def rank(self, query: str, return_similarities: bool = False) -> Union[List[str], List[Tuple[str, float]]]:
+        if return_similarities or not self.pruning:
+            return super().rank(query, return_similarities)
+        candidates, scores = self.score_pruned(query)
+        if len(candidates) < self.top_k:
+            # untouched chunks score 0, and fill the top-k in order
+            all_scores = np.zeros(len(self.chunks))
+            all_scores[candidates] = scores
+            return [self.chunks[i] for i in top_k_indices(all_scores, self.top_k)]
+        return [self.chunks[candidates[i]] for i in top_k_indices(scores, self.top_k)]
+
+    def batch_rank(self, queries: List[str], batch_size: int = 100) -> List[List[str]]:
+        query_counts = self.vectorizer.transform(self.preprocess(queries)).astype(float)
+        scores = (query_counts @ self.weights.T).toarray() if self.chunks else np.zeros((len(queries), 0))
+        return [[self.chunks[i] for i in top_k_indices(row, self.top_k)] for row in scores]
+
+    def preprocess(self, chunks: List[str]) -> List[str]:
+        # the same normalisation as TfidfRanker, so the two are interchangeable as sparse rankers
+        return self.preprocessor.preprocess_many(self.texts(chunks), workers=self.workers)
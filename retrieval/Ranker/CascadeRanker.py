@@ -0,0 +1,56 @@
+import numpy as np
+from typing import List, Dict
+
+from retrieval.Ranker import Ranker
+from retrieval.Ranker.CrossEncodingRanker import CrossEncodingRanker
+from retrieval.Ranker.TfidfRanker import TfidfRanker
+
+
+class CascadeRanker(Ranker):
+
+    def __init__(self, top_k: int, name=None,
+                 first: Ranker = TfidfRanker(top_k=5),
+                 second: CrossEncodingRanker = CrossEncodingRanker(top_k=5),
+                 depth: int = 20):
+        """
+        :param top_k: The number of chunks to return
+        :type top_k: int
+        :param first: The cheap ranker shortlisting chunks, e.g. a TfidfRanker or a SentEmbeddingRanker
+        :type first: Ranker, optional
+        :param second: The ranker rescoring the shortlist, only needs `score_chunks`
+        :type second: CrossEncodingRanker, optional
+        :param depth: The number of chunks shortlisted by the first ranker, defaults to 20
+        :type depth: int, optional
+        """
+        super().__init__(top_k, name)
+        if name is None:
+            self.name += f"_{first.name}_{second.name}_{depth}"
+
+        self.first_ranker = first
+        self.second_ranker = second
+        self.depth = depth
+
+    def init_chunks(self, chunks: List[str]):
+        self.chunks = chunks
+        self.first_ranker.init_chunks(chunks)
+        # tokenizes the chunks once for the second ranker
+        self.second_ranker.init_chunks(chunks)
+
+    def pop_stats(self) -> Dict[str, float]:
+        return {f"{stat} ({self.first_ranker.name})": value for stat, value in self.first_ranker.pop_stats().items()}
+
+    def score(self, query: str) -> np.ndarray:
+        first_scores = self.first_ranker.score(query)
+        order = np.argsort(-first_scores, kind="stable")
+        candidates, rest = order[:max(self.depth, self.top_k)], order[max(self.depth, self.top_k):]
+
+        scores = np.empty(len(self.chunks), dtype=np.float64)
+        candidate_scores = self.second_ranker.score_chunks(query, [self.chunks[i] for i in candidates])
+        scores[candidates] = candidate_scores
+        # chunks outside the shortlist rank below it, in the order of the first ranker
+        lowest = candidate_scores.min() if len(candidate_scores) else 0
+        scores[rest] = lowest - 1 - np.arange(len(rest)) / max(len(rest), 1)
+        return scores
+
+    def batch_rank(self, queries: List[str], batch_size: int = 100) -> List[List[str]]:
+        return [self.rank(query) for query in queries]
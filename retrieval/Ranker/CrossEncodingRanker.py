@@ -1,38 +1,169 @@
 import numpy as np
 import torch
 from sentence_transformers import CrossEncoder
-from typing import List, Union, Tuple
+from typing import List, Tuple, Dict
 
-from retrieval.Ranker import Ranker
+from retrieval.Ranker import Ranker, top_k_indices
+
+
+def truncate_longest_first(first: List[int], second: List[int], budget: int, fast: bool = True) -> Tuple[List[int], List[int]]:
+    """
+    Truncates a pair of token id sequences to a budget like the "longest_first" strategy of Hugging Face tokenizers,
+    which differs between fast (Rust) and Python tokenizers.
+
+    Fast tokenizers keep half the budget, rounded down, of the shorter sequence (the first on ties) if it does not fit,
+    and fill the rest with the longer one. Python tokenizers remove tokens from the longer sequence until both are
+    equally long, then from both in turn, taking an odd token from the second.
+
+    :param first: The token ids of the first sequence, without special tokens
+    :type first: list[int]
+    :param second: The token ids of the second sequence, without special tokens
+    :type second: list[int]
+    :param budget: The number of tokens left for the pair besides the special tokens
+    :type budget: int
+    :param fast: Whether to truncate like a fast tokenizer, defaults to True
+    :type fast: bool, optional
+
+    :return: The truncated sequences
+    """
+    if len(first) + len(second) <= budget:
+        return first, second
+    if fast:
+        if len(first) <= len(second):
+            first_length = min(len(first), budget // 2)
+            return first[:first_length], second[:budget - first_length]
+        second_length = min(len(second), budget // 2)
+        return first[:budget - second_length], second[:second_length]
+
+    excess = len(first) + len(second) - budget
+    difference = min(abs(len(first) - len(second)), excess)
+    first_length, second_length = len(first), len(second)
+    if first_length > second_length:
+        first_length -= difference
+    else:
+        second_length -= difference
+    rest = excess - difference
+    return first[:first_length - rest // 2], second[:second_length - rest // 2 - rest % 2]
 
 
 class CrossEncodingRanker(Ranker):
-    def __init__(self, top_k: int, name=None):
+    def __init__(self, top_k: int, name=None, batch_size: int = 32):
         """
         :param top_k: The number of chunks to return
         :type top_k: int
+        :param batch_size: The number of (query, chunk) pairs in a forward pass, defaults to 32
+        :type batch_size: int, optional
         """
         super().__init__(top_k, name)
         self.index = None
         if name is None:
             self.name += ""
+        self.batch_size = batch_size
 
         device = "cuda" if torch.cuda.is_available() else "cpu"
 
         self.model = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2', device=device)
+        self.tokenizer = self.model.tokenizer
+        self.max_length = self.model.max_length or self.tokenizer.model_max_length
+        # the token ids of every chunk seen, without special tokens, so only queries are tokenized when ranking
+        self.token_ids: Dict[str, List[int]] = {}
 
     def init_chunks(self, chunks: List[str]):
         self.chunks: List[str] = chunks
+        self.token_ids = {}
+        self.tokenize(self.texts(chunks))
+
+    def tokenize(self, texts: List[str]) -> List[List[int]]:
+        """
+        Gets the token ids of texts, tokenizing the ones not seen yet in one call.
+        :param texts: The texts
+        :type texts: list[str]
+
+        :return: The token ids of each text, without special tokens
+        """
+        missing = list(dict.fromkeys(text for text in texts if text not in self.token_ids))
+        if missing:
+            ids = self.tokenizer(missing, add_special_tokens=False, verbose=False)["input_ids"]
+            self.token_ids.update(zip(missing, ids))
+        return [self.token_ids[text] for text in texts]
+
+    def truncate(self, query_ids: List[int], chunk_ids: List[int]) -> Tuple[List[int], List[int]]:
+        """
+        Truncates a pair to the maximum length like the tokenizer's "longest_first" strategy.
+        """
+        budget = self.max_length - self.tokenizer.num_special_tokens_to_add(pair=True)
+        return truncate_longest_first(query_ids, chunk_ids, budget, self.tokenizer.is_fast)
+
+    def score_pairs(self, pairs: List[Tuple[List[int], List[int]]], batch_size: int = None) -> np.ndarray:
+        """
+        Scores (query, chunk) pairs of token ids. The pairs are sorted by length and batched, so each batch is padded
+        to the length of similar pairs only.
+        :param pairs: The token ids of the query and the chunk of each pair, without special tokens
+        :type pairs: list[tuple[list[int], list[int]]]
+        :param batch_size: The number of pairs in a forward pass, defaults to None - the ranker's batch size
+        :type batch_size: int, optional
+
+        :return: The score of each pair, in the order of the pairs
+        """
+        inputs, token_types = [], []
+        for query_ids, chunk_ids in pairs:
+            query_ids, chunk_ids = self.truncate(query_ids, chunk_ids)
+            inputs.append(self.tokenizer.build_inputs_with_special_tokens(query_ids, chunk_ids))
+            token_types.append(self.tokenizer.create_token_type_ids_from_sequences(query_ids, chunk_ids))
+
+        model = self.model.model
+        device = next(model.parameters()).device
+        activation = getattr(self.model, "activation_fn", None) or self.model.default_activation_function
+        use_token_types = "token_type_ids" in self.tokenizer.model_input_names
+
+        batch_size = batch_size or self.batch_size
+        scores = np.zeros(len(inputs), dtype=np.float32)
+        order = np.argsort([len(ids) for ids in inputs], kind="stable")
+        model.eval()
+        with torch.no_grad():
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                length = max(len(inputs[i]) for i in batch)
+                input_ids = np.full((len(batch), length), self.tokenizer.pad_token_id, dtype=np.int64)
+                attention_mask = np.zeros((len(batch), length), dtype=np.int64)
+                token_type_ids = np.zeros((len(batch), length), dtype=np.int64)
+                for row, i in enumerate(batch):
+                    input_ids[row, :len(inputs[i])] = inputs[i]
+                    attention_mask[row, :len(inputs[i])] = 1
+                    token_type_ids[row, :len(inputs[i])] = token_types[i]
+
+                features = {"input_ids": torch.from_numpy(input_ids).to(device),
+                            "attention_mask": torch.from_numpy(attention_mask).to(device)}
+                if use_token_types:
+                    features["token_type_ids"] = torch.from_numpy(token_type_ids).to(device)
+                logits = activation(model(**features, return_dict=True).logits)
+                scores[batch] = logits[:, 0].float().cpu().numpy()
+        return scores
+
+    def score_chunks(self, query: str, chunks: List[str]) -> np.ndarray:
+        """
+        Scores chunks against a query, which need not be the chunks the ranker was initialised with.
+        :param query: The query
+        :type query: str
+        :param chunks: The chunks
+        :type chunks: list[str]
+
+        :return: The score of each chunk
+        """
+        if len(chunks) == 0:
+            return np.zeros(0, dtype=np.float32)
+        query_ids = self.tokenizer(query, add_special_tokens=False, verbose=False)["input_ids"]
+        return self.score_pairs([(query_ids, chunk_ids) for chunk_ids in self.tokenize(self.texts(chunks))])
 
-    def rank(self, query: str, return_similarities: bool = False) -> Union[List[str], List[Tuple[str, float]]]:
-        scores = self.model.predict([[query, chunk] for chunk in self.chunks])
-        indices = np.argsort(scores)[::-1]
-        if return_similarities:
-            return [(self.chunks[i], scores[i]) for i in indices]
-        return [self.chunks[i] for i in indices[:self.top_k]]
+    def score(self, query: str) -> np.ndarray:
+        return self.score_chunks(query, self.chunks)
 
     def batch_rank(self, queries: List[str], batch_size: int = 100) -> List[List[str]]:
-        scores = self.model.predict([[query, chunk] for chunk in self.chunks for query in queries], batch_size=batch_size)
+        if len(self.chunks) == 0:
+            return [[] for _ in queries]
+        # the pairs of all queries are scored together, query-major
+        query_ids = self.tokenizer(queries, add_special_tokens=False, verbose=False)["input_ids"]
+        chunk_ids = self.tokenize(self.texts(self.chunks))
+        scores = self.score_pairs([(ids, chunk) for ids in query_ids for chunk in chunk_ids], batch_size)
         scores = scores.reshape(len(queries), len(self.chunks))
-        indices = np.argsort(scores, axis=1)[:, ::-1]
-        return [[self.chunks[i] for i in indices[j][:self.top_k]] for j in range(len(queries))]
+        return [[self.chunks[i] for i in top_k_indices(row, self.top_k)] for row in scores]
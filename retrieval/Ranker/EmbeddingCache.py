@@ -0,0 +1,157 @@
+import hashlib
+import os
+import threading
+from typing import Callable, Dict, List, Tuple, Union
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Caches embeddings, keyed by the model and a hash of the embedded text.
+
+    Overlapping chunks, the chunks of different chunkers and repeated runs share most of their texts, so rankers sharing
+    a cache only encode each text once. With a path, the embeddings of each model are appended to a float32 matrix on
+    disk, which is memory-mapped, next to an index holding the hash of the text of every row.
+    """
+
+    def __init__(self, path: str = None):
+        """
+        :param path: The directory to store the embeddings in, defaults to None - memory only
+        :type path: str, optional
+        """
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        # the row of every cached text and the matrix of embeddings, by model
+        self._rows: Dict[str, Dict[str, int]] = {}
+        self._vectors: Dict[str, np.ndarray] = {}
+        # rankers encoding concurrently (e.g. in a HybridRanker) may share the cache
+        self._lock = threading.Lock()
+
+        if path is not None and not os.path.exists(path):
+            os.makedirs(path)
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def files(self, model: str) -> Tuple[str, str]:
+        name = model.replace('/', '__')
+        return os.path.join(self.path, f"{name}.f32"), os.path.join(self.path, f"{name}.index")
+
+    def load(self, model: str):
+        """
+        Reads the index of a model's embeddings from disk, and memory-maps the embeddings.
+
+        :param model: The name of the model
+        :type model: str
+        """
+        if model in self._rows:
+            return
+        self._rows[model], self._vectors[model] = {}, None
+        if self.path is None:
+            return
+
+        vector_file, index_file = self.files(model)
+        if not os.path.exists(index_file):
+            return
+        with open(index_file, "r") as f:
+            dimension, *keys = f.read().split()
+        if len(keys) == 0:
+            return
+
+        # the index is written after the embeddings, so rows of an interrupted append are cut off
+        size = len(keys) * int(dimension) * 4
+        if os.path.getsize(vector_file) > size:
+            with open(vector_file, "r+b") as f:
+                f.truncate(size)
+        self._rows[model] = {key: row for row, key in enumerate(keys)}
+        self._vectors[model] = np.memmap(vector_file, dtype=np.float32, mode="r", shape=(len(keys), int(dimension)))
+
+    def append(self, model: str, keys: List[str], vectors: np.ndarray):
+        rows = self._rows[model]
+        start, dimension = len(rows), vectors.shape[1]
+
+        if self.path is None:
+            # the matrix doubles when it is full, so appending stays amortised linear
+            matrix = self._vectors[model]
+            if matrix is None or len(matrix) < start + len(keys):
+                grown = np.empty((max(2 * start, start + len(keys)), dimension), dtype=np.float32)
+                if matrix is not None:
+                    grown[:start] = matrix[:start]
+                matrix = grown
+            matrix[start:start + len(keys)] = vectors
+            self._vectors[model] = matrix
+        else:
+            vector_file, index_file = self.files(model)
+            new_index = not os.path.exists(index_file)
+            with open(vector_file, "ab") as f:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            with open(index_file, "a") as f:
+                if new_index:
+                    f.write(f"{dimension}\n")
+                f.write("".join(f"{key}\n" for key in keys))
+            self._vectors[model] = np.memmap(vector_file, dtype=np.float32, mode="r", shape=(start + len(keys), dimension))
+
+        rows.update((key, start + i) for i, key in enumerate(keys))
+
+    def get(self, model: str, texts: List[str], encode: Callable[[List[str]], np.ndarray],
+            return_counts: bool = False) -> Union[np.ndarray, Tuple[np.ndarray, int, int]]:
+        """
+        Gets the embeddings of texts, encoding the ones that are not cached yet in one call.
+
+        The cache is only locked to look up and append rows, so rankers sharing it encode concurrently.
+
+        :param model: The name of the model, part of the cache key
+        :type model: str
+        :param texts: The texts
+        :type texts: list[str]
+        :param encode: The model's encoding function, called with the missing texts
+        :type encode: Callable[[list[str]], np.ndarray]
+        :param return_counts: Whether to also return the number of cache hits and misses of this call, defaults to False
+        :type return_counts: bool, optional
+
+        :return: The embeddings of the texts, as a (texts x dimension) float32 array, and the hits and misses if requested
+        """
+        keys = [self.key(text) for text in texts]
+        missing = {}
+        with self._lock:
+            self.load(model)
+            rows = self._rows[model]
+            for key, text in zip(keys, texts):
+                if key not in rows and key not in missing:
+                    missing[key] = text
+
+        if len(texts) == 0:
+            embeddings = np.zeros((0, 0), dtype=np.float32)
+        else:
+            vectors = None
+            if missing:
+                vectors = np.asarray(encode(list(missing.values())), dtype=np.float32).reshape(len(missing), -1)
+            with self._lock:
+                # another thread may have appended some of the texts while they were encoded
+                new = [i for i, key in enumerate(missing) if key not in rows]
+                if new:
+                    self.append(model, [list(missing)[i] for i in new], vectors[new])
+                embeddings = np.asarray(self._vectors[model][[rows[key] for key in keys]], dtype=np.float32).reshape(len(keys), -1)
+
+        hits, misses = len(texts) - len(missing), len(missing)
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.bytes_saved += hits * embeddings.shape[1] * 4
+        if return_counts:
+            return embeddings, hits, misses
+        return embeddings
+
+    def clear(self):
+        """
+        Empties the in-memory cache. Files on disk are kept.
+        """
+        self._rows.clear()
+        self._vectors.clear()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
@@ -62,19 +62,12 @@ class GuessSimilarityRanker(Ranker):
     def rank(self, query: str, return_similarities: bool = False) -> Union[
             Tuple[List[str], List[str]], Tuple[List[Tuple[str, float]], List[str]]]:
         answers: List[str] = self.get_guesses(query)
-        # Get vectors for each answer
-        scores = []
-        for answer in answers:
-            scores.append(self.model.rank(answer, return_similarities=True))
-        # calculate the mean similarity for each chunk
-        scores = [{chunk: chunk_scores for chunk, chunk_scores in score} for score in scores]
-        mean_scores = {}
-        for chunk in self.chunks:
-            mean_scores[chunk] = np.mean([score.get(chunk, 0) for score in scores])
-        mean_scores = sorted(mean_scores.items(), key=lambda x: x[1], reverse=True)
+        # the mean score of each chunk over the answers
+        mean_scores = np.mean([self.model.score(answer) for answer in answers], axis=0)
+        indices = np.argsort(-mean_scores, kind="stable")
         if return_similarities:
-            return mean_scores, answers
-        return [x for x, _ in mean_scores][:self.top_k], answers
+            return [(self.chunks[i], mean_scores[i]) for i in indices], answers
+        return [self.chunks[i] for i in indices[:self.top_k]], answers
 
     def get_guesses(self, query: str) -> List[str]:
         inputs = self.prompt.format(num_of_paraphrases=self.num_of_paraphrases, query=query)
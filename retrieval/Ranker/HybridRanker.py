@@ -1,81 +1,377 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-from typing import List, Tuple, Union
+from typing import List, Dict, Union, Tuple, Callable, Any
 
-from retrieval.Ranker import Ranker
+from retrieval.Ranker import Ranker, top_k_indices
 from retrieval.Ranker.CrossEncodingRanker import CrossEncodingRanker
 from retrieval.Ranker.TfidfRanker import TfidfRanker
 
+FUSIONS = ("minmax", "zscore", "rrf", "weighted")
+GATES = ("margin", "entropy")
+
+# thread pools by number of workers, shared by all hybrid rankers
+_pools: Dict[int, ThreadPoolExecutor] = {}
+_pools_lock = threading.Lock()
+POOL_THREAD_PREFIX = "HybridRanker"
+
+
+def thread_pool(workers: int) -> ThreadPoolExecutor:
+    """
+    Gets the thread pool shared by all hybrid rankers with this number of workers.
+
+    :param workers: The number of threads
+    :type workers: int
+
+    :return: The thread pool
+    """
+    with _pools_lock:
+        if workers not in _pools:
+            _pools[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=POOL_THREAD_PREFIX)
+        return _pools[workers]
+
+
+def format_weights(weights: Union[float, List[float]]) -> str:
+    """
+    Formats a weight or a row of weights for ranker names, e.g. "0.5" or "0.2_0.8".
+    """
+    if isinstance(weights, (list, tuple, np.ndarray)):
+        return "_".join(str(weight) for weight in weights)
+    return str(weights)
+
+
+def fuse(scores: np.ndarray, weights: np.ndarray, fusion: str = "minmax", rrf_k: int = 60) -> np.ndarray:
+    """
+    Combines the scores of several rankers over the same chunks, in time linear in the number of chunks.
+
+    :param scores: The scores of each ranker, as a (rankers x chunks) array
+    :type scores: np.ndarray
+    :param weights: The weight of each ranker, or a (variants x rankers) array of weights to fuse several ways at once
+    :type weights: np.ndarray
+    :param fusion: How scores are made comparable before the weighted sum, defaults to "minmax".
+        "minmax" scales each ranker's scores to [0, 1], "zscore" standardises them, "rrf" replaces them by reciprocal
+        ranks 1 / (rrf_k + rank), and "weighted" sums the raw scores.
+    :type fusion: str, optional
+    :param rrf_k: The rank offset of reciprocal rank fusion, defaults to 60
+    :type rrf_k: int, optional
+
+    :return: The combined score of each chunk, for each row of weights if there are several
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if scores.shape[1] == 0:
+        return np.zeros(np.shape(weights)[:-1] + (0,))
+    if fusion == "minmax":
+        lowest = scores.min(axis=1, keepdims=True)
+        spread = scores.max(axis=1, keepdims=True) - lowest
+        # rankers scoring every chunk the same contribute nothing
+        scores = np.divide(scores - lowest, spread, out=np.zeros_like(scores), where=spread > 0)
+    elif fusion == "zscore":
+        deviation = scores.std(axis=1, keepdims=True)
+        scores = np.divide(scores - scores.mean(axis=1, keepdims=True), deviation, out=np.zeros_like(scores), where=deviation > 0)
+    elif fusion == "rrf":
+        ranks = np.empty_like(scores)
+        order = np.argsort(-scores, axis=1, kind="stable")
+        np.put_along_axis(ranks, order, np.arange(1, scores.shape[1] + 1, dtype=np.float64)[None, :], axis=1)
+        scores = 1 / (rrf_k + ranks)
+    elif fusion != "weighted":
+        raise ValueError(f"Unknown fusion {fusion}, expected one of {FUSIONS}")
+    return np.asarray(weights, dtype=np.float64) @ scores
+
 
 class HybridRanker(Ranker):
 
     def __init__(self, top_k: int, name=None,
                  sparse: Ranker = TfidfRanker(top_k=5),
                  dense: Ranker = CrossEncodingRanker(top_k=5),
-                 sparse_weight: float = 0.5):
+                 sparse_weight: Union[float, List[float]] = 0.5,
+                 rankers: List[Ranker] = None,
+                 weights: Union[List[float], List[List[float]]] = None,
+                 fusion: str = "minmax",
+                 rrf_k: int = 60,
+                 workers: int = None,
+                 gate: str = None,
+                 gate_threshold: float = 0.5,
+                 gate_action: str = "skip",
+                 gate_depth: int = 20):
         """
         :param top_k: The number of chunks to return
         :type top_k: int
+        :param sparse: The sparse ranker, unless rankers are given
+        :type sparse: Ranker, optional
+        :param dense: The dense ranker, unless rankers are given
+        :type dense: Ranker, optional
+        :param sparse_weight: The weight of the sparse ranker, the dense ranker gets the rest, defaults to 0.5.
+            A list of weights sweeps them: the component scores are computed once per query, and each weight is a variant.
+        :type sparse_weight: Union[float, list[float]], optional
+        :param rankers: Any number of rankers to combine instead of sparse and dense, defaults to None
+        :type rankers: list[Ranker], optional
+        :param weights: The weight of each of the rankers, or a list of such weights to sweep, defaults to None - equal weights
+        :type weights: Union[list[float], list[list[float]]], optional
+        :param fusion: How the scores are combined, one of "minmax", "zscore", "rrf" or "weighted", defaults to "minmax"
+        :type fusion: str, optional
+        :param rrf_k: The rank offset of reciprocal rank fusion, defaults to 60
+        :type rrf_k: int, optional
+        :param workers: The number of threads initialising and scoring the components concurrently, defaults to None - one after another.
+            Model inference releases the GIL, so e.g. TF-IDF scoring overlaps with a cross-encoder forward pass.
+        :type workers: int, optional
+        :param gate: How decisive the scores of the first (sparse) ranker must be to spare the other rankers, defaults to None - never.
+            "margin" gates questions where the min-max normalised gap between the two best chunks is at least gate_threshold.
+            "entropy" gates questions where the entropy of the normalised scores, divided by its maximum, is at most gate_threshold.
+        :type gate: str, optional
+        :param gate_threshold: The threshold of the gate, defaults to 0.5
+        :type gate_threshold: float, optional
+        :param gate_action: What gated questions do, defaults to "skip".
+            "skip" ranks them by the first ranker alone. "shortlist" scores only its gate_depth best chunks with the other rankers,
+            if they can score a subset of the chunks (`score_chunks`), and gives the rest their lowest score.
+        :type gate_action: str, optional
+        :param gate_depth: The number of chunks shortlisted for gated questions, defaults to 20
+        :type gate_depth: int, optional
         """
         super().__init__(top_k, name)
+        assert fusion in FUSIONS, f"fusion must be one of {FUSIONS}"
+        assert gate is None or gate in GATES, f"gate must be one of {GATES}"
+        assert gate_action in ("skip", "shortlist"), "gate_action must be one of 'skip' or 'shortlist'"
+        if rankers is None:
+            rankers = [sparse, dense]
+            sweep = isinstance(sparse_weight, (list, tuple))
+            sweep_values = list(sparse_weight) if sweep else [sparse_weight]
+            weights = [[weight, 1 - weight] for weight in sweep_values]
+            label = f"_{sparse.name}_{dense.name}"
+            self.sparse_weight = sparse_weight
+        else:
+            weights = [1 / len(rankers)] * len(rankers) if weights is None else weights
+            sweep = isinstance(weights[0], (list, tuple))
+            sweep_values = list(weights) if sweep else [weights]
+            weights = [list(row) for row in sweep_values]
+            assert all(len(row) == len(rankers) for row in weights), "There must be one weight per ranker"
+            label = "".join(f"_{ranker.name}" for ranker in rankers)
+            self.sparse_weight = weights[0][0]
+        suffix = "" if fusion == "minmax" else f"_{fusion}"
+        if gate is not None:
+            suffix += f"_{gate}{gate_threshold}_{gate_action}" + (f"{gate_depth}" if gate_action == "shortlist" else "")
+
+        # each variant is named like the ranker with only its weight, so its results line up with separate runs
+        values = [format_weights(swept) for swept in sweep_values]
         if name is None:
-            self.name += f"_{sparse.name}_{dense.name}_{sparse_weight}"
+            self.name += f"{label}_{'-'.join(values)}{suffix}"
+            self.variant_names = [self.__class__.__name__ + f"_{top_k}{label}_{value}{suffix}" for value in values]
+        else:
+            self.variant_names = [f"{name}_{value}" for value in values] if sweep else [name]
+
+        self.rankers = rankers
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.fusion = fusion
+        self.rrf_k = rrf_k
+        self.workers = workers
+        # seconds spent per stage, in total and by each component, since the last pop_stats
+        self.timings: Dict[str, float] = {}
+        self.gate = gate
+        self.gate_threshold = gate_threshold
+        self.gate_action = gate_action
+        self.gate_depth = gate_depth
+        # the number of questions and their scoring seconds, gated or not, and the seconds saved, since the last pop_stats
+        self.gate_stats = {"gated": 0, "gated seconds": 0.0, "not gated": 0, "not gated seconds": 0.0, "saved seconds": 0.0}
+        # the seconds each component spent scoring and the number of chunks it scored, kept across pop_stats,
+        # so the seconds saved by gating are estimated against scoring every chunk
+        self.scoring_seconds = np.zeros(len(rankers))
+        self.scored_chunks = np.zeros(len(rankers))
+        self.sparse_ranker = rankers[0]
+        self.dense_ranker = rankers[-1]
+
+    def run_components(self, stage: str, call: Callable[[Ranker], Any], rankers: List[Ranker] = None,
+                       return_seconds: bool = False) -> Union[List[Any], List[Tuple[Any, float]]]:
+        """
+        Calls every component, concurrently on the shared thread pool if the ranker has workers, and times each call.
+
+        :param stage: The name of the stage in the timings
+        :type stage: str
+        :param call: The function called with each component
+        :type call: Callable[[Ranker], Any]
+        :param rankers: The components to call, defaults to None - all of them
+        :type rankers: list[Ranker], optional
+        :param return_seconds: Whether to return the seconds of each call with its result, defaults to False
+        :type return_seconds: bool, optional
 
-        self.sparse_ranker = sparse
-        self.dense_ranker = dense
-        self.sparse_weight = sparse_weight
+        :return: The result of each call, in the order of the components
+        """
+        def timed(ranker: Ranker):
+            start_time = time.perf_counter()
+            result = call(ranker)
+            return result, time.perf_counter() - start_time
+
+        rankers = self.rankers if rankers is None else rankers
+        start_time = time.perf_counter()
+        # a hybrid ranker nested in another one (or in a ranker it runs) calls its components on the calling pool thread,
+        # since the outer tasks may hold every thread of the pool while they wait for it
+        nested = threading.current_thread().name.startswith(POOL_THREAD_PREFIX)
+        if self.workers is None or self.workers <= 1 or len(rankers) < 2 or nested:
+            outcomes = [timed(ranker) for ranker in rankers]
+        else:
+            outcomes = list(thread_pool(self.workers).map(timed, rankers))
+        self.timings[f"{stage} seconds"] = self.timings.get(f"{stage} seconds", 0.0) + time.perf_counter() - start_time
+        for ranker, (_, seconds) in zip(rankers, outcomes):
+            key = f"{stage} seconds ({ranker.name})"
+            self.timings[key] = self.timings.get(key, 0.0) + seconds
+        if return_seconds:
+            return outcomes
+        return [result for result, _ in outcomes]
 
     def init_chunks(self, chunks: List[str]):
         self.chunks = chunks
-        self.sparse_ranker.init_chunks(chunks)
-        self.dense_ranker.init_chunks(chunks)
-
-    def rank(self, query: str, return_similarities: bool = False) -> Union[List[str], List[Tuple[str, float]]]:
-        # [(chunk, sim), ...]
-        sparse_rank: List[Tuple[str, float]] = self.sparse_ranker.rank(query, return_similarities=True)
-        dense_rank: List[Tuple[str, float]] = self.dense_ranker.rank(query, return_similarities=True)
-
-        # print("")
-        # print(sparse_rank[:5])
-        # print(dense_rank[:5])
-        # print("")
-
-        # make sure all chunks appear in both rankings
-        sparse_chunks = [x[0] for x in sparse_rank]
-        dense_chunks = [x[0] for x in dense_rank]
-        assert set(sparse_chunks) == set(dense_chunks) == set(self.chunks), f"Chunks in sparse and dense rankings do not match. {set(sparse_chunks) - set(dense_chunks)} in sparse but not dense, {set(dense_chunks) - set(sparse_chunks)} in dense but not sparse."
-
-        # normalize rankings
-        sparse_rank_max = max(sparse_rank, key=lambda x: x[1])[1]
-        sparse_rank_min = min(sparse_rank, key=lambda x: x[1])[1]
-        dense_rank_max = max(dense_rank, key=lambda x: x[1])[1]
-        dense_rank_min = min(dense_rank, key=lambda x: x[1])[1]
-
-        sparse_rank = [(x[0], (x[1] - sparse_rank_min) / (sparse_rank_max - sparse_rank_min)) for x in sparse_rank]
-        # replace NaNs with 0
-        sparse_rank = [(x[0], 0 if np.isnan(x[1]) else x[1]) for x in sparse_rank]
-        dense_rank = [(x[0], (x[1] - dense_rank_min) / (dense_rank_max - dense_rank_min)) for x in dense_rank]
-        # replace NaNs with 0
-        dense_rank = [(x[0], 0 if np.isnan(x[1]) else x[1]) for x in dense_rank]
-
-        # print("")
-        # print(sparse_rank[:5])
-        # print(dense_rank[:5])
-        # print("")
-
-        # Combine the two rankings
-        combined_rank = []
-        for i in range(len(sparse_rank)):
-            current_chunk = sparse_rank[i][0]
-            sparse_sim = sparse_rank[i][1]
-            dense_sim = dense_rank[dense_chunks.index(current_chunk)][1]
-            combined_sim = self.sparse_weight * sparse_sim + (1 - self.sparse_weight) * dense_sim
-            combined_rank.append((current_chunk, combined_sim))
-        combined_rank.sort(key=lambda x: x[1], reverse=True)
-
-        if return_similarities:
-            return combined_rank
-
-        return [x[0] for x in combined_rank[:self.top_k]]
+        self.run_components("Initialising", lambda ranker: ranker.init_chunks(chunks))
+
+    def add_chunks(self, chunks: List[str]):
+        self.chunks = list(self.chunks) + list(chunks)
+        for ranker in self.rankers:
+            ranker.add_chunks(chunks)
+
+    def remove_chunks(self, chunks: List[str]):
+        removed = set(chunks)
+        self.chunks = [chunk for chunk in self.chunks if chunk not in removed]
+        for ranker in self.rankers:
+            ranker.remove_chunks(chunks)
+
+    def pop_stats(self) -> Dict[str, float]:
+        stats, self.timings = self.timings, {}
+        if self.gate is not None:
+            gate_stats, self.gate_stats = self.gate_stats, dict.fromkeys(self.gate_stats, 0)
+            questions = gate_stats["gated"] + gate_stats["not gated"]
+            gated_mean = gate_stats["gated seconds"] / gate_stats["gated"] if gate_stats["gated"] else 0.0
+            not_gated_mean = gate_stats["not gated seconds"] / gate_stats["not gated"] if gate_stats["not gated"] else 0.0
+            stats["Gated fraction"] = gate_stats["gated"] / questions if questions else 0.0
+            stats["Mean scoring seconds (gated)"] = gated_mean
+            stats["Mean scoring seconds (not gated)"] = not_gated_mean
+            stats["Estimated scoring seconds saved"] = gate_stats["saved seconds"]
+            stats["Estimated scoring seconds saved per question"] = gate_stats["saved seconds"] / questions if questions else 0.0
+        for ranker in self.rankers:
+            stats.update({f"{stat} ({ranker.name})": value for stat, value in ranker.pop_stats().items()})
+        return stats
+
+    def component_path(self, path: str, i: int) -> str:
+        # sparse and dense keep their own directories, so earlier saves still load
+        if len(self.rankers) == 2:
+            return os.path.join(path, ("sparse", "dense")[i])
+        return os.path.join(path, str(i))
+
+    def save_state(self, path: str):
+        for i, ranker in enumerate(self.rankers):
+            ranker.save(self.component_path(path, i))
+
+    def load_state(self, path: str):
+        for i, ranker in enumerate(self.rankers):
+            ranker.load(self.component_path(path, i), self.chunks)
+
+    def fused_scores(self, query: str) -> np.ndarray:
+        """
+        Scores every chunk with each component once, and fuses the scores for every variant.
+        :param query: The query
+        :type query: str
+
+        :return: The scores of the chunks, as a (variants x chunks) array
+        """
+        if self.gate is None:
+            scores = self.run_components("Scoring", lambda ranker: ranker.score(query))
+            weights = self.weights
+        else:
+            scores, weights = self.gated_scores(query)
+        assert all(len(ranker_scores) == len(self.chunks) for ranker_scores in scores), "The rankers do not score the same chunks"
+        return fuse(np.vstack(scores), weights, self.fusion, self.rrf_k)
+
+    def decisive(self, scores: np.ndarray) -> bool:
+        """
+        Decides whether the scores of the first ranker pass the gate.
+        :param scores: The scores of the first ranker
+        :type scores: np.ndarray
+
+        :return: Whether the other rankers can be spared
+        """
+        if len(scores) < 2:
+            return True
+        normalised = fuse(scores[None, :], np.ones(1), "minmax")
+        if self.gate == "margin":
+            # the best chunk scores 1 unless all chunks score the same
+            second, first = np.partition(normalised, len(normalised) - 2)[-2:]
+            return first - second >= self.gate_threshold
+        total = normalised.sum()
+        if total == 0:
+            return False
+        probabilities = normalised[normalised > 0] / total
+        entropy = -(probabilities * np.log(probabilities)).sum() / np.log(len(scores))
+        return entropy <= self.gate_threshold
+
+    def shortlist_scores(self, ranker: Ranker, query: str, shortlist: np.ndarray) -> np.ndarray:
+        """
+        Scores only the shortlisted chunks with a component, and gives the others its lowest score.
+        Components without `score_chunks` score every chunk.
+        """
+        if not hasattr(ranker, "score_chunks"):
+            return ranker.score(query)
+        shortlist_scores = ranker.score_chunks(query, [self.chunks[i] for i in shortlist])
+        scores = np.full(len(self.chunks), shortlist_scores.min() if len(shortlist_scores) else 0, dtype=np.float64)
+        scores[shortlist] = shortlist_scores
+        return scores
+
+    def gated_scores(self, query: str) -> Tuple[List[np.ndarray], np.ndarray]:
+        """
+        Scores the chunks with the first ranker, and with the others unless the first is decisive.
+        :param query: The query
+        :type query: str
+
+        :return: The scores of each ranker used, and the weights to fuse them with
+        """
+        start_time = time.perf_counter()
+        first_scores = self.run_components("Scoring", lambda ranker: ranker.score(query), self.rankers[:1])[0]
+        gated = self.decisive(first_scores)
+        others = self.rankers[1:]
+        if gated and self.gate_action == "skip":
+            scores, weights, seconds = [first_scores], np.ones((len(self.weights), 1)), np.zeros(len(others))
+        else:
+            if gated:
+                shortlist = top_k_indices(first_scores, self.gate_depth)
+                outcomes = self.run_components("Scoring", lambda ranker: self.shortlist_scores(ranker, query, shortlist), others, return_seconds=True)
+                scored = [len(shortlist) if hasattr(ranker, "score_chunks") else len(self.chunks) for ranker in others]
+            else:
+                outcomes = self.run_components("Scoring", lambda ranker: ranker.score(query), others, return_seconds=True)
+                scored = [len(self.chunks)] * len(others)
+            scores = [first_scores] + [ranker_scores for ranker_scores, _ in outcomes]
+            weights = self.weights
+            seconds = np.array([ranker_seconds for _, ranker_seconds in outcomes])
+            self.scoring_seconds[1:] += seconds
+            self.scored_chunks[1:] += scored
+
+        if gated:
+            # the ungated ranker would have scored every chunk with the other rankers, at the seconds per chunk they took so far.
+            # Rankers that have not scored any chunks yet are left out.
+            measured = self.scored_chunks[1:] > 0
+            per_chunk = self.scoring_seconds[1:][measured] / self.scored_chunks[1:][measured]
+            self.gate_stats["saved seconds"] += float((per_chunk * len(self.chunks) - seconds[measured]).sum())
+
+        outcome = "gated" if gated else "not gated"
+        self.gate_stats[outcome] += 1
+        self.gate_stats[f"{outcome} seconds"] += time.perf_counter() - start_time
+        return scores, weights
+
+    def score(self, query: str) -> np.ndarray:
+        # the first variant, when sweeping weights
+        return self.fused_scores(query)[0]
+
+    def variants(self) -> List[str]:
+        return self.variant_names
+
+    def score_variants(self, query: str) -> Dict[str, np.ndarray]:
+        return dict(zip(self.variant_names, self.fused_scores(query)))
+
+    def rank_variants(self, query: str, return_similarities: bool = False) -> Dict[str, Union[List[str], List[Tuple[str, float]]]]:
+        rankings = {}
+        for variant, scores in self.score_variants(query).items():
+            if return_similarities:
+                rankings[variant] = [(self.chunks[i], scores[i]) for i in np.argsort(-scores, kind="stable")]
+            else:
+                rankings[variant] = [self.chunks[i] for i in top_k_indices(scores, self.top_k)]
+        return rankings
 
     def batch_rank(self, queries: List[str], batch_size: int = 100) -> List[List[str]]:
-        raise NotImplementedError
+        return [self.rank(query) for query in queries]
@@ -0,0 +1,145 @@
+import hashlib
+import string
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List
+
+import contractions
+import nltk
+from nltk.corpus import stopwords
+from nltk.stem import PorterStemmer
+
+try:
+    nltk.data.find('corpora/stopwords')
+except LookupError:
+    nltk.download('stopwords')
+
+
+class Preprocessor:
+    """
+    Normalises text for the sparse rankers: expands contractions, strips punctuation, lowercases, removes stopwords,
+    stems and drops non-alphabetic tokens.
+
+    Stems are memoized per token, and whole results are kept in an LRU keyed by a hash of the text, so chunks and
+    questions shared between rankers and chunkers are only processed once.
+    """
+    stop_words = set(stopwords.words('english'))
+    punctuation = str.maketrans("", "", string.punctuation)
+
+    def __init__(self, max_size: int = 65536, stem_cache_size: int = 1 << 18):
+        """
+        :param max_size: The number of preprocessed texts kept in memory, defaults to 65536
+        :type max_size: int, optional
+        :param stem_cache_size: The number of stemmed tokens kept in memory, defaults to 262144
+        :type stem_cache_size: int, optional
+        """
+        self.max_size = max_size
+        self.stem_cache_size = stem_cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict = OrderedDict()
+        # rankers scoring concurrently (e.g. in a HybridRanker) share the text cache
+        self._lock = threading.Lock()
+        self.stem = lru_cache(maxsize=stem_cache_size)(PorterStemmer().stem)
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def process(self, text: str) -> str:
+        """
+        Preprocesses a text, bypassing the text cache.
+
+        :param text: The text
+        :type text: str
+
+        :return: The preprocessed tokens, joined with spaces
+        """
+        text = contractions.fix(text).translate(self.punctuation).lower()
+        tokens = (self.stem(word) for word in text.split() if word not in self.stop_words)
+        return ' '.join(token for token in tokens if token.isalpha())
+
+    def process_batch(self, texts: List[str]) -> List[str]:
+        return [self.process(text) for text in texts]
+
+    def preprocess_chunk(self, text: str) -> str:
+        """
+        Preprocesses a text, using the text cache.
+
+        :param text: The text
+        :type text: str
+
+        :return: The preprocessed tokens, joined with spaces
+        """
+        return self.preprocess_many([text])[0]
+
+    def preprocess_many(self, texts: List[str], workers: int = None, chunksize: int = None) -> List[str]:
+        """
+        Preprocesses many texts, sending the ones that are not cached yet to a process pool.
+
+        :param texts: The texts
+        :type texts: list[str]
+        :param workers: The number of worker processes, defaults to None - preprocesses in the current process
+        :type workers: int, optional
+        :param chunksize: The number of texts sent to a worker at once, defaults to None - a quarter of each worker's share
+        :type chunksize: int, optional
+
+        :return: The preprocessed texts
+        """
+        keys = [self.key(text) for text in texts]
+        missing, processed = {}, {}
+        with self._lock:
+            for key, text in zip(keys, texts):
+                if key in self._cache:
+                    self.hits += 1
+                    self._cache.move_to_end(key)
+                    processed[key] = self._cache[key]
+                elif key not in missing:
+                    self.misses += 1
+                    missing[key] = text
+
+        if workers is None or workers <= 1 or len(missing) < 2:
+            results = self.process_batch(list(missing.values()))
+        else:
+            if chunksize is None:
+                chunksize = max(1, len(missing) // (4 * workers))
+            batches = list(missing.values())
+            batches = [batches[i:i + chunksize] for i in range(0, len(batches), chunksize)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = [result for batch in executor.map(self.process_batch, batches) for result in batch]
+
+        processed.update(zip(missing.keys(), results))
+        with self._lock:
+            for key, result in zip(missing.keys(), results):
+                self._cache[key] = result
+                if len(self._cache) > self.max_size:
+                    self._cache.popitem(last=False)
+        return [processed[key] for key in keys]
+
+    def __getstate__(self):
+        # the preprocessor is pickled for every batch sent to a process pool, so the caches are left behind
+        state = self.__dict__.copy()
+        state['_cache'] = OrderedDict()
+        del state['stem']
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self.stem = lru_cache(maxsize=self.stem_cache_size)(PorterStemmer().stem)
+
+    def clear(self):
+        """
+        Empties the text and stem caches.
+        """
+        self._cache.clear()
+        self.stem.cache_clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# shared by all sparse rankers unless they are given their own preprocessor
+default_preprocessor = Preprocessor()
@@ -44,6 +44,7 @@ class PromptRanker(Ranker):
         self.api_key = api_key
         self.prompt = prompt
         self.paragraphs = {}
+        self.sections = None
         if api_key is None:
             try:
                 self.api_key = os.environ["HUGGINGFACE_API_KEY"]
@@ -56,9 +57,19 @@ class PromptRanker(Ranker):
 
         self.model = ranker
 
-    def init_chunks(self, chunks: List[str], paragraphs: Dict[str, str] = None):
+    def init_chunks(self, chunks: List[str], paragraphs: Dict[str, str] = None, sections: Dict[str, List[int]] = None):
+        """
+        Initialises the ranker with a list of chunks.
+        :param chunks: The chunks
+        :type chunks: list[str]
+        :param paragraphs: The text of each section of the document, by section name, defaults to None
+        :type paragraphs: dict[str, str], optional
+        :param sections: The indices of the chunks of each section, e.g. from `SectionChunker.chunk_sections`, defaults to None - recovered by searching the paragraphs on every query
+        :type sections: dict[str, list[int]], optional
+        """
         self.chunks: List[str] = chunks
         self.paragraphs: Dict[str, str] = paragraphs
+        self.sections: Dict[str, List[int]] = sections
         if paragraphs is None:
             self.paragraphs = {}
             warnings.warn(f"No paragraphs were given. The ranker will function as a regular {self.model.name}.")
@@ -73,16 +84,21 @@ class PromptRanker(Ranker):
 
         # print(paragraphs_of_choice)
 
-        # get chunks that are in the paragraphs
-        chunks = [chunk for chunk in self.chunks if any(chunk.replace(' ', '') in self.paragraphs[paragraph].replace(' ', '') for paragraph in paragraphs_of_choice)]
-
-        # add chunks before and after the selected chunks to completely cover the paragraphs
-        for i, chunk in enumerate(self.chunks):
-            if chunk in chunks:
-                if i > 0 and self.chunks[i-1] not in chunks:
-                    chunks.append(self.chunks[i-1])
-                if i < len(self.chunks) - 1 and self.chunks[i+1] not in chunks:
-                    chunks.append(self.chunks[i+1])
+        if self.sections is not None:
+            # section-aware chunks never cross a section, so they are looked up directly
+            indices = sorted({i for paragraph in paragraphs_of_choice for i in self.sections.get(paragraph, [])})
+            chunks = [self.chunks[i] for i in indices]
+        else:
+            # get chunks that are in the paragraphs
+            chunks = [chunk for chunk in self.chunks if any(str(chunk).replace(' ', '') in self.paragraphs[paragraph].replace(' ', '') for paragraph in paragraphs_of_choice)]
+
+            # add chunks before and after the selected chunks to completely cover the paragraphs
+            for i, chunk in enumerate(self.chunks):
+                if chunk in chunks:
+                    if i > 0 and self.chunks[i-1] not in chunks:
+                        chunks.append(self.chunks[i-1])
+                    if i < len(self.chunks) - 1 and self.chunks[i+1] not in chunks:
+                        chunks.append(self.chunks[i+1])
 
         if len(chunks) == 0:
             # if the paragraphs are not in the chunks (i.e. they are smaller than their chunk), use the paragraphs
@@ -0,0 +1,184 @@
+import os
+
+import faiss
+import numpy as np
+from typing import List, Tuple, Iterable
+
+from retrieval.Ranker import Ranker
+from retrieval.Ranker.EmbeddingCache import EmbeddingCache
+from retrieval.Ranker.SentEmbeddingRanker import SentEmbeddingRanker
+
+# the number of set bits of every byte
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+class QuantizedSentEmbeddingRanker(SentEmbeddingRanker):
+    def __init__(
+            self,
+            top_k: int,
+            name=None,
+            cache: EmbeddingCache = None,
+            quantization: str = "int8",
+            rescore: bool = True,
+            rescore_depth: int = 100,
+            block_size: int = 4096,
+            query_block_size: int = 16,
+            **kwargs
+    ):
+        """
+        :param top_k: The number of chunks to return
+        :type top_k: int
+        :param cache: A cache of chunk and query embeddings, possibly shared with other rankers, defaults to None - every text is encoded
+        :type cache: EmbeddingCache, optional
+        :param quantization: How embeddings are stored, defaults to "int8".
+            "int8" keeps one byte per dimension in a FAISS scalar quantizer index (4x smaller than float32).
+            "binary" keeps one bit per dimension, the sign of the centered embedding (32x smaller), and shortlists chunks by Hamming distance.
+        :type quantization: str, optional
+        :param rescore: Whether binary shortlists are rescored with int8 codes (not the float32 embeddings), which are then stored as well, defaults to True.
+            One bit and one byte per dimension take about 3.6x less memory than float32.
+        :type rescore: bool, optional
+        :param rescore_depth: The number of chunks shortlisted per query for rescoring, defaults to 100
+        :type rescore_depth: int, optional
+        :param block_size: The number of binary codes compared with a block of queries at once, defaults to 4096
+        :type block_size: int, optional
+        :param query_block_size: The number of queries compared with a block of codes at once, defaults to 16.
+            A search takes memory for query_block_size x block_size codes, and for the shortlist of each query.
+        :type query_block_size: int, optional
+
+        :param kwargs: Keyword arguments for SentEmbeddingRanker, e.g. train_size or search_depth
+        :type kwargs: dict
+        """
+        assert quantization in ("int8", "binary"), "quantization must be one of 'int8' or 'binary'"
+        if name is None:
+            name = self.__class__.__name__ + f"_{top_k}_{quantization}"
+            if quantization == "binary" and rescore:
+                name += f"_rescore{rescore_depth}"
+        super().__init__(top_k, name, cache, index_factory="SQ8", **kwargs)
+
+        self.quantization = quantization
+        self.rescore = rescore
+        self.rescore_depth = rescore_depth
+        self.block_size = block_size
+        self.query_block_size = query_block_size
+
+        # the binary codes, and the int8 codes with the offset and step of every dimension
+        self.center = None
+        self.binary_codes = None
+        self.codes = None
+        self.minimum = None
+        self.step = None
+
+    def init_chunks(self, chunks: List[str]):
+        if self.quantization == "int8":
+            super().init_chunks(chunks)
+            return
+
+        self.chunks = chunks
+        vectors = self.encode(self.texts(self.chunks))
+        sample = vectors
+        if len(vectors) > self.train_size:
+            sample = vectors[np.random.default_rng(0).choice(len(vectors), self.train_size, replace=False)]
+
+        self.center = sample.mean(axis=0)
+        self.binary_codes = np.packbits(vectors > self.center, axis=1)
+        if self.rescore:
+            self.minimum = sample.min(axis=0)
+            self.step = np.maximum(sample.max(axis=0) - self.minimum, 1e-12) / 255
+            self.codes = np.clip(np.rint((vectors - self.minimum) / self.step), 0, 255).astype(np.uint8)
+        self.clear_corpus()
+
+    def init_chunk_stream(self, chunks: Iterable[str], batch_size: int = 256):
+        if self.quantization == "int8":
+            super().init_chunk_stream(chunks, batch_size)
+            return
+        # binary codes are centered on all chunks, so the chunks are collected first
+        Ranker.init_chunk_stream(self, chunks, batch_size)
+
+    def add_chunks(self, chunks: List[str]):
+        self.clear_selection()
+        Ranker.add_chunks(self, chunks)
+
+    def remove_chunks(self, chunks: List[str]):
+        self.clear_selection()
+        Ranker.remove_chunks(self, chunks)
+
+    def search_parameters(self, selector: faiss.IDSelector):
+        if self.quantization == "int8":
+            return super().search_parameters(selector)
+        # binary codes are searched by position, so the selection is kept for search to see
+        return selector
+
+    def hamming_shortlist(self, query_codes: np.ndarray, depth: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the chunks whose binary codes are closest to the codes of the queries.
+
+        :param query_codes: The binary codes of the queries
+        :type query_codes: np.ndarray
+        :param depth: The number of chunks to find per query
+        :type depth: int
+
+        :return: The Hamming distances and the positions of the chunks, closest first
+        """
+        codes = self.binary_codes[self.offset:self.offset + len(self.chunks)]
+        depth = min(depth, len(codes))
+        distances, positions = [], []
+        for query_start in range(0, len(query_codes), self.query_block_size):
+            queries = query_codes[query_start:query_start + self.query_block_size]
+            # the running shortlist of every query, keyed by distance and then position, so ties keep the earlier chunk
+            keys = np.empty((len(queries), 0), dtype=np.int64)
+            for start in range(0, len(codes), self.block_size):
+                block = codes[start:start + self.block_size]
+                block_distances = POPCOUNT[block[None, :, :] ^ queries[:, None, :]].sum(axis=2, dtype=np.int64)
+                keys = np.concatenate((keys, block_distances * len(codes) + np.arange(start, start + len(block))), axis=1)
+                if keys.shape[1] > depth:
+                    keys = np.partition(keys, depth - 1, axis=1)[:, :depth]
+            keys.sort(axis=1)
+            distances.append(keys // len(codes))
+            positions.append(keys % len(codes))
+        return np.concatenate(distances).astype(np.uint16), np.concatenate(positions)
+
+    def search(self, query_arr: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if self.quantization == "int8":
+            return super().search(query_arr, k)
+
+        k = min(k, len(self.chunks))
+        depth = min(max(k, self.rescore_depth), len(self.chunks)) if self.rescore else k
+        distances, candidates = self.hamming_shortlist(np.packbits(query_arr > self.center, axis=1), depth)
+        if not self.rescore:
+            # the inner product of two sign vectors
+            return (query_arr.shape[1] - 2 * distances.astype(np.float32)), candidates
+
+        # the inner products with the int8 codes, without decoding them to floats
+        weights = query_arr * self.step
+        scores = np.stack([self.codes[self.offset + positions].astype(np.float32) @ weight
+                           for positions, weight in zip(candidates, weights)])
+        scores += (query_arr @ self.minimum)[:, None]
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(candidates, order, axis=1)
+
+    def save_state(self, path: str):
+        if self.quantization == "int8":
+            super().save_state(path)
+            return
+        arrays = {"center": self.center, "binary_codes": self.binary_codes}
+        if self.rescore:
+            arrays.update({"codes": self.codes, "minimum": self.minimum, "step": self.step})
+        np.savez(os.path.join(path, "codes.npz"), **arrays)
+
+    def load_state(self, path: str):
+        if self.quantization == "int8":
+            super().load_state(path)
+            return
+        self.clear_corpus()
+        with np.load(os.path.join(path, "codes.npz")) as arrays:
+            self.center, self.binary_codes = arrays["center"], arrays["binary_codes"]
+            if self.rescore:
+                self.codes, self.minimum, self.step = arrays["codes"], arrays["minimum"], arrays["step"]
+
+    def memory_usage(self) -> int:
+        """
+        :return: The number of bytes taken up by the stored embeddings
+        """
+        if self.quantization == "int8":
+            return 0 if self.index is None else self.index.sa_code_size() * self.index.ntotal
+        return sum(array.nbytes for array in (self.binary_codes, self.codes) if array is not None)
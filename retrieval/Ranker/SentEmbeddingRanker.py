@@ -1,51 +1,328 @@
+import os
+import warnings
+
 import faiss
 import numpy as np
 import torch
 from sentence_transformers import SentenceTransformer
-from typing import List, Union, Tuple
+from typing import List, Union, Tuple, Iterable, Dict
 
+from retrieval.Chunker import batched
 from retrieval.Ranker import Ranker
+from retrieval.Ranker.EmbeddingCache import EmbeddingCache
 
 
 class SentEmbeddingRanker(Ranker):
-    def __init__(self, top_k: int, name=None):
+    def __init__(
+            self,
+            top_k: int,
+            name=None,
+            cache: EmbeddingCache = None,
+            index_factory: str = "Flat",
+            nprobe: int = None,
+            ef_search: int = None,
+            train_size: int = 65536,
+            search_depth: int = None
+    ):
         """
         :param top_k: The number of chunks to return
         :type top_k: int
+        :param cache: A cache of chunk and query embeddings, possibly shared with other rankers, defaults to None - every text is encoded
+        :type cache: EmbeddingCache, optional
+        :param index_factory: The FAISS index factory string, e.g. "IVF256,Flat", "IVF256,PQ16" or "HNSW32", defaults to "Flat" - exact search
+        :type index_factory: str, optional
+        :param nprobe: The number of inverted lists an IVF index visits per query, defaults to None - the FAISS default
+        :type nprobe: int, optional
+        :param ef_search: The size of the candidate list of an HNSW index, defaults to None - the FAISS default
+        :type ef_search: int, optional
+        :param train_size: The number of vectors sampled to train the index, if it needs training, defaults to 65536
+        :type train_size: int, optional
+        :param search_depth: The number of chunks searched for when ranking with similarities, defaults to None - all chunks. The other chunks get the lowest similarity found.
+        :type search_depth: int, optional
         """
         super().__init__(top_k, name)
         self.index = None
+        self.index_factory = index_factory
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.train_size = train_size
+        self.search_depth = search_depth
+        # when initialised with a corpus, searches are restricted to the ids of the selected document
+        self.corpus_chunks = None
+        self.corpus_offsets: Dict[str, Tuple[int, int]] = {}
+        self.offset = 0
+        self.search_params = None
+        # once chunks are added or removed, the index maps stable ids to vectors, and ids[i] is the id of chunks[i]
+        self.ids = None
+        # whether the index is an exact Flat index because there were too few vectors to train the configured one
+        self.flat_fallback = False
         if name is None:
-            self.name += ""
+            self.name += "" if index_factory == "Flat" else f"_{index_factory}"
+            self.name += "" if nprobe is None else f"_nprobe{nprobe}"
+            self.name += "" if ef_search is None else f"_efSearch{ef_search}"
 
         device = "cuda" if torch.cuda.is_available() else "cpu"
 
-        self.model = SentenceTransformer('paraphrase-MiniLM-L6-v2', device=device)
+        self.model_name = 'paraphrase-MiniLM-L6-v2'
+        self.model = SentenceTransformer(self.model_name, device=device)
+        self.cache = cache
+        self.stats = {"hits": 0, "misses": 0, "bytes_saved": 0, "flat fallbacks": 0}
 
-    def init_chunks(self, chunks: List[str]):
-        self.chunks: List[str] = chunks
-        vectors = self.model.encode(self.chunks)
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Encodes texts, only passing the ones missing from the cache to the model.
+
+        :param texts: The texts
+        :type texts: list[str]
+
+        :return: The embeddings, as a (texts x dimension) float32 array
+        """
+        if self.cache is None:
+            return np.vstack(self.model.encode(texts), dtype="float32")
+        vectors, hits, misses = self.cache.get(self.model_name, texts, self.model.encode, return_counts=True)
+        self.stats["hits"] += hits
+        self.stats["misses"] += misses
+        self.stats["bytes_saved"] += hits * vectors.shape[1] * 4
+        return vectors
 
-        embedding_size = len(vectors[0])
+    def pop_stats(self) -> Dict[str, float]:
+        stats, self.stats = self.stats, {"hits": 0, "misses": 0, "bytes_saved": 0, "flat fallbacks": 0}
+        popped = {}
+        if self.index_factory != "Flat":
+            # results of indexes that fell back to Flat are exact, not approximate
+            popped["Flat index fallbacks"] = stats["flat fallbacks"]
+        if self.cache is not None:
+            lookups = stats["hits"] + stats["misses"]
+            popped.update({
+                "Embedding cache hits": stats["hits"],
+                "Embedding cache hit rate": stats["hits"] / lookups if lookups else 0.0,
+                "Embedding bytes saved": stats["bytes_saved"],
+            })
+        return popped
 
-        chunks_arr: np.ndarray = np.vstack(vectors, dtype="float32")
+    def init_chunks(self, chunks: List[str]):
+        self.chunks: List[str] = chunks
+        chunks_arr: np.ndarray = self.encode(self.texts(self.chunks))
 
         # #### FAISS ####
-        self.index = faiss.index_factory(embedding_size, "Flat", faiss.METRIC_INNER_PRODUCT)
+        self.index = self.build_index(chunks_arr)
         self.index.add(chunks_arr)
+        self.clear_corpus()
 
-    def rank(self, query: str, return_similarities: bool = False) -> Union[List[str], List[Tuple[str, float]]]:
-        query_vector = self.model.encode([query])
-        query_arr: np.ndarray = np.vstack(query_vector, dtype="float32")
-        if return_similarities:
-            distances, indices = self.index.search(query_arr, len(self.chunks))
-            return [(self.chunks[i], d) for i, d in zip(indices[0], distances[0])]
+    def build_index(self, vectors: np.ndarray) -> faiss.Index:
+        """
+        Creates an empty index of the configured type, trained on a sample of the vectors if it needs training.
+
+        Falls back to an exact Flat index if there are too few vectors to train it, e.g. for a short document,
+        with a warning, and records it in `flat_fallback` and `pop_stats`.
+        :param vectors: The vectors that will be added to the index
+        :type vectors: np.ndarray
+
+        :return: The index
+        """
+        embedding_size = vectors.shape[1]
+        index = faiss.index_factory(embedding_size, self.index_factory, faiss.METRIC_INNER_PRODUCT)
+        self.flat_fallback = False
+        if not index.is_trained:
+            sample = vectors
+            if len(vectors) > self.train_size:
+                sample = vectors[np.random.default_rng(0).choice(len(vectors), self.train_size, replace=False)]
+            try:
+                index.train(sample)
+            except RuntimeError:
+                # FAISS needs at least as many training vectors as centroids
+                warnings.warn(f"Too few vectors ({len(sample)}) to train a {self.index_factory} index, "
+                              f"{self.name} falls back to an exact Flat index")
+                index = faiss.index_factory(embedding_size, "Flat", faiss.METRIC_INNER_PRODUCT)
+                self.flat_fallback = True
+                self.stats["flat fallbacks"] += 1
+        self.tune(index)
+        return index
+
+    def tune(self, index: faiss.Index):
+        """
+        Applies the nprobe and efSearch settings, where the index has them.
+
+        :param index: The index
+        :type index: faiss.Index
+        """
+        space = faiss.ParameterSpace()
+        for parameter, value in (("nprobe", self.nprobe), ("efSearch", self.ef_search)):
+            if value is None:
+                continue
+            try:
+                space.set_index_parameter(index, parameter, value)
+            except RuntimeError:
+                # not an IVF or HNSW index, e.g. after falling back to a Flat index
+                pass
+
+    def search_parameters(self, selector: faiss.IDSelector) -> faiss.SearchParameters:
+        """
+        Creates search parameters restricting a search to a selection of ids, of the type the index expects.
+
+        :param selector: The ids to search
+        :type selector: faiss.IDSelector
+
+        :return: The search parameters
+        """
+        index = faiss.downcast_index(self.index)
+        if isinstance(index, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+        if isinstance(index, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+        return faiss.SearchParameters(sel=selector)
+
+    def clear_corpus(self):
+        self.corpus_chunks = None
+        self.offset = 0
+        self.search_params = None
+        self.ids = None
+
+    def clear_selection(self):
+        if self.corpus_chunks is not None:
+            # added chunks join the corpus as a whole
+            self.chunks = self.corpus_chunks
+            self.offset = 0
+            self.search_params = None
+            self.corpus_chunks = None
+
+    def id_map(self):
+        """
+        Moves the vectors into an index with stable ids, so chunks can be removed without re-encoding the others.
+        """
+        self.clear_selection()
+        if self.ids is not None:
+            return
+        vectors = self.index.reconstruct_n(0, self.index.ntotal)
+        self.ids = np.arange(len(vectors), dtype="int64")
+        self.index = faiss.IndexIDMap2(faiss.index_factory(vectors.shape[1], "Flat", faiss.METRIC_INNER_PRODUCT))
+        self.index.add_with_ids(vectors, self.ids)
+
+    def add_chunks(self, chunks: List[str]):
+        if self.index is None:
+            self.init_chunks(chunks)
+            return
+        if self.index_factory != "Flat":
+            # approximate indexes are rebuilt, and with a cache only the added chunks are encoded
+            self.clear_selection()
+            super().add_chunks(chunks)
+            return
+        self.id_map()
+        chunks_arr: np.ndarray = self.encode(self.texts(chunks))
+        # ids only grow, so self.ids stays sorted
+        ids = np.arange(len(chunks), dtype="int64") + (int(self.ids[-1]) + 1 if len(self.ids) else 0)
+        self.index.add_with_ids(chunks_arr, ids)
+        self.ids = np.concatenate((self.ids, ids))
+        self.chunks = list(self.chunks) + list(chunks)
+
+    def remove_chunks(self, chunks: List[str]):
+        if self.index_factory != "Flat":
+            self.clear_selection()
+            super().remove_chunks(chunks)
+            return
+        self.id_map()
+        removed = set(chunks)
+        kept = np.array([chunk not in removed for chunk in self.chunks], dtype=bool)
+        self.index.remove_ids(self.ids[~kept])
+        self.ids = self.ids[kept]
+        self.chunks = [chunk for chunk, keep in zip(self.chunks, kept) if keep]
+
+    def init_corpus(self, documents: Dict[str, List[str]]):
+        # all chunks are encoded in one call, so the batches stay full however short the documents are
+        chunks, offsets = self.flatten_corpus(documents)
+        self.init_chunks(chunks)
+        self.corpus_chunks, self.corpus_offsets = chunks, offsets
+
+    def select_document(self, doc_id: str):
+        start, end = self.corpus_offsets[doc_id]
+        self.chunks = self.corpus_chunks[start:end]
+        self.offset = start
+        self.search_params = self.search_parameters(faiss.IDSelectorRange(start, end))
+
+    def search(self, query_arr: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Searches the index, within the selected document if there is one.
+
+        :param query_arr: The query vectors
+        :type query_arr: np.ndarray
+        :param k: The number of results per query, at most the number of chunks
+        :type k: int
+
+        :return: The similarities and the positions of the results in self.chunks, -1 where fewer than k were found
+        """
+        k = min(k, len(self.chunks))
+        if self.search_params is None:
+            distances, indices = self.index.search(query_arr, k)
+        else:
+            distances, indices = self.index.search(query_arr, k, params=self.search_params)
+        if self.ids is not None:
+            positions = np.searchsorted(self.ids, indices)
         else:
-            distances, indices = self.index.search(query_arr, self.top_k)
-            return [self.chunks[i] for i in indices[0]]
+            positions = indices - self.offset
+        # approximate indexes can find fewer than k chunks
+        return distances, np.where(indices < 0, -1, positions)
+
+    def init_chunk_stream(self, chunks: Iterable[str], batch_size: int = 256):
+        # encode and index one batch at a time, so only one batch of chunks is embedded at once.
+        # An index that needs training is trained on the first batch.
+        self.chunks = []
+        self.index = None
+        self.clear_corpus()
+        for batch in batched(chunks, batch_size):
+            chunks_arr: np.ndarray = self.encode(self.texts(batch))
+            if self.index is None:
+                self.index = self.build_index(chunks_arr)
+            self.index.add(chunks_arr)
+            self.chunks.extend(batch)
+
+    def save_state(self, path: str):
+        faiss.write_index(self.index, os.path.join(path, "index.faiss"))
+        if self.ids is not None:
+            np.save(os.path.join(path, "ids.npy"), self.ids)
+
+    def load_state(self, path: str):
+        try:
+            # the vectors stay on disk and are paged in as they are searched
+            self.index = faiss.read_index(os.path.join(path, "index.faiss"), faiss.IO_FLAG_MMAP)
+        except RuntimeError:
+            # not every index type can be memory-mapped
+            self.index = faiss.read_index(os.path.join(path, "index.faiss"))
+        self.tune(self.index)
+        self.clear_corpus()
+        if os.path.exists(os.path.join(path, "ids.npy")):
+            self.ids = np.load(os.path.join(path, "ids.npy"))
+
+    def rank(self, query: str, return_similarities: bool = False, doc_id: str = None) -> Union[List[str], List[Tuple[str, float]]]:
+        """
+        Ranks the chunks based on a query.
+        :param query: The query
+        :type query: str
+        :param return_similarities: Whether to return the similarities, defaults to False
+        :type return_similarities: bool, optional
+        :param doc_id: The document of the corpus to rank the chunks of, defaults to None - the selected document
+        :type doc_id: str, optional
+
+        :return: The top-k chunks ordered by relevance (descending)
+        """
+        if doc_id is not None:
+            self.select_document(doc_id)
+        if return_similarities:
+            return super().rank(query, return_similarities)
+        distances, indices = self.search(self.encode([query]), self.top_k)
+        return [self.chunks[i] for i in indices[0] if i >= 0]
+
+    def score(self, query: str) -> np.ndarray:
+        if len(self.chunks) == 0:
+            return np.zeros(0, dtype=np.float32)
+        depth = len(self.chunks) if self.search_depth is None else max(self.search_depth, self.top_k)
+        distances, indices = self.search(self.encode([query]), depth)
+        found = indices[0] >= 0
+        # chunks the search did not reach get the lowest similarity found
+        scores = np.full(len(self.chunks), distances[0][found].min() if found.any() else 0, dtype=np.float32)
+        scores[indices[0][found]] = distances[0][found]
+        return scores
 
     def batch_rank(self, queries: List[str], batch_size: int = 100) -> List[List[str]]:
-        query_vectors = self.model.encode(queries)
-        query_arr: np.ndarray = np.vstack(query_vectors, dtype="float32")
-        _, indices = self.index.search(query_arr, self.top_k)
-        return [[self.chunks[i] for i in indices[j]] for j in range(len(queries))]
+        query_arr: np.ndarray = self.encode(queries)
+        _, indices = self.search(query_arr, self.top_k)
+        return [[self.chunks[i] for i in indices[j] if i >= 0] for j in range(len(queries))]
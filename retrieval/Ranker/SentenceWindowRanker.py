@@ -0,0 +1,126 @@
+import numpy as np
+from typing import List, Union, Tuple, Dict
+
+from retrieval.Chunker import Chunk, Chunker
+from retrieval.Chunker.SentChunker import SentChunker
+from retrieval.Ranker import Ranker
+from retrieval.Ranker.TfidfRanker import TfidfRanker
+
+
+def aggregate_windows(scores: np.ndarray, starts: np.ndarray, ends: np.ndarray, aggregation: str = "max") -> np.ndarray:
+    """
+    Aggregates unit scores over (possibly overlapping) windows of units.
+
+    :param scores: The score of each unit
+    :type scores: np.ndarray
+    :param starts: The index of the first unit of each window
+    :type starts: np.ndarray
+    :param ends: The index after the last unit of each window
+    :type ends: np.ndarray
+    :param aggregation: One of "max", "mean" or "sum", defaults to "max"
+    :type aggregation: str, optional
+
+    :return: The score of each window
+    """
+    lengths = ends - starts
+    if len(scores) == 0:
+        return np.zeros(len(starts))
+
+    if aggregation == "max":
+        # every window starts at its own row of a strided view over the padded scores,
+        # as wide as the longest window, so the units past the end of shorter windows are masked
+        width = max(int(lengths.max()), 1)
+        padded = np.full(len(scores) + width, -np.inf)
+        padded[:len(scores)] = scores
+        windows = np.lib.stride_tricks.sliding_window_view(padded, width)[starts]
+        return np.where(np.arange(width) < lengths[:, None], windows, -np.inf).max(axis=1)
+
+    prefix = np.concatenate(([0.0], np.cumsum(scores, dtype=float)))
+    sums = prefix[ends] - prefix[starts]
+    if aggregation == "sum":
+        return sums
+    if aggregation == "mean":
+        return sums / np.maximum(lengths, 1)
+    raise ValueError(f"Unknown aggregation {aggregation}, expected one of 'max', 'mean' or 'sum'")
+
+
+class SentenceWindowRanker(Ranker):
+    def __init__(self, top_k: int, name=None, ranker: Ranker = TfidfRanker(top_k=5), aggregation: str = "max"):
+        """
+        :param top_k: The number of chunks to return
+        :type top_k: int
+        :param ranker: The ranker used to score the individual sentences
+        :type ranker: Ranker
+        :param aggregation: How sentence scores are combined into chunk scores, one of "max", "mean" or "sum", defaults to "max"
+        :type aggregation: str, optional
+        """
+        super().__init__(top_k, name)
+        if name is None:
+            self.name += f"_{ranker.name}_{aggregation}"
+
+        assert aggregation in ("max", "mean", "sum"), "aggregation must be one of 'max', 'mean' or 'sum'"
+
+        self.model = ranker
+        self.aggregation = aggregation
+
+        self.document = None
+        self.splitter_name = None
+        self.sentences: List[Chunk] = []
+        self.starts = None
+        self.ends = None
+        # sentence scores of the current document, by query
+        self.sentence_scores: Dict[str, np.ndarray] = {}
+
+    def init_chunks(self, chunks: List[str]):
+        # without sentence windows the chunks are ranked directly
+        self.chunks = chunks
+        self.starts = None
+        self.document = None
+        self.model.init_chunks(chunks)
+
+    def init_document(self, document: str, chunker: Chunker, chunks: List[str] = None, cache_dir: str = None):
+        if not isinstance(chunker, SentChunker):
+            super().init_document(document, chunker, chunks, cache_dir)
+            return
+
+        if self.starts is None or document != self.document or chunker.splitter_name != self.splitter_name:
+            # the sentences are indexed once per document and splitter, and reused by every chunk length and overlap
+            self.document = document
+            self.splitter_name = chunker.splitter_name
+            self.sentences = [Chunk(document, start, end) for start, end in chunker.sentence_spans(document)]
+            self.sentence_scores = {}
+            self.model.init_chunks(self.sentences)
+
+        if chunks is None:
+            chunks = chunker.chunk(document)
+        windows = chunker.window_array(len(self.sentences))
+        assert len(windows) == len(chunks), "The chunks do not match the sentence windows of the chunker"
+
+        self.chunks = chunks
+        self.starts, self.ends = windows[:, 0], windows[:, 1]
+
+    def score_sentences(self, query: str) -> np.ndarray:
+        """
+        Scores every sentence of the current document once per query.
+
+        :param query: The query
+        :type query: str
+
+        :return: The score of each sentence, in document order
+        """
+        if query not in self.sentence_scores:
+            self.sentence_scores[query] = self.model.score(query)
+        return self.sentence_scores[query]
+
+    def score(self, query: str) -> np.ndarray:
+        if self.starts is None:
+            return self.model.score(query)
+        return aggregate_windows(self.score_sentences(query), self.starts, self.ends, self.aggregation)
+
+    def rank(self, query: str, return_similarities: bool = False) -> Union[List[str], List[Tuple[str, float]]]:
+        if self.starts is None:
+            return self.model.rank(query, return_similarities=return_similarities)
+        return super().rank(query, return_similarities)
+
+    def batch_rank(self, queries: List[str], batch_size: int = 100) -> List[List[str]]:
+        return [self.rank(query) for query in queries]
@@ -1,29 +1,54 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, Future
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer, TfidfTransformer
 from sklearn.metrics.pairwise import cosine_similarity
-from nltk.corpus import stopwords
-import string
-import nltk
-import contractions
-from nltk.stem import PorterStemmer
-from typing import List, Union, Tuple
+from typing import List, Union, Tuple, Dict, Any
+
+from retrieval.Chunker import Chunker
+from retrieval.Chunker.SentChunker import SentChunker
+from retrieval.Ranker import Ranker, top_k_indices
+from retrieval.Ranker.Preprocessor import Preprocessor, default_preprocessor
 
-from retrieval.Ranker import Ranker
 
+def window_matrix(starts: np.ndarray, ends: np.ndarray, num_of_units: int) -> sp.csr_matrix:
+    """
+    Builds the sparse matrix that sums the rows of units into rows of windows.
 
-try:
-    nltk.data.find('corpora/stopwords')
-except LookupError:
-    nltk.download('stopwords')
+    :param starts: The index of the first unit of each window
+    :type starts: np.ndarray
+    :param ends: The index after the last unit of each window
+    :type ends: np.ndarray
+    :param num_of_units: The number of units
+    :type num_of_units: int
+
+    :return: A (windows x units) matrix with a one for every unit of every window
+    """
+    lengths = ends - starts
+    rows = np.repeat(np.arange(len(starts)), lengths)
+    # the offset of every entry within its window, added to the start of the window
+    columns = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+    return sp.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(len(starts), num_of_units))
 
 
 class TfidfRanker(Ranker):
-    stop_words = set(stopwords.words('english'))
-    stemmer = PorterStemmer()
+    stop_words = Preprocessor.stop_words
+    transformer_params = ('norm', 'use_idf', 'smooth_idf', 'sublinear_tf')
 
-    def __init__(self, top_k: int, name=None, **kwargs):
+    def __init__(self, top_k: int, name=None, sentence_windows: bool = False,
+                 preprocessor: Preprocessor = default_preprocessor, workers: int = None, **kwargs):
         """
         :param top_k: The number of chunks to return
         :type top_k: int
+        :param sentence_windows: Whether to vectorize documents chunked by a SentChunker once at sentence level, and build the vectors of any chunk length from the sentence vectors, defaults to False. Vocabulary pruning (min_df, max_df, max_features) is then applied to sentences.
+        :type sentence_windows: bool, optional
+        :param preprocessor: The preprocessor normalising chunks and queries, defaults to the one shared by all sparse rankers
+        :type preprocessor: Preprocessor, optional
+        :param workers: The number of processes preprocessing chunks that are not cached yet, defaults to None - the current process
+        :type workers: int, optional
 
         :param kwargs: Keyword arguments for the TfidfVectorizer
         :type kwargs: dict
@@ -31,52 +56,272 @@ class TfidfRanker(Ranker):
         super().__init__(top_k, name)
         if name is None and not kwargs == {}:
             self.name += f"_{kwargs}"
+        # the vectorizer holds the configuration. Chunks and queries are counted by the counter and weighted by the transformer,
+        # so a vocabulary and idf that were not fitted on the chunks (sentence windows, merges, saves) can be swapped in
         self.vectorizer = TfidfVectorizer(**kwargs)
+        self.counter = CountVectorizer(**self.count_params())
+        self.transformer = self.new_transformer()
+        self.preprocessor = preprocessor
+        self.workers = workers
         self.chunks = None
         self.vectors = None
 
+        # the chunks and vectors of all documents, when initialised with a corpus
+        self.corpus_chunks = None
+        self.corpus_vectors = None
+        self.corpus_offsets: Dict[str, Tuple[int, int]] = {}
+
+        self.sentence_windows = sentence_windows
+        self.document = None
+        self.splitter_name = None
+        self.sentence_counter = None
+        self.sentence_counts = None
+
+        # the raw term counts of the chunks, kept once chunks are added or removed
+        self.counts = None
+        # added and removed chunks are merged into the vectors on a background thread
+        self.merger: ThreadPoolExecutor = None
+        self.merge: Future = None
+
     def init_chunks(self, chunks: List[str]):
+        self.wait()
         self.chunks = chunks
         fit_chunks = self.preprocess(chunks)
-        self.vectors = self.vectorizer.fit_transform(fit_chunks)
+        self.transformer = self.new_transformer()
+        self.vectors = self.transformer.fit_transform(self.counter.fit_transform(fit_chunks))
+        self.corpus_chunks = None
+        self.counts = None
 
-    def rank(self, query: str, return_similarities: bool = False) -> Union[List[str], List[Tuple[str, float]]]:
-        query_vector = self.vectorizer.transform([self.preprocess_chunk(query)])
-        cosine_similarities = cosine_similarity(query_vector, self.vectors).flatten()
-        if return_similarities:
-            return [(self.chunks[i], cosine_similarities[i]) for i in cosine_similarities.argsort()[::-1]]
-        return [x for _, x in sorted(zip(cosine_similarities, self.chunks), reverse=True)][:self.top_k]
+    def init_corpus(self, documents: Dict[str, List[str]]):
+        # the vocabulary and idf are fitted on the chunks of every document
+        chunks, offsets = self.flatten_corpus(documents)
+        self.init_chunks(chunks)
+        self.corpus_chunks, self.corpus_offsets, self.corpus_vectors = chunks, offsets, self.vectors
 
-    def preprocess(self, chunks: List[str]) -> List[str]:
-        # remove punctuation, lowercase, and remove stopwords, if any
-        return [self.preprocess_chunk(chunk) for chunk in chunks]
+    def select_document(self, doc_id: str):
+        self.wait()
+        start, end = self.corpus_offsets[doc_id]
+        self.chunks = self.corpus_chunks[start:end]
+        self.vectors = self.corpus_vectors[start:end]
 
-    @staticmethod
-    def preprocess_chunk(chunk: str) -> str:
-        # Handle contractions
-        chunk = contractions.fix(chunk)
+    def init_document(self, document: str, chunker: Chunker, chunks: List[str] = None, cache_dir: str = None):
+        if not self.sentence_windows or not isinstance(chunker, SentChunker):
+            super().init_document(document, chunker, chunks, cache_dir)
+            return
+
+        self.wait()
+        self.corpus_chunks = None
+        self.counts = None
+        sentences = chunker.sentences(document)
+        if document != self.document or chunker.splitter_name != self.splitter_name:
+            # the document is preprocessed and counted once per splitter, for every chunk length and overlap
+            self.sentence_counter = CountVectorizer(**self.count_params())
+            self.sentence_counts = self.sentence_counter.fit_transform(self.preprocess(sentences))
+            self.document = document
+            self.splitter_name = chunker.splitter_name
+
+        windows = chunker.window_array(len(sentences))
+        counts = window_matrix(windows[:, 0], windows[:, 1], len(sentences)) @ self.sentence_counts
+        if self.vectorizer.binary:
+            counts.data[:] = 1
+
+        transformer = self.new_transformer()
+        self.vectors = transformer.fit_transform(counts)
+        self.set_vectorizer_state(self.sentence_counter.vocabulary_, transformer)
+
+        self.chunks = chunks if chunks is not None else chunker.chunk(document)
+
+    def count_params(self) -> Dict[str, Any]:
+        # the parameters of the vectorizer that configure counting
+        return {key: value for key, value in self.vectorizer.get_params().items() if key not in self.transformer_params}
+
+    def new_transformer(self) -> TfidfTransformer:
+        return TfidfTransformer(**{key: getattr(self.vectorizer, key) for key in self.transformer_params})
+
+    def set_vectorizer_state(self, vocabulary: Dict[str, int], transformer: TfidfTransformer):
+        """
+        Makes queries vectorize with a vocabulary and idf that were not fitted by the counter and the transformer.
+        :param vocabulary: The vocabulary, mapping terms to columns
+        :type vocabulary: dict[str, int]
+        :param transformer: The fitted transformer holding the idf
+        :type transformer: TfidfTransformer
+        """
+        self.counter.vocabulary_ = vocabulary
+        # the transformer is replaced rather than given a new idf_, since a fitted transformer
+        # keeps checking queries against the number of terms it was fitted with
+        self.transformer = transformer
+
+    def vectorize(self, texts: List[str]) -> sp.csr_matrix:
+        """
+        :param texts: The preprocessed texts
+        :type texts: list[str]
+
+        :return: The tf-idf vectors of the texts
+        """
+        return self.transformer.transform(self.counter.transform(texts))
+
+    @property
+    def online(self) -> bool:
+        # the vocabulary can only grow chunk by chunk if no term is pruned by its document frequency
+        return (self.vectorizer.vocabulary is None and self.vectorizer.max_features is None
+                and self.vectorizer.min_df == 1 and self.vectorizer.max_df == 1.0)
+
+    def count(self, texts: List[str], vocabulary: Dict[str, int]) -> sp.csr_matrix:
+        """
+        Counts the terms of preprocessed texts, adding unseen terms to the end of the vocabulary.
 
-        # Remove punctuation
-        chunk = chunk.translate(str.maketrans("", "", string.punctuation))
+        :param texts: The preprocessed texts
+        :type texts: list[str]
+        :param vocabulary: The vocabulary, mapping terms to columns, updated in place
+        :type vocabulary: dict[str, int]
 
-        # Lowercase
-        chunk = chunk.lower()
+        :return: The (texts x vocabulary) term counts
+        """
+        analyzer = self.vectorizer.build_analyzer()
+        indices, indptr = [], [0]
+        for text in texts:
+            indices.extend(vocabulary.setdefault(term, len(vocabulary)) for term in analyzer(text))
+            indptr.append(len(indices))
+        counts = sp.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(texts), len(vocabulary)))
+        counts.sum_duplicates()
+        return counts
+
+    def wait(self):
+        """
+        Waits until added and removed chunks are merged into the vectors.
+        """
+        if self.merge is not None:
+            merge, self.merge = self.merge, None
+            merge.result()
+
+    def segment(self):
+        """
+        Makes sure the raw term counts of all indexed chunks are known, before chunks are added or removed.
+        """
+        if self.corpus_chunks is not None:
+            # added chunks join the corpus as a whole
+            self.chunks, self.vectors = self.corpus_chunks, self.corpus_vectors
+            self.corpus_chunks = None
+        if self.counts is None:
+            # the preprocessed chunks are cached, so only counting is repeated
+            self.counts = self.count(self.preprocess(self.chunks), dict(self.counter.vocabulary_))
+
+    def add_chunks(self, chunks: List[str]):
+        self.wait()
+        if not self.online or self.chunks is None:
+            super().add_chunks(chunks)
+            return
+
+        self.segment()
+        vocabulary = dict(self.counter.vocabulary_)
+        delta = self.count(self.preprocess(chunks), vocabulary)
+        self.chunks = list(self.chunks) + list(chunks)
+        self.submit_merge([self.counts, delta], vocabulary)
+
+    def remove_chunks(self, chunks: List[str]):
+        self.wait()
+        if not self.online or self.chunks is None:
+            super().remove_chunks(chunks)
+            return
+
+        self.segment()
+        removed = set(chunks)
+        kept = np.array([chunk not in removed for chunk in self.chunks], dtype=bool)
+        self.chunks = [chunk for chunk, keep in zip(self.chunks, kept) if keep]
+        self.submit_merge([self.counts[kept]], dict(self.counter.vocabulary_))
+
+    def submit_merge(self, segments: List[sp.csr_matrix], vocabulary: Dict[str, int]):
+        if self.merger is None:
+            self.merger = ThreadPoolExecutor(max_workers=1)
+        self.merge = self.merger.submit(self.merge_segments, segments, vocabulary)
+
+    def merge_segments(self, segments: List[sp.csr_matrix], vocabulary: Dict[str, int]):
+        """
+        Stacks the term counts of the indexed and added chunks, and refreshes the idf and vectors from them.
+
+        The result ranks like a refit on the same chunks, without preprocessing any chunk again.
+        :param segments: The term counts of the chunks, in order. Earlier segments may have fewer columns.
+        :type segments: list[sp.csr_matrix]
+        :param vocabulary: The vocabulary of the last segment
+        :type vocabulary: dict[str, int]
+        """
+        num_of_terms = len(vocabulary)
+        counts = sp.vstack([sp.csr_matrix((segment.data, segment.indices, segment.indptr), shape=(segment.shape[0], num_of_terms))
+                            for segment in segments], format="csr")
+
+        # terms no chunk contains any more are dropped, as a refit would
+        used = np.bincount(counts.indices, minlength=num_of_terms) > 0
+        if not used.all():
+            columns = np.flatnonzero(used)
+            terms = np.empty(num_of_terms, dtype=object)
+            for term, column in vocabulary.items():
+                terms[column] = term
+            vocabulary = {term: i for i, term in enumerate(terms[columns])}
+            counts = counts[:, columns]
 
-        # Tokenize
-        tokens = chunk.split()
+        weights = counts.copy()
+        if self.vectorizer.binary:
+            weights.data[:] = 1
+        transformer = self.new_transformer()
+        self.vectors = transformer.fit_transform(weights)
+        self.counts = counts
+        self.set_vectorizer_state(vocabulary, transformer)
+        self.document = None
 
-        # Remove stopwords
-        tokens = [word for word in tokens if word not in TfidfRanker.stop_words]
+    def save_state(self, path: str):
+        self.wait()
+        with open(os.path.join(path, "vocabulary.json"), "w") as f:
+            json.dump({term: int(column) for term, column in self.counter.vocabulary_.items()}, f)
+        if self.vectorizer.use_idf:
+            np.save(os.path.join(path, "idf.npy"), self.transformer.idf_)
+        sp.save_npz(os.path.join(path, "vectors.npz"), self.vectors)
 
-        # Stem
-        tokens = [TfidfRanker.stemmer.stem(word) for word in tokens]
+    def load_state(self, path: str):
+        with open(os.path.join(path, "vocabulary.json"), "r") as f:
+            vocabulary = json.load(f)
+        transformer = self.new_transformer()
+        if self.vectorizer.use_idf:
+            transformer.idf_ = np.load(os.path.join(path, "idf.npy"))
+        else:
+            transformer.fit(sp.csr_matrix((1, len(vocabulary))))
+        self.set_vectorizer_state(vocabulary, transformer)
+        self.vectors = sp.load_npz(os.path.join(path, "vectors.npz"))
+        self.document = None
+        self.corpus_chunks = None
+        self.counts = None
 
-        # Remove non-alphabetic tokens
-        tokens = [word for word in tokens if word.isalpha()]
+    def rank(self, query: str, return_similarities: bool = False, doc_id: str = None) -> Union[List[str], List[Tuple[str, float]]]:
+        """
+        Ranks the chunks based on a query.
+        :param query: The query
+        :type query: str
+        :param return_similarities: Whether to return the similarities, defaults to False
+        :type return_similarities: bool, optional
+        :param doc_id: The document of the corpus to rank the chunks of, defaults to None - the selected document
+        :type doc_id: str, optional
+
+        :return: The top-k chunks ordered by relevance (descending)
+        """
+        self.wait()
+        if doc_id is not None:
+            self.select_document(doc_id)
+        return super().rank(query, return_similarities)
 
-        return ' '.join(tokens)
+    def score(self, query: str) -> np.ndarray:
+        self.wait()
+        query_vector = self.vectorize(self.preprocess([query]))
+        return cosine_similarity(query_vector, self.vectors).flatten()
+
+    def preprocess(self, chunks: List[str]) -> List[str]:
+        # remove punctuation, lowercase, and remove stopwords, if any
+        return self.preprocessor.preprocess_many(self.texts(chunks), workers=self.workers)
+
+    @staticmethod
+    def preprocess_chunk(chunk: str) -> str:
+        return default_preprocessor.preprocess_chunk(chunk)
 
     def batch_rank(self, queries: List[str], batch_size: int = 100) -> List[List[str]]:
-        query_vectors = self.vectorizer.transform([self.preprocess_chunk(query) for query in queries])
+        self.wait()
+        query_vectors = self.vectorize(self.preprocess(queries))
         cosine_similarities = cosine_similarity(query_vectors, self.vectors)
-        return [[x for _, x in sorted(zip(cosine_similarities[i], self.chunks), reverse=True)][:self.top_k] for i in range(len(queries))]
+        return [[self.chunks[i] for i in top_k_indices(row, self.top_k)] for row in cosine_similarities]
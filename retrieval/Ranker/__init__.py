@@ -1,10 +1,68 @@
+import hashlib
+import inspect
+import json
+import os
 import random
 from abc import ABC, abstractmethod
 
-from typing import List, Union, Tuple
+import numpy as np
+from typing import List, Union, Tuple, Iterable, Dict
+
+from retrieval.Chunker import batched, Chunk, Chunker
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Finds the indices of the k highest scores without sorting all of them.
+
+    :param scores: The scores
+    :type scores: np.ndarray
+    :param k: The number of indices to return
+    :type k: int
+
+    :return: The indices of the k highest scores, ordered by score (descending), ties by index
+    """
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    threshold = -np.partition(-scores, k - 1)[k - 1]
+    # chunks tied with the k-th score are taken by index, as a stable sort of all scores would
+    greater = np.flatnonzero(scores > threshold)
+    top = np.concatenate((greater, np.flatnonzero(scores == threshold)[:k - len(greater)]))
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def describe_config(value) -> str:
+    """
+    Describes a constructor argument of a ranker for its fingerprint.
+
+    :param value: The argument
+    :return: Its repr for plain values, the class and configuration for rankers, and the class for other objects,
+        whose repr would hold their address
+    """
+    if isinstance(value, Ranker):
+        return f"{value.__class__.__name__}({describe_config(value.config)})"
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{key!r}: {describe_config(item)}" for key, item in sorted(value.items(), key=lambda item: repr(item[0]))) + "}"
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(describe_config(item) for item in value) + "]"
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return repr(value)
+    return value.__class__.__qualname__
 
 
 class Ranker(ABC):
+    def __new__(cls, *args, **kwargs):
+        # score and rank have default implementations built on each other, so either one must be overridden
+        if cls.score is Ranker.score and cls.rank is Ranker.rank:
+            raise TypeError(f"Can't instantiate {cls.__name__} without an implementation of score or rank")
+        instance = super().__new__(cls)
+        # the arguments of the constructor, defaults included, identify the configuration in the fingerprint,
+        # since a custom name does not
+        arguments = inspect.signature(cls.__init__).bind_partial(instance, *args, **kwargs)
+        arguments.apply_defaults()
+        instance.config = {key: value for key, value in list(arguments.arguments.items())[1:] if key != "name"}
+        return instance
+
     def __init__(self, top_k: int, name: str = None):
         """
         :param top_k: The number of chunks to return
@@ -18,6 +76,17 @@ class Ranker(ABC):
         if name is None:
             self.name = self.__class__.__name__ + f"_{top_k}"
 
+    @staticmethod
+    def texts(chunks: List[Union[str, Chunk]]) -> List[str]:
+        """
+        Gets the text of each chunk, so rankers can be initialised with strings or `Chunk` objects alike.
+        :param chunks: The chunks
+        :type chunks: list[Union[str, Chunk]]
+
+        :return: The texts of the chunks
+        """
+        return [str(chunk) for chunk in chunks]
+
     @abstractmethod
     def init_chunks(self, chunks: List[str]):
         """
@@ -27,10 +96,226 @@ class Ranker(ABC):
         """
         raise NotImplementedError
 
-    @abstractmethod
+    def init_document(self, document: str, chunker: Chunker, chunks: List[str] = None, cache_dir: str = None):
+        """
+        Initialises the ranker with a document chunked by a chunker.
+
+        The default implementation calls `init_chunks`, or `init_chunks_cached` if a cache directory is given.
+        Rankers that can share work between chunkers of the same document (e.g. by indexing its sentences once)
+        override it.
+        :param document: The document
+        :type document: str
+        :param chunker: The chunker
+        :type chunker: Chunker
+        :param chunks: The chunks of the document, if already computed, defaults to None - chunks the document
+        :type chunks: list[str], optional
+        :param cache_dir: The directory of saved rankers to load from and save to, defaults to None - no caching
+        :type cache_dir: str, optional
+        """
+        if chunks is None:
+            chunks = chunker.chunk(document)
+        if cache_dir is None:
+            self.init_chunks(chunks)
+        else:
+            self.init_chunks_cached(chunks, cache_dir)
+
+    def init_chunk_stream(self, chunks: Iterable[str], batch_size: int = 256):
+        """
+        Initialises the ranker with a stream of chunks, e.g. from `Chunker.iter_chunks`, consumed in fixed-size batches.
+
+        The default implementation collects the batches and calls `init_chunks`.
+        Rankers that can index chunks incrementally override it to bound their peak memory.
+        :param chunks: The chunks
+        :type chunks: Iterable[str]
+        :param batch_size: The number of chunks consumed at once
+        :type batch_size: int
+        """
+        collected = []
+        for batch in batched(chunks, batch_size):
+            collected.extend(batch)
+        self.init_chunks(collected)
+
+    def add_chunks(self, chunks: List[Union[str, Chunk]]):
+        """
+        Adds chunks to the ranked chunks.
+
+        The default implementation initialises the ranker again with all chunks. Rankers that can update their index
+        in place override it.
+        :param chunks: The chunks to add
+        :type chunks: list[Union[str, Chunk]]
+        """
+        self.init_chunks(list(self.chunks or []) + list(chunks))
+
+    def remove_chunks(self, chunks: List[Union[str, Chunk]]):
+        """
+        Removes every occurrence of the given chunks from the ranked chunks.
+
+        The default implementation initialises the ranker again with the remaining chunks.
+        :param chunks: The chunks to remove
+        :type chunks: list[Union[str, Chunk]]
+        """
+        removed = set(chunks)
+        self.init_chunks([chunk for chunk in self.chunks if chunk not in removed])
+
+    def init_corpus(self, documents: Dict[str, List[Union[str, Chunk]]]):
+        """
+        Initialises the ranker with the chunks of many documents at once, building one index over all of them.
+        `select_document` then restricts ranking to the chunks of one document.
+
+        Not supported by default - rankers without it are initialised document by document.
+        :param documents: The chunks of each document, by document id
+        :type documents: dict[str, list[Union[str, Chunk]]]
+        """
+        raise NotImplementedError
+
+    def select_document(self, doc_id: str):
+        """
+        Restricts ranking to the chunks of one document of the corpus given to `init_corpus`.
+
+        :param doc_id: The id of the document
+        :type doc_id: str
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def flatten_corpus(documents: Dict[str, List[Union[str, Chunk]]]) -> Tuple[List[Union[str, Chunk]], Dict[str, Tuple[int, int]]]:
+        """
+        Concatenates the chunks of a corpus.
+
+        :param documents: The chunks of each document, by document id
+        :type documents: dict[str, list[Union[str, Chunk]]]
+
+        :return: All chunks, and the (start, end) positions of the chunks of each document among them
+        """
+        chunks, offsets = [], {}
+        for doc_id, document_chunks in documents.items():
+            offsets[doc_id] = (len(chunks), len(chunks) + len(document_chunks))
+            chunks.extend(document_chunks)
+        return chunks, offsets
+
+    def pop_stats(self) -> Dict[str, float]:
+        """
+        Returns the counters the ranker collected since the last call (e.g. cache hits), and resets them.
+
+        Experiments record them next to their timings. Empty by default.
+        :return: The value of each counter, by a readable name
+        """
+        return {}
+
+    def fingerprint(self, chunks: List[Union[str, Chunk]]) -> str:
+        """
+        Identifies the state of the ranker after initialising it with a list of chunks.
+
+        :param chunks: The chunks
+        :type chunks: list[Union[str, Chunk]]
+
+        :return: A hash of the ranker's class, the arguments it was constructed with and the texts of the chunks
+        """
+        fingerprint = hashlib.sha1(f"{self.__class__.__name__}-{describe_config(self.config)}".encode("utf-8"))
+        for text in self.texts(chunks):
+            # the length prefix keeps the boundaries between chunks part of the hash
+            fingerprint.update(f"{len(text)}:".encode("utf-8"))
+            fingerprint.update(text.encode("utf-8"))
+        return fingerprint.hexdigest()
+
+    def save(self, path: str):
+        """
+        Saves the initialised ranker to a directory, so it can be loaded without initialising it again.
+
+        :param path: The directory
+        :type path: str
+        """
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "chunks.json"), "w") as f:
+            json.dump(self.texts(self.chunks), f)
+        self.save_state(path)
+        # written last, so an interrupted save is not mistaken for a complete one
+        with open(os.path.join(path, "ranker.json"), "w") as f:
+            json.dump({"class": self.__class__.__name__, "name": self.name, "fingerprint": self.fingerprint(self.chunks)}, f)
+
+    def load(self, path: str, chunks: List[Union[str, Chunk]] = None):
+        """
+        Loads a ranker saved with `save`.
+
+        :param path: The directory
+        :type path: str
+        :param chunks: The chunks the ranker was saved with, e.g. as `Chunk` objects, defaults to None - the saved texts
+        :type chunks: list[Union[str, Chunk]], optional
+        """
+        with open(os.path.join(path, "ranker.json"), "r") as f:
+            saved = json.load(f)
+        if saved["class"] != self.__class__.__name__:
+            raise ValueError(f"{path} holds a {saved['class']}, not a {self.__class__.__name__}")
+
+        if chunks is None:
+            with open(os.path.join(path, "chunks.json"), "r") as f:
+                chunks = json.load(f)
+        if self.fingerprint(chunks) != saved["fingerprint"]:
+            raise ValueError(f"{path} was saved by a different configuration of {self.name} or with different chunks")
+
+        self.chunks = chunks
+        self.load_state(path)
+
+    def save_state(self, path: str):
+        """
+        Saves whatever the ranker computes in `init_chunks`. Nothing by default.
+
+        :param path: The directory
+        :type path: str
+        """
+        pass
+
+    def load_state(self, path: str):
+        """
+        Restores what `save_state` saved, once `self.chunks` is set. Calls `init_chunks` by default.
+
+        :param path: The directory
+        :type path: str
+        """
+        self.init_chunks(self.chunks)
+
+    def init_chunks_cached(self, chunks: List[Union[str, Chunk]], cache_dir: str):
+        """
+        Initialises the ranker with a list of chunks, loading it from a cache directory if it was saved there before,
+        and saving it there otherwise.
+
+        :param chunks: The chunks
+        :type chunks: list[Union[str, Chunk]]
+        :param cache_dir: The directory holding one saved ranker per fingerprint
+        :type cache_dir: str
+        """
+        path = os.path.join(cache_dir, self.fingerprint(chunks))
+        if os.path.exists(os.path.join(path, "ranker.json")):
+            self.load(path, chunks)
+        else:
+            self.init_chunks(chunks)
+            self.save(path)
+
+    def score(self, query: str) -> np.ndarray:
+        """
+        Scores every chunk based on a query.
+
+        The default implementation looks up the similarities returned by `rank`. Rankers that score all chunks at once
+        override it instead, and `rank` is then built on it. Every ranker overrides at least one of the two.
+        :param query: The query
+        :type query: str
+
+        :return: The score of each chunk, aligned with self.chunks
+        """
+        positions = {}
+        for i, chunk in enumerate(self.chunks):
+            positions.setdefault(chunk, []).append(i)
+        scores = np.full(len(self.chunks), np.nan)
+        for chunk, similarity in self.rank(query, return_similarities=True):
+            scores[positions[chunk].pop(0)] = similarity
+        # chunks left out of the ranking score lowest
+        return np.where(np.isnan(scores), np.nanmin(scores) if len(scores) and not np.isnan(scores).all() else 0, scores)
+
     def rank(self, query: str, return_similarities: bool = False) -> Union[List[str], List[Tuple[str, float]]]:
         """
         Ranks the chunks based on a query.
+
+        The default implementation sorts the chunks by `score`.
         :param query: The query
         :type query: str
         :param return_similarities: Whether to return the distances/similarities, defaults to False
@@ -38,7 +323,42 @@ class Ranker(ABC):
 
         :return: The top-k chunks ordered by relevance (descending)
         """
-        raise NotImplementedError
+        scores = self.score(query)
+        if return_similarities:
+            return [(self.chunks[i], scores[i]) for i in np.argsort(-scores, kind="stable")]
+        return [self.chunks[i] for i in top_k_indices(scores, self.top_k)]
+
+    def variants(self) -> List[str]:
+        """
+        Names the rankings the ranker produces for every query, one by default.
+
+        Rankers sweeping a parameter (e.g. `HybridRanker` with a list of weights) produce one ranking per value from
+        the same scores, named like the ranker configured with only that value.
+        :return: The names of the rankings
+        """
+        return [self.name]
+
+    def score_variants(self, query: str) -> Dict[str, np.ndarray]:
+        """
+        Scores every chunk for each of the `variants`.
+        :param query: The query
+        :type query: str
+
+        :return: The scores of each variant, by name
+        """
+        return {self.name: self.score(query)}
+
+    def rank_variants(self, query: str, return_similarities: bool = False) -> Dict[str, Union[List[str], List[Tuple[str, float]]]]:
+        """
+        Ranks the chunks for each of the `variants`.
+        :param query: The query
+        :type query: str
+        :param return_similarities: Whether to return the distances/similarities, defaults to False
+        :type return_similarities: bool, optional
+
+        :return: The ranking of each variant, by name
+        """
+        return {self.name: self.rank(query, return_similarities)}
 
     @abstractmethod
     def batch_rank(self, queries: List[str], batch_size: int = 100) -> List[List[str]]:
@@ -0,0 +1,77 @@
+import time
+
+import numpy as np
+
+from data.QAsperDocument import QAsperDocument, qasper_top_200
+from data.NewsQaDocument import NewsQaDocument, newsqa_top_300
+from retrieval.Chunker.CharChunker import CharChunker
+from retrieval.Ranker.EmbeddingCache import EmbeddingCache
+from retrieval.Ranker.QuantizedSentEmbeddingRanker import QuantizedSentEmbeddingRanker
+from retrieval.Ranker.SentEmbeddingRanker import SentEmbeddingRanker
+
+# Compares approximate FAISS indexes of SentEmbeddingRanker with the exact Flat index on a corpus of chunks:
+# the recall of the top-k chunks, and the search latency per query. Embeddings are computed once and shared
+# through an EmbeddingCache, so only building and searching the indexes is compared.
+# Quantized rankers additionally report the bytes their stored embeddings take up, against float32 vectors.
+
+top_k = 5
+repeats = 3
+
+chunker = CharChunker(chunk_length=500, sliding_window_size=0.5)
+cache = EmbeddingCache()
+
+datasets = {
+    "qasper": [QAsperDocument(story_id=story_id) for story_id in qasper_top_200],
+    "newsqa": [NewsQaDocument(story_id=story_id) for story_id in newsqa_top_300],
+}
+
+configurations = [
+    {"index_factory": "Flat"},
+    {"index_factory": "IVF256,Flat", "nprobe": 1},
+    {"index_factory": "IVF256,Flat", "nprobe": 8},
+    {"index_factory": "IVF256,Flat", "nprobe": 32},
+    {"index_factory": "IVF256,PQ16", "nprobe": 8},
+    {"index_factory": "IVF256,PQ16", "nprobe": 32},
+    {"index_factory": "HNSW32", "ef_search": 16},
+    {"index_factory": "HNSW32", "ef_search": 64},
+    {"quantization": "int8"},
+    {"quantization": "binary", "rescore": False},
+    {"quantization": "binary", "rescore_depth": 20},
+    {"quantization": "binary", "rescore_depth": 100},
+]
+
+for dataset_name, documents in datasets.items():
+    chunks = [chunk for document in documents for chunk in chunker.chunk(document.document)]
+    questions = [question["question"] for document in documents for question in document.questions]
+    print(f"{dataset_name}: {len(chunks)} chunks, {len(questions)} questions")
+
+    exact = None
+    for configuration in configurations:
+        if "quantization" in configuration:
+            ranker = QuantizedSentEmbeddingRanker(top_k=top_k, cache=cache, **configuration)
+        else:
+            ranker = SentEmbeddingRanker(top_k=top_k, cache=cache, **configuration)
+
+        start_time = time.perf_counter()
+        ranker.init_chunks(chunks)
+        build_time = time.perf_counter() - start_time
+
+        query_arr = ranker.encode(questions)
+        times = []
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            _, indices = ranker.search(query_arr, top_k)
+            times.append(time.perf_counter() - start_time)
+
+        if exact is None:
+            exact = indices
+        recall = np.mean([len(set(found) & set(expected)) / top_k for found, expected in zip(indices, exact)])
+
+        notes = ""
+        if ranker.flat_fallback:
+            # too few chunks to train the index, so its results are exact
+            notes += ", fell back to Flat"
+        if isinstance(ranker, QuantizedSentEmbeddingRanker):
+            notes += f", {ranker.memory_usage() / (query_arr.shape[1] * 4 * len(chunks)):.3f}x float32 memory"
+        print(f"  {ranker.name}: recall@{top_k} {recall:.3f}, "
+              f"{min(times) / len(questions) * 1000:.3f} ms/query, build {build_time:.2f}s{notes}")
@@ -0,0 +1,44 @@
+import time
+
+import numpy as np
+
+from retrieval.Ranker.BM25Ranker import BM25Ranker
+
+# Times BM25Ranker.rank with and without MaxScore pruning on synthetic chunks whose words follow a Zipf distribution,
+# for long-tail queries: a rare word or two next to common ones, whose postings span most chunks.
+
+top_k = 5
+repeats = 3
+num_of_words = 50000
+chunk_length = 50
+
+rng = np.random.default_rng(0)
+# words of letters only, which the preprocessor keeps
+words = np.array(["".join(chr(97 + i // 26 ** j % 26) for j in range(4)) + "x" for i in range(num_of_words)])
+frequencies = 1 / np.arange(1, num_of_words + 1)
+frequencies /= frequencies.sum()
+
+
+def best_time(function, queries):
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        for query in queries:
+            function(query)
+        times.append(time.perf_counter() - start_time)
+    return min(times) / len(queries)
+
+
+for num_of_chunks in (10000, 100000):
+    chunks = [" ".join(words[rng.choice(num_of_words, chunk_length, p=frequencies)]) for _ in range(num_of_chunks)]
+    queries = [" ".join(np.concatenate((words[rng.integers(0, 10, 3)], words[rng.integers(1000, num_of_words, 2)])))
+               for _ in range(100)]
+
+    ranker, pruned = BM25Ranker(top_k), BM25Ranker(top_k, pruning=True)
+    ranker.init_chunks(chunks)
+    pruned.init_chunks(chunks)
+    assert all(pruned.rank(query) == ranker.rank(query) for query in queries)
+
+    full, maxscore = best_time(ranker.rank, queries), best_time(pruned.rank, queries)
+    print(f"{num_of_chunks} chunks: rank {full * 1000:.3f} ms/query, pruned {maxscore * 1000:.3f} ms/query "
+          f"({full / maxscore:.1f}x)")
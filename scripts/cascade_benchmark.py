@@ -0,0 +1,55 @@
+import time
+
+import numpy as np
+
+from data.QAsperDocument import QAsperDocument, qasper_top_200
+from retrieval.Chunker.CharChunker import CharChunker
+from retrieval.Ranker.CascadeRanker import CascadeRanker
+from retrieval.Ranker.CrossEncodingRanker import CrossEncodingRanker
+from retrieval.Ranker.SentEmbeddingRanker import SentEmbeddingRanker
+from retrieval.Ranker.TfidfRanker import TfidfRanker
+
+# Compares CascadeRanker, which cross-encodes only a shortlist of a cheap first ranker, with cross-encoding every chunk:
+# the recall of the top-k chunks of full cross-encoding, and the latency per question.
+
+top_k = 5
+num_of_documents = 20
+
+chunker = CharChunker(chunk_length=500, sliding_window_size=0.5)
+cross_encoder = CrossEncodingRanker(top_k=top_k)
+documents = [QAsperDocument(story_id=story_id) for story_id in qasper_top_200[:num_of_documents]]
+
+rankers = [
+    CascadeRanker(top_k=top_k, first=TfidfRanker(top_k=top_k), second=cross_encoder, depth=depth)
+    for depth in (10, 20, 50)
+] + [
+    CascadeRanker(top_k=top_k, first=SentEmbeddingRanker(top_k=top_k), second=cross_encoder, depth=depth)
+    for depth in (10, 20, 50)
+]
+
+times = {ranker.name: 0.0 for ranker in [cross_encoder] + rankers}
+recalls = {ranker.name: [] for ranker in rankers}
+num_of_chunks, num_of_questions = 0, 0
+
+for document in documents:
+    chunks = chunker.chunk(document.document)
+    questions = [question["question"] for question in document.questions]
+    num_of_chunks += len(chunks)
+    num_of_questions += len(questions)
+
+    cross_encoder.init_chunks(chunks)
+    start_time = time.perf_counter()
+    expected = [cross_encoder.rank(question) for question in questions]
+    times[cross_encoder.name] += time.perf_counter() - start_time
+
+    for ranker in rankers:
+        ranker.init_chunks(chunks)
+        start_time = time.perf_counter()
+        found = [ranker.rank(question) for question in questions]
+        times[ranker.name] += time.perf_counter() - start_time
+        recalls[ranker.name].extend(len(set(f) & set(e)) / len(e) for f, e in zip(found, expected) if e)
+
+print(f"{num_of_documents} documents, {num_of_chunks} chunks, {num_of_questions} questions")
+for name, total in times.items():
+    recall = f"recall@{top_k} {np.mean(recalls[name]):.3f}, " if name in recalls else ""
+    print(f"  {name}: {recall}{total / num_of_questions * 1000:.1f} ms/question")
@@ -0,0 +1,53 @@
+import time
+import tracemalloc
+
+from data.UXDocument import UXDocument, chapters
+from data.QAsperDocument import QAsperDocument, qasper_top_200
+from data.NewsQaDocument import NewsQaDocument, newsqa_top_300
+from retrieval.Chunker.TokenizationCache import TokenizationCache
+from retrieval.Chunker.WordChunker import WordChunker
+from retrieval.Chunker.WordSplitter import RegexWordSplitter
+
+# Compares WordChunker with nltk.word_tokenize against the span-slicing regex word splitter:
+# the time to chunk every document with a fresh tokenization cache, and the peak memory allocated while doing so.
+
+repeats = 3
+chunk_length = 100
+sliding_window_size = 0.5
+
+datasets = {
+    "ux": [UXDocument(chapter=chapter).document for chapter in chapters],
+    "qasper": [QAsperDocument(story_id=story_id).document for story_id in qasper_top_200[:50]],
+    "newsqa": [NewsQaDocument(story_id=story_id).document for story_id in newsqa_top_300[:100]],
+}
+
+chunkers = {
+    "nltk": lambda: WordChunker(chunk_length, sliding_window_size, cache=TokenizationCache()),
+    "regex": lambda: WordChunker(chunk_length, sliding_window_size, cache=TokenizationCache(),
+                                 splitter=RegexWordSplitter()),
+}
+
+
+def run(make_chunker, documents):
+    chunker = make_chunker()
+    return sum(len(chunker.chunk(document)) for document in documents)
+
+
+for dataset_name, documents in datasets.items():
+    num_of_words = sum(len(document.split()) for document in documents)
+    print(f"{dataset_name}: {len(documents)} documents, ~{num_of_words} words")
+    for chunker_name, make_chunker in chunkers.items():
+        times = []
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            num_of_chunks = run(make_chunker, documents)
+            times.append(time.perf_counter() - start_time)
+
+        tracemalloc.start()
+        run(make_chunker, documents)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        best = min(times)
+        print(f"  {chunker_name}: {best:.3f}s, {num_of_words / best:,.0f} words/s, "
+              f"{num_of_chunks} chunks, peak memory {peak / 2 ** 20:.1f} MiB")
@@ -0,0 +1,71 @@
+import time
+
+import numpy as np
+
+from data.NewsQaDocument import NewsQaDocument, newsqa_top_300
+from data.QAsperDocument import QAsperDocument, qasper_top_200
+from retrieval.Chunker.CharChunker import CharChunker
+from retrieval.Ranker.CrossEncodingRanker import CrossEncodingRanker
+from retrieval.Ranker.HybridRanker import HybridRanker
+from retrieval.Ranker.TfidfRanker import TfidfRanker
+
+# Compares gated HybridRankers, which spare the cross-encoder when the TF-IDF scores are decisive, with the ungated one,
+# on NewsQA and QAsper: the fraction of questions gated, the latency per question, the recall of the top-k chunks of the
+# ungated ranker, and the scoring seconds saved. The saving is measured against the ungated ranker on the same questions,
+# next to the estimate the gated ranker reports from the cross-encoder's seconds per chunk.
+
+top_k = 5
+num_of_documents = 20
+
+chunker = CharChunker(chunk_length=500, sliding_window_size=0.5)
+sparse, dense = TfidfRanker(top_k=top_k), CrossEncodingRanker(top_k=top_k)
+datasets = {
+    "NewsQA": [NewsQaDocument(story_id=story_id) for story_id in newsqa_top_300[:num_of_documents]],
+    "QAsper": [QAsperDocument(story_id=story_id) for story_id in qasper_top_200[:num_of_documents]],
+}
+
+ungated = HybridRanker(top_k=top_k, sparse=sparse, dense=dense)
+rankers = [
+    HybridRanker(top_k=top_k, sparse=sparse, dense=dense, gate="margin", gate_threshold=threshold, gate_action=action)
+    for threshold in (0.2, 0.4, 0.6) for action in ("skip", "shortlist")
+] + [
+    HybridRanker(top_k=top_k, sparse=sparse, dense=dense, gate="entropy", gate_threshold=threshold, gate_action=action)
+    for threshold in (0.7, 0.8, 0.9) for action in ("skip", "shortlist")
+]
+
+for dataset, documents in datasets.items():
+    times = {ranker.name: 0.0 for ranker in [ungated] + rankers}
+    recalls = {ranker.name: [] for ranker in rankers}
+    gated = {ranker.name: 0.0 for ranker in rankers}
+    estimated = {ranker.name: 0.0 for ranker in rankers}
+    num_of_chunks, num_of_questions = 0, 0
+
+    for document in documents:
+        chunks = chunker.chunk(document.document)
+        questions = [question["question"] for question in document.questions]
+        num_of_chunks += len(chunks)
+        num_of_questions += len(questions)
+
+        ungated.init_chunks(chunks)
+        start_time = time.perf_counter()
+        expected = [ungated.rank(question) for question in questions]
+        times[ungated.name] += time.perf_counter() - start_time
+
+        for ranker in rankers:
+            ranker.init_chunks(chunks)
+            start_time = time.perf_counter()
+            found = [ranker.rank(question) for question in questions]
+            times[ranker.name] += time.perf_counter() - start_time
+            recalls[ranker.name].extend(len(set(f) & set(e)) / len(e) for f, e in zip(found, expected) if e)
+            stats = ranker.pop_stats()
+            gated[ranker.name] += stats["Gated fraction"] * len(questions)
+            estimated[ranker.name] += stats["Estimated scoring seconds saved"]
+
+    print(f"{dataset}: {len(documents)} documents, {num_of_chunks} chunks, {num_of_questions} questions")
+    print(f"  {ungated.name}: {times[ungated.name] / num_of_questions * 1000:.1f} ms/question")
+    for ranker in rankers:
+        saved = times[ungated.name] - times[ranker.name]
+        print(f"  {ranker.name}: {times[ranker.name] / num_of_questions * 1000:.1f} ms/question, "
+              f"recall@{top_k} {np.mean(recalls[ranker.name]):.3f}, gated {gated[ranker.name] / num_of_questions:.2%}, "
+              f"saved {saved:.1f} s ({saved / num_of_questions * 1000:.1f} ms/question), "
+              f"estimated {estimated[ranker.name]:.1f} s ({estimated[ranker.name] / num_of_questions * 1000:.1f} ms/question)")
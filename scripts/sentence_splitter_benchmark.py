@@ -0,0 +1,51 @@
+import time
+
+import nltk
+
+from data.UXDocument import UXDocument, chapters
+from data.QAsperDocument import QAsperDocument, qasper_top_200
+from retrieval.Chunker import align_spans
+from retrieval.Chunker.SentenceSplitter import RegexSentenceSplitter
+
+# Compares the regex sentence splitter used by SentChunker(splitter=RegexSentenceSplitter()) with nltk punkt:
+# the time to split every document, and how many of punkt's sentence boundaries the regex splitter agrees with.
+
+repeats = 3
+
+datasets = {
+    "ux": [UXDocument(chapter=chapter).document for chapter in chapters],
+    "qasper": [QAsperDocument(story_id=story_id).document for story_id in qasper_top_200[:50]],
+}
+
+splitter = RegexSentenceSplitter()
+
+
+def best_time(function, documents):
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        for document in documents:
+            function(document)
+        times.append(time.perf_counter() - start_time)
+    return min(times)
+
+
+for dataset_name, documents in datasets.items():
+    punkt_time = best_time(nltk.sent_tokenize, documents)
+    regex_time = best_time(splitter.span_tokenize, documents)
+
+    agreed, punkt_boundaries, regex_boundaries = 0, 0, 0
+    for document in documents:
+        punkt_ends = {end for _, end in align_spans(nltk.sent_tokenize(document), document)}
+        regex_ends = {end for _, end in splitter.span_tokenize(document)}
+        agreed += len(punkt_ends & regex_ends)
+        punkt_boundaries += len(punkt_ends)
+        regex_boundaries += len(regex_ends)
+
+    precision = agreed / regex_boundaries if regex_boundaries else 0
+    recall = agreed / punkt_boundaries if punkt_boundaries else 0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0
+
+    print(f"{dataset_name}: {len(documents)} documents, {sum(len(document) for document in documents)} characters")
+    print(f"  punkt: {punkt_time:.3f}s, regex: {regex_time:.3f}s, speedup: {punkt_time / regex_time:.1f}x")
+    print(f"  boundary agreement with punkt: precision {precision:.3f}, recall {recall:.3f}, f1 {f1:.3f}")
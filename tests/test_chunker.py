@@ -1,7 +1,16 @@
+import io
+
+import nltk
 import pytest
-from retrieval.Chunker import Chunker
+from retrieval.Chunker import Chunker, Chunk
 from retrieval.Chunker.CharChunker import CharChunker
-from retrieval.Chunker.SentChunker import SentChunker
+from retrieval.Chunker.SectionChunker import SectionChunker
+from retrieval.Chunker.SentChunker import SentChunker, iter_sentences
+from retrieval.Chunker.SentenceSplitter import RegexSentenceSplitter
+from retrieval.Chunker.TokenChunker import TokenChunker
+from retrieval.Chunker.TokenizationCache import TokenizationCache
+from retrieval.Chunker.WordChunker import WordChunker
+from retrieval.Chunker.WordSplitter import RegexWordSplitter
 
 
 def test_chunker_init():
@@ -52,3 +61,151 @@ def test_sent_chunker_chunk():
     assert chunks == ['Aa. Bb. Cc.', 'Cc. dd. Ee.', 'Ee. ff. Gg.', 'Gg. Hh.'], f"window size 0.5"
 
 
+def test_char_chunker_iter_chunks():
+    c = CharChunker(3, 0.5)
+    document = 'abcdefgh'
+    assert list(c.iter_chunks(document)) == c.chunk(document)
+    assert list(c.iter_chunks(io.StringIO(document))) == c.chunk(document)
+    assert list(c.iter_chunks(io.BytesIO(document.encode()))) == c.chunk(document)
+
+    assert list(c.iter_chunks('ab')) == ['ab']
+
+
+def test_sent_chunker_iter_chunks():
+    document = 'Aa. Bb. Cc. dd. Ee. ff. Gg. Hh.'
+
+    c = SentChunker(3, 0.5)
+    assert list(c.iter_chunks(io.StringIO(document))) == c.chunk(document)
+
+
+def test_iter_sentences_unpunctuated(monkeypatch):
+    # a long document without sentence boundaries, streamed in blocks
+    words = [f'word{i % 100}' for i in range(20000)]
+    document = ' '.join(words)
+    blocks = [document[i:i + 1000] for i in range(0, len(document), 1000)]
+
+    tokenized = []
+    sent_tokenize = nltk.sent_tokenize
+    monkeypatch.setattr(nltk, 'sent_tokenize', lambda text: tokenized.append(len(text)) or sent_tokenize(text))
+    sentences = list(iter_sentences(blocks, max_length=4000))
+
+    assert ' '.join(sentences).split() == words
+    assert max(len(sentence) for sentence in sentences) <= 5000
+    # every block is tokenized a bounded number of times, not once per following block
+    assert sum(tokenized) <= 12 * len(document)
+
+
+def test_char_chunker_chunk_objects():
+    c = CharChunker(3, 0.5)
+    document = 'abcdefgh'
+    chunks = c.chunk_objects(document, doc_id='doc')
+
+    assert [str(chunk) for chunk in chunks] == c.chunk(document)
+    assert [(chunk.start, chunk.end) for chunk in chunks] == [(0, 3), (2, 5), (4, 7), (6, 8)]
+    assert 'cd' in chunks[1]
+
+
+def test_chunk_identity():
+    document = 'abcdefgh'
+    a = Chunk(document, 0, 3, doc_id='doc')
+    b = Chunk(document, 2, 5, doc_id='doc')
+
+    assert a == Chunk(document, 0, 3, doc_id='doc')
+    assert a != Chunk(document, 0, 3, doc_id='other')
+    assert len({a, b, Chunk(document, 0, 3, doc_id='doc')}) == 2
+    assert a.overlaps(b)
+    assert not a.overlaps(Chunk(document, 3, 5, doc_id='doc'))
+    assert Chunk(document, 1, 2, doc_id='doc') in a
+
+
+def test_tokenization_cache(tmpdir):
+    calls = []
+
+    def tokenize(document):
+        calls.append(document)
+        return document.split()
+
+    cache = TokenizationCache(max_size=1, path=str(tmpdir))
+    assert cache.get('a b c', 'split', tokenize) == ['a', 'b', 'c']
+    assert cache.get('a b c', 'split', tokenize) == ['a', 'b', 'c']
+    assert len(calls) == 1
+
+    # evicted from memory, but still on disk
+    cache.get('d e', 'split', tokenize)
+    assert cache.get('a b c', 'split', tokenize) == ['a', 'b', 'c']
+    assert len(calls) == 2
+    assert cache.hits == 2 and cache.misses == 2
+
+
+def test_chunker_chunk_many():
+    c = CharChunker(3, 0.5)
+    documents = ['abcdefgh', 'ab', 'abcdef'] * 4
+
+    assert c.chunk_many(documents, workers=2) == [c.chunk(document) for document in documents]
+    assert c.chunk_many(documents, spans=True) == [c.chunk_spans(document) for document in documents]
+
+
+def test_chunker_chunk_many_cache():
+    cache = TokenizationCache()
+    documents = ['One. Two. Three.', 'Four. Five.', 'Six. Seven. Eight. Nine.'] * 2
+    c = SentChunker(2, 0.5, cache=cache)
+    assert c.chunk_many(documents, workers=2) == [SentChunker(2, 0.5, cache=TokenizationCache()).chunk(document) for document in documents]
+
+    # the tokenizations made by the workers are merged into the cache of this process, and sent back to the workers
+    assert all(cache.entries(document) for document in documents)
+    c = SentChunker(3, cache=cache)
+    assert c.chunk_many(documents, workers=2, spans=True) == [c.chunk_spans(document) for document in documents]
+    assert cache.misses == 0
+
+
+class WhitespaceTokenizer:
+    def __call__(self, texts, add_special_tokens=False):
+        return {'input_ids': [text.split() for text in texts]}
+
+
+def test_token_chunker_chunk():
+    c = TokenChunker(4, 0.5, tokenizer=WhitespaceTokenizer())
+    assert c.name == 'TokenChunker_4_0.5'
+
+    document = 'One two. Three four five. Six. Seven eight nine ten eleven. End.'
+    assert c.chunk(document) == [
+        'One two.',
+        'Three four five. Six.',
+        'Six. Seven eight nine',
+        'eight nine ten eleven.',
+        'ten eleven. End.'
+    ]
+
+
+def test_section_chunker_chunk_sections():
+    c = SectionChunker(CharChunker(3, 0.0))
+    assert c.name == 'SectionCharChunker_3_0.0'
+
+    chunks, sections = c.chunk_sections({'Intro': 'abcdefgh', 'Method': 'ij'})
+    assert chunks == ['abc', 'def', 'gh', 'ij']
+    assert sections == {'Intro': [0, 1, 2], 'Method': [3]}
+
+
+def test_regex_sentence_splitter():
+    splitter = RegexSentenceSplitter()
+    document = 'Mr. Smith left.  He said "Hi!" It cost 3.5 dollars.\n\nNew paragraph'
+
+    assert splitter.tokenize(document) == ['Mr. Smith left.', 'He said "Hi!"', 'It cost 3.5 dollars.', 'New paragraph']
+
+
+def test_sent_chunker_splitter_chunk():
+    document = 'Aa. Bb.  Cc. Dd.'
+
+    c = SentChunker(2, 0.5, splitter=RegexSentenceSplitter())
+    assert c.name == 'SentChunker_2_0.5_regex'
+    assert c.chunk(document) == ['Aa. Bb.', 'Bb.  Cc.', 'Cc. Dd.', 'Dd.']
+
+
+def test_word_chunker_splitter_chunk():
+    document = "It's 3.5  dollars, isn't it?"
+
+    c = WordChunker(2, 0.5, splitter=RegexWordSplitter(), cache=TokenizationCache())
+    assert c.name == 'WordChunker_2_0.5_regex'
+    assert c.words(document) == ['It', "'s", '3.5', 'dollars', ',', 'isn', "'t", 'it', '?']
+    assert c.chunk(document) == ["It's", "'s 3.5", '3.5  dollars', 'dollars,', ', isn', "isn't", "'t it", 'it?', '?']
+    assert c.chunk('') == ['']
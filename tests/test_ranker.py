@@ -1,8 +1,26 @@
+import threading
+from types import SimpleNamespace
+
+import faiss
+import numpy as np
 import pytest
+import torch
 from sklearn.feature_extraction.text import TfidfVectorizer
+from transformers import BertTokenizer, BertTokenizerFast
 
-from retrieval.Ranker import Ranker
+from retrieval.Ranker import Ranker, RandomRanker, top_k_indices
+from retrieval.Chunker.SentChunker import SentChunker
+from retrieval.Chunker.SentenceSplitter import RegexSentenceSplitter
 from retrieval.Ranker.TfidfRanker import TfidfRanker  # replace with your actual module name
+from retrieval.Ranker.EmbeddingCache import EmbeddingCache
+from retrieval.Ranker.Preprocessor import Preprocessor
+from retrieval.Ranker.BM25Ranker import BM25Ranker
+from retrieval.Ranker.CascadeRanker import CascadeRanker
+from retrieval.Ranker.CrossEncodingRanker import CrossEncodingRanker, truncate_longest_first
+from retrieval.Ranker.HybridRanker import HybridRanker, fuse
+from retrieval.Ranker.QuantizedSentEmbeddingRanker import QuantizedSentEmbeddingRanker
+from retrieval.Ranker.SentEmbeddingRanker import SentEmbeddingRanker
+from retrieval.Ranker.SentenceWindowRanker import SentenceWindowRanker, aggregate_windows
 
 
 def test_ranker_init():
@@ -30,3 +48,671 @@ def test_tfidf_ranker_rank():
     r = TfidfRanker(5)
     r.init_chunks(['A bit more complex chunk', 'Once again, a chunk', 'A chunk'])
     assert r.rank('A chunk') == ['A chunk', 'Once again, a chunk', 'A bit more complex chunk']
+
+
+def test_aggregate_windows():
+    scores = np.array([1.0, 5.0, 2.0, 0.0, 3.0])
+    starts, ends = np.array([0, 2, 4]), np.array([3, 5, 5])
+
+    assert aggregate_windows(scores, starts, ends, "max").tolist() == [5.0, 3.0, 3.0]
+    assert aggregate_windows(scores, starts, ends, "sum").tolist() == [8.0, 5.0, 3.0]
+    assert aggregate_windows(scores, starts, ends, "mean").tolist() == [8.0 / 3, 5.0 / 3, 3.0]
+
+    # windows of different lengths, the shorter ones before the longer ones
+    scores, starts, ends = np.array([1.0, 5.0, 2.0, 3.0]), np.array([0, 2]), np.array([1, 4])
+    assert aggregate_windows(scores, starts, ends, "max").tolist() == [1.0, 3.0]
+    assert aggregate_windows(scores, np.array([0, 1, 0]), np.array([1, 3, 4]), "max").tolist() == [1.0, 5.0, 5.0]
+    assert aggregate_windows(scores, np.array([0, 1, 0]), np.array([1, 3, 4]), "sum").tolist() == [1.0, 7.0, 11.0]
+
+
+def test_sentence_window_ranker_rank():
+    document = 'The cat sat. A dog barked. The cat slept. Birds sang.'
+    r = SentenceWindowRanker(1, ranker=TfidfRanker(5))
+
+    r.init_document(document, SentChunker(2, 0.5))
+    assert r.rank('dog') == ['The cat sat. A dog barked.']
+
+    # the sentences are scored once and reused by other chunk lengths
+    r.init_document(document, SentChunker(3, 0.0))
+    assert len(r.sentence_scores) == 1
+    assert r.rank('dog') == ['The cat sat. A dog barked. The cat slept.']
+
+
+def test_tfidf_ranker_sentence_windows():
+    document = 'The cat sat. A dog barked. The cat slept. Birds sang. The dog slept.'
+    chunker = SentChunker(2, 0.5)
+
+    r = TfidfRanker(5, sentence_windows=True)
+    r.init_document(document, chunker)
+
+    expected = TfidfRanker(5)
+    expected.init_chunks(chunker.chunk(document))
+
+    assert r.chunks == expected.chunks
+    assert np.allclose(r.vectors.toarray(), expected.vectors.toarray())
+    assert r.rank('dog slept') == expected.rank('dog slept')
+
+
+def test_sentence_index_per_splitter():
+    # punkt does not split at the blank line, the regex splitter does
+    document = 'The cat sat\n\nA dog barked. The cat slept. Birds sang.'
+    punkt, regex = SentChunker(1), SentChunker(1, splitter=RegexSentenceSplitter())
+    assert len(punkt.sentences(document)) != len(regex.sentences(document))
+
+    for r in [SentenceWindowRanker(1, ranker=TfidfRanker(5)), TfidfRanker(1, sentence_windows=True)]:
+        for chunker in [punkt, regex, punkt]:
+            r.init_document(document, chunker)
+            assert r.chunks == chunker.chunk(document)
+            assert r.rank('dog') == [chunk for chunk in chunker.chunk(document) if 'dog' in chunk]
+
+
+def test_top_k_indices():
+    scores = np.array([0.1, 0.9, 0.5, 0.9, 0.0])
+    assert top_k_indices(scores, 3).tolist() == [1, 3, 2]
+    assert top_k_indices(scores, 10).tolist() == [1, 3, 2, 0, 4]
+    # ties at the k-th score are taken by index
+    assert top_k_indices(np.array([0.0, 1.0, 0.0, 0.0]), 2).tolist() == [1, 0]
+
+
+@pytest.mark.parametrize('fast', [True, False])
+def test_truncate_longest_first(tmpdir, fast):
+    vocabulary = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + [f'w{i}' for i in range(60)]
+    tmpdir.join('vocab.txt').write('\n'.join(vocabulary))
+    tokenizer = (BertTokenizerFast if fast else BertTokenizer)(str(tmpdir.join('vocab.txt')))
+
+    for query_length, chunk_length, max_length in [(3, 3, 8), (10, 4, 8), (4, 10, 8), (5, 6, 10), (6, 5, 10), (20, 3, 10), (7, 8, 9), (2, 2, 10)]:
+        query, chunk = list(range(5, 5 + query_length)), list(range(30, 30 + chunk_length))
+        expected = tokenizer(' '.join(vocabulary[i] for i in query), ' '.join(vocabulary[i] for i in chunk),
+                             truncation='longest_first', max_length=max_length)['input_ids']
+        truncated = truncate_longest_first(query, chunk, max_length - tokenizer.num_special_tokens_to_add(pair=True), fast)
+        assert tokenizer.build_inputs_with_special_tokens(*truncated) == expected
+
+
+class StubCrossEncoderModel(torch.nn.Module):
+    # scores a pair by the number of chunk tokens that occur in the query, preferring shorter chunks
+    def __init__(self):
+        super().__init__()
+        self.weight = torch.nn.Parameter(torch.zeros(1))
+
+    def forward(self, input_ids, attention_mask, token_type_ids, return_dict=True):
+        query = (token_type_ids == 0) & (attention_mask == 1)
+        chunk = (token_type_ids == 1) & (attention_mask == 1)
+        matches = (input_ids[:, :, None] == input_ids[:, None, :]) & chunk[:, :, None] & query[:, None, :]
+        scores = matches.any(dim=2).sum(dim=1) - 0.01 * chunk.sum(dim=1)
+        return SimpleNamespace(logits=scores.float()[:, None] + self.weight)
+
+
+def test_cross_encoding_ranker_batch_rank(tmpdir, monkeypatch):
+    vocabulary = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + [f'w{i}' for i in range(20)]
+    tmpdir.join('vocab.txt').write('\n'.join(vocabulary))
+    model = SimpleNamespace(tokenizer=BertTokenizerFast(str(tmpdir.join('vocab.txt'))), model=StubCrossEncoderModel(),
+                            max_length=16, activation_fn=lambda logits: logits)
+    monkeypatch.setattr('retrieval.Ranker.CrossEncodingRanker.CrossEncoder', lambda *args, **kwargs: model)
+
+    rng = np.random.default_rng(0)
+    chunks = [' '.join(f'w{i}' for i in rng.integers(0, 20, rng.integers(2, 12))) for _ in range(9)]
+    queries = ['w1 w2 w3', 'w4', 'w5 w6 w7 w8 w9 w10', 'w11 w12']
+    r = CrossEncodingRanker(3, batch_size=4)
+    r.init_chunks(chunks)
+    assert r.batch_rank(queries) == [r.rank(query) for query in queries]
+    assert r.batch_rank(queries, batch_size=5) == [r.rank(query) for query in queries]
+    # the rankings differ between queries, so pairs attributed to the wrong query would show
+    assert len({tuple(ranking) for ranking in r.batch_rank(queries)}) > 1
+
+
+def test_fuse():
+    chunks = ['a', 'b', 'c', 'd']
+    scores = np.array([[0.0, 2.0, 1.0, 4.0], [10.0, 30.0, 20.0, 20.0]])
+
+    # min-max fusion gives the scores of the list-based fusion HybridRanker used before
+    normalised = [{chunk: (score - min(row)) / (max(row) - min(row)) for chunk, score in zip(chunks, row)} for row in scores]
+    expected = [0.3 * normalised[0][chunk] + 0.7 * normalised[1][chunk] for chunk in chunks]
+    assert np.allclose(fuse(scores, [0.3, 0.7]), expected)
+
+    standardised = (scores - scores.mean(axis=1, keepdims=True)) / scores.std(axis=1, keepdims=True)
+    assert np.allclose(fuse(scores, [0.3, 0.7], 'zscore'), 0.3 * standardised[0] + 0.7 * standardised[1])
+    # ranks are 1-based, and ties are ranked by position
+    assert np.allclose(fuse(scores, [1, 1], 'rrf', rrf_k=0), [1 / 4 + 1 / 4, 1 / 2 + 1, 1 / 3 + 1 / 2, 1 + 1 / 3])
+    assert np.allclose(fuse(scores, [1, 2], 'weighted'), scores[0] + 2 * scores[1])
+
+    # rankers scoring every chunk the same contribute nothing
+    constant = np.array([[1.0, 1.0, 1.0], [0.0, 1.0, 2.0]])
+    assert np.allclose(fuse(constant, [0.5, 0.5]), [0.0, 0.25, 0.5])
+    assert np.allclose(fuse(constant, [0.5, 0.5], 'zscore'), 0.5 * (constant[1] - 1) / constant[1].std())
+
+    # a row of weights per variant
+    assert fuse(scores, [[0.3, 0.7], [1.0, 0.0]]).shape == (2, 4)
+    assert fuse(np.zeros((2, 0)), [[0.5, 0.5]]).shape == (1, 0)
+    with pytest.raises(ValueError):
+        fuse(scores, [0.5, 0.5], 'max')
+
+
+def test_hybrid_ranker_name():
+    sparse, dense = TfidfRanker(5), BM25Ranker(5)
+    assert HybridRanker(2, sparse=sparse, dense=dense).name == f'HybridRanker_2_{sparse.name}_{dense.name}_0.5'
+    assert HybridRanker(2, rankers=[sparse, dense], weights=[0.25, 0.75], fusion='rrf').name == f'HybridRanker_2_{sparse.name}_{dense.name}_0.25_0.75_rrf'
+    assert HybridRanker(2, sparse=sparse, dense=dense, sparse_weight=[0.2, 0.8]).name == f'HybridRanker_2_{sparse.name}_{dense.name}_0.2-0.8'
+
+
+def test_hybrid_ranker_sweep():
+    chunks = ['The cat sat on the mat', 'A dog barked at the cat', 'Birds sang in the trees', 'The dog slept']
+    sparse, dense = TfidfRanker(5), BM25Ranker(5)
+    sweeps = [
+        ({'sparse': sparse, 'dense': dense}, 'sparse_weight', [0.2, 0.5, 1.0]),
+        ({'rankers': [sparse, dense]}, 'weights', [[0.25, 0.75], [0.6, 0.4]]),
+    ]
+    for components, parameter, values in sweeps:
+        swept = HybridRanker(2, **components, **{parameter: values})
+        singles = [HybridRanker(2, **components, **{parameter: value}) for value in values]
+        swept.init_chunks(chunks)
+        for single in singles:
+            single.init_chunks(chunks)
+
+        # each variant is scored and named like the ranker with only its weight
+        assert swept.variants() == [single.name for single in singles]
+        variant_scores = swept.score_variants('the dog')
+        assert list(variant_scores) == [single.name for single in singles]
+        for single in singles:
+            assert np.allclose(variant_scores[single.name], single.score('the dog'))
+        rankings = swept.rank_variants('the dog')
+        assert all(rankings[single.name] == single.rank('the dog') for single in singles)
+        assert np.allclose(swept.score('the dog'), singles[0].score('the dog'))
+
+    # fusing several rankers for several weights gives a (variants x chunks) array
+    scores = np.array([[0.0, 2.0, 1.0], [3.0, 1.0, 2.0], [1.0, 1.0, 4.0]])
+    weights = np.array([[1.0, 0.0, 0.0], [0.2, 0.3, 0.5], [0.0, 0.5, 0.5]])
+    fused = fuse(scores, weights)
+    assert fused.shape == (3, 3)
+    for row, weight in zip(fused, weights):
+        assert np.allclose(row, fuse(scores, weight))
+
+
+class StubRanker(Ranker):
+    # scores the chunks with fixed scores per query, and records the chunks it scored
+    def __init__(self, top_k, scores, name=None):
+        super().__init__(top_k, name)
+        self.scores = {query: np.array(query_scores, dtype=float) for query, query_scores in scores.items()}
+        self.scored = []
+
+    def init_chunks(self, chunks):
+        self.chunks = chunks
+
+    def batch_rank(self, queries, batch_size=100):
+        return [self.rank(query) for query in queries]
+
+    def score(self, query):
+        self.scored.append(list(self.chunks))
+        return self.scores[query]
+
+
+class StubShortlistRanker(StubRanker):
+    def score_chunks(self, query, chunks):
+        self.scored.append(list(chunks))
+        return self.scores[query][[self.chunks.index(chunk) for chunk in chunks]]
+
+
+def test_hybrid_ranker_decisive():
+    margin = HybridRanker(2, sparse=StubRanker(2, {}), dense=StubRanker(2, {}), gate='margin', gate_threshold=0.5)
+    assert margin.decisive(np.array([0.0, 0.5, 1.0]))
+    assert not margin.decisive(np.array([0.0, 0.6, 1.0]))
+    assert not margin.decisive(np.array([2.0, 2.0, 2.0]))
+    assert margin.decisive(np.array([2.0]))
+
+    # the entropy of two equally likely chunks out of three is log(2) / log(3)
+    threshold = np.log(2) / np.log(3)
+    entropy = HybridRanker(2, sparse=StubRanker(2, {}), dense=StubRanker(2, {}), gate='entropy', gate_threshold=threshold)
+    assert entropy.decisive(np.array([0.0, 1.0, 1.0]))
+    entropy.gate_threshold = np.nextafter(threshold, 0)
+    assert not entropy.decisive(np.array([0.0, 1.0, 1.0]))
+    assert entropy.decisive(np.array([0.0, 0.0, 1.0]))
+    assert not entropy.decisive(np.array([2.0, 2.0, 2.0]))
+
+
+def test_hybrid_ranker_gate():
+    chunks = ['a', 'b', 'c', 'd', 'e']
+    sparse_scores = {'decisive': [0.0, 0.0, 1.0, 0.0, 0.1], 'open': [0.5, 0.4, 0.6, 0.55, 0.45]}
+    dense_scores = {'decisive': [1.0, 0.0, 0.0, 0.0, 0.5], 'open': [1.0, 0.0, 0.0, 0.0, 0.5]}
+
+    # skipped questions are ranked by the first ranker alone
+    dense = StubRanker(2, dense_scores)
+    r = HybridRanker(2, sparse=StubRanker(2, sparse_scores), dense=dense, gate='margin', gate_threshold=0.5)
+    r.init_chunks(chunks)
+    assert r.rank('decisive') == ['c', 'e']
+    assert dense.scored == []
+    # without a measured cost of the dense ranker, no saving is estimated
+    assert r.pop_stats()['Estimated scoring seconds saved'] == 0.0
+
+    assert np.allclose(r.score('open'), fuse(np.array([sparse_scores['open'], dense_scores['open']]), [0.5, 0.5]))
+    assert r.rank('decisive') == ['c', 'e']
+    assert dense.scored == [chunks]
+    stats = r.pop_stats()
+    assert stats['Gated fraction'] == 0.5
+    assert stats['Estimated scoring seconds saved'] > 0
+    assert stats['Estimated scoring seconds saved per question'] == stats['Estimated scoring seconds saved'] / 2
+
+    # shortlisted questions are scored by the other rankers on the best chunks of the first, and the rest get their lowest score
+    dense = StubShortlistRanker(2, dense_scores)
+    r = HybridRanker(2, sparse=StubRanker(2, sparse_scores), dense=dense, gate='margin', gate_threshold=0.5,
+                     gate_action='shortlist', gate_depth=2)
+    r.init_chunks(chunks)
+    expected = fuse(np.array([sparse_scores['decisive'], [0.0, 0.0, 0.0, 0.0, 0.5]]), [0.5, 0.5])
+    assert np.allclose(r.score('decisive'), expected)
+    assert dense.scored == [['c', 'e']]
+    assert r.pop_stats()['Gated fraction'] == 1.0
+
+    # rankers without score_chunks score every chunk
+    dense = StubRanker(2, dense_scores)
+    r = HybridRanker(2, sparse=StubRanker(2, sparse_scores), dense=dense, gate='margin', gate_threshold=0.5,
+                     gate_action='shortlist', gate_depth=2)
+    r.init_chunks(chunks)
+    assert np.allclose(r.score('decisive'), fuse(np.array([sparse_scores['decisive'], dense_scores['decisive']]), [0.5, 0.5]))
+    assert dense.scored == [chunks]
+
+
+def test_cascade_ranker():
+    chunks = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']
+    # the first ranker orders the chunks b, e, g, c, h, d, f, a
+    first_scores = {'q': [0.1, 0.9, 0.5, 0.3, 0.8, 0.2, 0.7, 0.4]}
+    second_scores = {'q': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0]}
+
+    second = StubShortlistRanker(2, second_scores)
+    r = CascadeRanker(2, first=StubRanker(2, first_scores), second=second, depth=3)
+    r.init_chunks(chunks)
+    assert r.rank('q') == ['g', 'e']
+    assert second.scored == [['b', 'e', 'g']]
+
+    # every chunk is returned, and the chunks below the shortlist keep the first ranker's order below the lowest candidate
+    similarities = r.rank('q', return_similarities=True)
+    assert [chunk for chunk, _ in similarities] == ['g', 'e', 'b', 'c', 'h', 'd', 'f', 'a']
+    assert max(similarity for _, similarity in similarities[3:]) < 2.0
+
+    # the shortlist holds at least top_k chunks
+    second = StubShortlistRanker(2, second_scores)
+    r = CascadeRanker(2, first=StubRanker(2, first_scores), second=second, depth=1)
+    r.init_chunks(chunks)
+    assert r.rank('q') == ['e', 'b']
+    assert second.scored == [['b', 'e']]
+
+    # a shortlist deeper than the chunks rescores them all
+    r = CascadeRanker(2, first=StubRanker(2, first_scores), second=StubShortlistRanker(2, second_scores), depth=10)
+    r.init_chunks(chunks)
+    assert np.allclose(r.score('q'), second_scores['q'])
+    assert [chunk for chunk, _ in r.rank('q', return_similarities=True)] == chunks[::-1]
+
+
+def test_ranker_requires_score_or_rank():
+    class Unranked(Ranker):
+        def init_chunks(self, chunks):
+            self.chunks = chunks
+
+        def batch_rank(self, queries, batch_size=100):
+            return [self.rank(query) for query in queries]
+
+    with pytest.raises(TypeError):
+        Unranked(2)
+
+
+def test_ranker_score():
+    chunks = ['The cat sat on the mat', 'A dog chased the cat', 'The dog slept', 'Birds sing loudly']
+    r = RandomRanker(2)
+    r.init_chunks(chunks)
+    # the scores are looked up from rank, aligned with the chunks
+    assert sorted(r.score('dog').tolist()) == [0.25, 0.5, 0.75, 1.0]
+
+    bm25 = BM25Ranker(2)
+    bm25.init_chunks(chunks)
+    scores = bm25.score('dog chased')
+    assert scores.shape == (4,)
+    assert bm25.rank('dog chased') == [chunks[i] for i in np.argsort(-scores, kind='stable')[:2]]
+    # a ranker without a sweep is its only variant
+    assert bm25.variants() == [bm25.name]
+    assert bm25.rank_variants('dog chased') == {bm25.name: bm25.rank('dog chased')}
+
+
+def test_bm25_ranker_rank():
+    chunks = ['The cat sat on the mat', 'A dog chased the cat', 'The dog slept', 'Birds sing loudly', 'Cats and dogs play']
+    r = BM25Ranker(2)
+    r.init_chunks(chunks)
+    assert r.name == 'BM25Ranker_2_1.5_0.75'
+    assert r.rank('dog chased') == ['A dog chased the cat', 'The dog slept']
+    assert [chunk for chunk, _ in r.rank('dog chased', return_similarities=True)][:2] == r.rank('dog chased')
+    assert r.batch_rank(['dog chased', 'birds']) == [r.rank('dog chased'), r.rank('birds')]
+
+    pruned = BM25Ranker(2, pruning=True)
+    pruned.init_chunks(chunks)
+    assert pruned.rank('dog chased cat') == r.rank('dog chased cat')
+
+
+def test_bm25_ranker_pruning():
+    # common and rare words, so queries mix long and short postings
+    rng = np.random.default_rng(0)
+    words = np.array([f'word{chr(97 + i // 26)}{chr(97 + i % 26)}' for i in range(200)])
+    frequencies = 1 / np.arange(1, 201)
+    chunks = [' '.join(rng.choice(words, 12, p=frequencies / frequencies.sum())) for _ in range(500)]
+    queries = [' '.join(rng.choice(words, 4)) for _ in range(50)] + ['wordaa wordab', 'unknown', '']
+    for top_k in (1, 5, 600):
+        r, pruned = BM25Ranker(top_k), BM25Ranker(top_k, pruning=True)
+        r.init_chunks(chunks)
+        pruned.init_chunks(chunks)
+        for query in queries:
+            assert pruned.rank(query) == r.rank(query)
+            # the scores of the chunks that can be in the top-k are exact
+            candidates, scores = pruned.score_pruned(query)
+            assert np.allclose(scores, r.score(query)[candidates])
+
+
+def test_preprocessor_preprocess_many():
+    p = Preprocessor()
+    texts = ['The cats kept running!', 'Dogs run 3 times.', 'The cats kept running!']
+    assert p.preprocess_many(texts) == ['cat kept run', 'dog run time', 'cat kept run']
+    assert (p.hits, p.misses) == (0, 2)
+    assert p.preprocess_chunk('Dogs run 3 times.') == 'dog run time'
+    assert p.hits == 1
+    assert Preprocessor().preprocess_many(texts, workers=2) == ['cat kept run', 'dog run time', 'cat kept run']
+
+
+def test_ranker_init_chunks_cached(tmpdir):
+    chunks = ['The cat sat on the mat', 'A dog chased the cat', 'The dog slept', 'Birds sing loudly']
+    for make_ranker in [lambda: TfidfRanker(2), lambda: BM25Ranker(2)]:
+        r = make_ranker()
+        r.init_chunks_cached(chunks, str(tmpdir))
+        path = tmpdir.join(r.fingerprint(chunks))
+        assert path.join('ranker.json').check()
+
+        loaded = make_ranker()
+        loaded.load(str(path))
+        assert loaded.chunks == chunks
+        assert loaded.rank('dog chased') == r.rank('dog chased')
+
+    with pytest.raises(ValueError):
+        TfidfRanker(2).load(str(tmpdir.join(BM25Ranker(2).fingerprint(chunks))))
+    with pytest.raises(ValueError):
+        BM25Ranker(2).load(str(tmpdir.join(BM25Ranker(2).fingerprint(chunks))), chunks=chunks[:2])
+
+    # a custom name does not hide the configuration
+    assert BM25Ranker(2, name='bm25', k1=1.2).fingerprint(chunks) == BM25Ranker(2, name='other', k1=1.2).fingerprint(chunks)
+    assert BM25Ranker(2, name='bm25', k1=1.2).fingerprint(chunks) != BM25Ranker(2, name='bm25', k1=2.0).fingerprint(chunks)
+    assert (HybridRanker(2, name='hybrid', sparse=BM25Ranker(2, k1=1.2), dense=TfidfRanker(2)).fingerprint(chunks)
+            != HybridRanker(2, name='hybrid', sparse=BM25Ranker(2, k1=2.0), dense=TfidfRanker(2)).fingerprint(chunks))
+    with pytest.raises(ValueError):
+        BM25Ranker(2, name='BM25Ranker_2', k1=2.0).load(str(tmpdir.join(BM25Ranker(2).fingerprint(chunks))))
+
+
+def test_tfidf_ranker_init_corpus():
+    r = TfidfRanker(2)
+    r.init_corpus({'a': ['The cat sat on the mat', 'A dog chased the cat'], 'b': ['The dog slept', 'Birds sing loudly', 'A dog barked']})
+    assert r.rank('dog', doc_id='a') == ['A dog chased the cat', 'The cat sat on the mat']
+    assert r.rank('dog', doc_id='b')[0] in ['The dog slept', 'A dog barked']
+    assert len(r.rank('dog', return_similarities=True)) == 3
+
+    r.select_document('a')
+    assert r.batch_rank(['birds']) == [r.rank('birds')]
+
+
+def test_tfidf_ranker_add_remove_chunks():
+    chunks = ['The cat sat on the mat', 'A dog chased the cat', 'The dog slept']
+    r = TfidfRanker(2)
+    r.init_chunks(chunks[:2])
+    r.add_chunks(chunks[2:] + ['Birds sing loudly'])
+    r.remove_chunks(['Birds sing loudly'])
+
+    refit = TfidfRanker(2)
+    refit.init_chunks(chunks)
+    assert r.chunks == chunks
+    assert r.rank('dog slept') == refit.rank('dog slept')
+    assert 'bird' not in r.counter.vocabulary_
+
+
+def test_embedding_cache_get(tmpdir):
+    encoded = []
+
+    def encode(texts):
+        encoded.extend(texts)
+        return np.array([[len(text), 1.0] for text in texts])
+
+    cache = EmbeddingCache(path=str(tmpdir))
+    assert cache.get('model', ['a', 'bb', 'a'], encode).tolist() == [[1, 1], [2, 1], [1, 1]]
+    assert cache.get('model', ['bb', 'ccc'], encode).tolist() == [[2, 1], [3, 1]]
+    assert encoded == ['a', 'bb', 'ccc']
+    assert (cache.hits, cache.misses, cache.bytes_saved) == (2, 3, 16)
+
+    # a new cache reads the embeddings back from disk
+    assert EmbeddingCache(path=str(tmpdir)).get('model', ['ccc', 'a'], encode).tolist() == [[3, 1], [1, 1]]
+    assert encoded == ['a', 'bb', 'ccc']
+
+
+def test_embedding_cache_get_concurrent():
+    # both threads must be encoding at once to pass the barrier, so encoding cannot hold the cache's lock
+    barrier = threading.Barrier(2, timeout=5)
+
+    def encode(texts):
+        barrier.wait()
+        return np.array([[len(text), 1.0] for text in texts])
+
+    cache = EmbeddingCache()
+    results = {}
+
+    def get(texts):
+        results[tuple(texts)] = cache.get('model', texts, encode, return_counts=True)
+
+    threads = [threading.Thread(target=get, args=(texts,)) for texts in (['a', 'bb'], ['bb', 'ccc'])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    embeddings, hits, misses = results[('a', 'bb')]
+    assert embeddings.tolist() == [[1, 1], [2, 1]] and (hits, misses) == (0, 2)
+    embeddings, hits, misses = results[('bb', 'ccc')]
+    assert embeddings.tolist() == [[2, 1], [3, 1]] and (hits, misses) == (0, 2)
+    # the text encoded by both threads is only appended once
+    assert len(cache._rows['model']) == 3
+    assert cache.get('model', ['ccc', 'a', 'bb'], encode, return_counts=True)[1:] == (3, 0)
+
+
+def test_hybrid_ranker_workers():
+    chunks = ['The cat sat on the mat', 'A dog barked at the cat', 'Birds sang in the trees', 'The dog slept']
+    sequential = HybridRanker(2, sparse=TfidfRanker(5), dense=BM25Ranker(5), sparse_weight=[0.3, 0.7])
+    concurrent = HybridRanker(2, sparse=TfidfRanker(5), dense=BM25Ranker(5), sparse_weight=[0.3, 0.7], workers=2)
+    sequential.init_chunks(chunks)
+    concurrent.init_chunks(chunks)
+
+    for query in ('the dog', 'birds', 'cat on a mat'):
+        assert concurrent.rank_variants(query) == sequential.rank_variants(query)
+        assert np.allclose(concurrent.score(query), sequential.score(query))
+    stats = concurrent.pop_stats()
+    assert all(f"Scoring seconds ({ranker.name})" in stats for ranker in concurrent.rankers)
+
+
+class StubEncoder:
+    # encodes texts with fixed vectors, and records the texts it encoded
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.encoded = []
+
+    def encode(self, texts):
+        self.encoded.extend(texts)
+        return np.array([self.vectors[text] for text in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def encoder(monkeypatch):
+    # 200 random unit vectors, and a query for each of them clearly closest to it and then to the next two
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((200, 256)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = vectors + 0.7 * np.roll(vectors, -1, axis=0) + 0.5 * np.roll(vectors, -2, axis=0)
+    encoder = StubEncoder({**{f'chunk {i}': vector for i, vector in enumerate(vectors)},
+                           **{f'query {i}': query for i, query in enumerate(queries)}})
+    monkeypatch.setattr('retrieval.Ranker.SentEmbeddingRanker.SentenceTransformer', lambda *args, **kwargs: encoder)
+    return encoder
+
+
+def test_quantized_sent_embedding_ranker_rank(encoder):
+    chunks = [f'chunk {i}' for i in range(200)]
+    queries = [f'query {i}' for i in range(0, 200, 10)]
+    exact = SentEmbeddingRanker(3)
+    exact.init_chunks(chunks)
+    expected = exact.batch_rank(queries)
+    assert expected == [[f'chunk {(i + j) % 200}' for j in range(3)] for i in range(0, 200, 10)]
+
+    int8 = QuantizedSentEmbeddingRanker(3)
+    rescored = QuantizedSentEmbeddingRanker(3, quantization='binary', rescore_depth=20, block_size=7, query_block_size=3)
+    binary = QuantizedSentEmbeddingRanker(3, quantization='binary', rescore=False)
+    for r in (int8, rescored, binary):
+        r.init_chunks(chunks)
+    assert int8.batch_rank(queries) == expected
+    assert rescored.batch_rank(queries) == expected
+    assert [rescored.rank(query) for query in queries] == expected
+    # signs alone only find the closest chunk reliably
+    assert [ranking[0] for ranking in binary.batch_rank(queries)] == [ranking[0] for ranking in expected]
+
+
+def test_quantized_sent_embedding_ranker_hamming_shortlist(encoder):
+    chunks = [f'chunk {i}' for i in range(200)]
+    r = QuantizedSentEmbeddingRanker(3, quantization='binary', block_size=7, query_block_size=3)
+    r.init_chunks(chunks)
+    query_codes = np.packbits(r.encode([f'query {i}' for i in range(10)]) > r.center, axis=1)
+    brute_force = np.unpackbits(r.binary_codes[None, :, :] ^ query_codes[:, None, :], axis=2).sum(axis=2)
+
+    # a shortlist deeper than the chunks holds every chunk, by distance and then position
+    distances, positions = r.hamming_shortlist(query_codes, 500)
+    assert positions.shape == (10, 200)
+    assert (positions == np.argsort(brute_force, axis=1, kind='stable')).all()
+    assert (distances == np.sort(brute_force, axis=1)).all()
+    distances, positions = r.hamming_shortlist(query_codes, 5)
+    assert (positions == np.argsort(brute_force, axis=1, kind='stable')[:, :5]).all()
+
+    # deeper than the chunks, every chunk is rescored, so the similarities are those of the int8 codes
+    r.rescore_depth = 500
+    similarities = r.rank('query 0', return_similarities=True)
+    assert len(similarities) == 200
+    decoded = r.codes * r.step + r.minimum
+    assert np.allclose([similarity for _, similarity in similarities], np.sort(decoded @ r.encode(['query 0'])[0])[::-1], atol=1e-5)
+
+
+def test_quantized_sent_embedding_ranker_memory_usage(encoder):
+    chunks = [f'chunk {i}' for i in range(200)]
+    float32 = 200 * 256 * 4
+    for kwargs, ratio in (({}, 4), ({'quantization': 'binary', 'rescore': False}, 32), ({'quantization': 'binary'}, 32 / 9)):
+        r = QuantizedSentEmbeddingRanker(3, **kwargs)
+        r.init_chunks(chunks)
+        assert float32 / r.memory_usage() == pytest.approx(ratio)
+
+
+def test_quantized_sent_embedding_ranker_select_document(encoder):
+    documents = {'a': [f'chunk {i}' for i in range(100)], 'b': [f'chunk {i}' for i in range(100, 200)]}
+    for rescore in (True, False):
+        r = QuantizedSentEmbeddingRanker(3, quantization='binary', rescore=rescore)
+        r.init_corpus(documents)
+        assert r.rank('query 150', doc_id='b')[0] == 'chunk 150'
+        assert set(r.rank('query 150')) <= set(documents['b'])
+        assert r.rank('query 50', doc_id='a')[0] == 'chunk 50'
+        assert set(r.rank('query 150', doc_id='a')) <= set(documents['a'])
+        assert len(r.score('query 150')) == 100
+
+
+def test_hybrid_ranker_nested_workers():
+    chunks = ['The cat sat on the mat', 'A dog barked at the cat', 'Birds sang in the trees', 'The dog slept']
+
+    def nested(workers):
+        inner = [HybridRanker(2, sparse=TfidfRanker(5), dense=BM25Ranker(5), workers=workers) for _ in range(2)]
+        return HybridRanker(2, rankers=inner, workers=workers)
+
+    sequential, concurrent = nested(None), nested(2)
+    sequential.init_chunks(chunks)
+    results = {}
+
+    def rank():
+        # the inner rankers share the outer ranker's pool, whose threads all run outer tasks
+        concurrent.init_chunks(chunks)
+        results['concurrent'] = [concurrent.rank(query) for query in ('the dog', 'birds')]
+
+    thread = threading.Thread(target=rank, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive(), "nested hybrid rankers deadlocked on the shared pool"
+    assert results['concurrent'] == [sequential.rank(query) for query in ('the dog', 'birds')]
+
+
+def test_sent_embedding_ranker_index_options(encoder):
+    chunks = [f'chunk {i}' for i in range(200)]
+    queries = [f'query {i}' for i in range(0, 200, 10)]
+    exact = SentEmbeddingRanker(3)
+    exact.init_chunks(chunks)
+    expected = exact.batch_rank(queries)
+
+    ivf = SentEmbeddingRanker(3, index_factory='IVF4,Flat', nprobe=2)
+    ivf.init_chunks(chunks)
+    assert faiss.downcast_index(ivf.index).nprobe == 2
+    assert not ivf.flat_fallback
+    recall = np.mean([len(set(found) & set(e)) / 3 for found, e in zip(ivf.batch_rank(queries), expected)])
+    assert recall >= 0.8
+    ivf.nprobe = 4
+    ivf.init_chunks(chunks)
+    assert ivf.batch_rank(queries) == expected
+
+    hnsw = SentEmbeddingRanker(3, index_factory='HNSW16', ef_search=48)
+    hnsw.init_chunks(chunks)
+    assert faiss.downcast_index(hnsw.index).hnsw.efSearch == 48
+    assert hnsw.batch_rank(queries) == expected
+
+    # too few chunks to train 256 centroids
+    fallback = SentEmbeddingRanker(3, index_factory='IVF256,Flat', nprobe=8)
+    with pytest.warns(UserWarning, match='falls back to an exact Flat index'):
+        fallback.init_chunks(chunks)
+    assert fallback.flat_fallback
+    assert fallback.batch_rank(queries) == expected
+    assert fallback.pop_stats()['Flat index fallbacks'] == 1
+    assert fallback.pop_stats()['Flat index fallbacks'] == 0
+
+
+def test_sent_embedding_ranker_search_depth(encoder):
+    chunks = [f'chunk {i}' for i in range(200)]
+    exact = SentEmbeddingRanker(3)
+    shallow = SentEmbeddingRanker(3, search_depth=5)
+    exact.init_chunks(chunks)
+    shallow.init_chunks(chunks)
+
+    # the chunks beyond the search depth get the lowest similarity found, so every chunk is still ranked
+    exact_similarities = exact.rank('query 0', return_similarities=True)
+    similarities = shallow.rank('query 0', return_similarities=True)
+    assert len(similarities) == 200
+    # the fifth chunk found ties with the chunks that were not
+    assert [chunk for chunk, _ in similarities[:4]] == [chunk for chunk, _ in exact_similarities[:4]]
+    assert np.allclose([similarity for _, similarity in similarities[:5]], [similarity for _, similarity in exact_similarities[:5]])
+    assert all(similarity == similarities[4][1] for _, similarity in similarities[5:])
+    assert shallow.rank('query 0') == exact.rank('query 0')
+
+
+def test_sent_embedding_ranker_select_document(encoder):
+    documents = {'a': [f'chunk {i}' for i in range(100)], 'b': [f'chunk {i}' for i in range(100, 200)]}
+    for kwargs in ({}, {'index_factory': 'IVF4,Flat', 'nprobe': 4}, {'index_factory': 'HNSW16'}):
+        r = SentEmbeddingRanker(3, **kwargs)
+        r.init_corpus(documents)
+        assert r.rank('query 150', doc_id='b') == ['chunk 150', 'chunk 151', 'chunk 152']
+        assert set(r.rank('query 50', doc_id='b')) <= set(documents['b'])
+        assert r.rank('query 50', doc_id='a') == ['chunk 50', 'chunk 51', 'chunk 52']
+        assert len(r.score('query 150')) == 100
+
+
+def test_sent_embedding_ranker_add_remove_chunks(encoder):
+    chunks = [f'chunk {i}' for i in range(200)]
+    queries = [f'query {i}' for i in range(0, 200, 7)]
+    r = SentEmbeddingRanker(3)
+    r.init_chunks(chunks[:150])
+
+    encoder.encoded.clear()
+    r.add_chunks(chunks[150:])
+    # only the added chunks are encoded
+    assert encoder.encoded == chunks[150:]
+    removed = chunks[::3]
+    r.remove_chunks(removed)
+    r.add_chunks(['chunk 0'])
+
+    fresh = SentEmbeddingRanker(3)
+    fresh.init_chunks([chunk for chunk in chunks if chunk not in removed] + ['chunk 0'])
+    assert r.chunks == fresh.chunks
+    assert r.batch_rank(queries) == fresh.batch_rank(queries)
+    assert [r.rank(query) for query in queries] == fresh.batch_rank(queries)
+    assert np.allclose(r.score('query 1'), fresh.score('query 1'))